@@ -0,0 +1,284 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+"""
+Benchmarks for widget naming and name resolution on synthetic object trees.
+
+Builds trees of configurable depth, fan-out, proportion of unnamed children and 
+proportion of duplicate names, and times:
+
+- get_fully_qualified_name (with a cold and a warm name cache)
+- get_named_object (with a cold and a warm name index)
+- assign_unique_child_index (for every child of one wide parent)
+- EventRecordingApp.notify (for user, mouse and key events sent to objects in the tree)
+
+The "cold" benchmarks restore the tree's original names and discard all name caches and 
+indexes before every repeat, so every repeat pays for naming the tree from scratch.
+
+Results are written as JSON.  Pass --baseline to compare against a previous run;
+any benchmark that got slower than the allowed ratio is reported, and the exit code is nonzero.
+
+Usage:
+
+    $ PYTHONPATH=.. python naming_benchmark.py --sizes 100 1000 10000 --output results.json
+    $ PYTHONPATH=.. python naming_benchmark.py --sizes 100 1000 10000 --baseline results.json
+
+This needs a display.  On a headless machine, use a virtual one, e.g. xvfb-run.
+"""
+
+import sys
+import json
+import math
+import random
+import argparse
+import platform
+from timeit import default_timer as _clock
+
+from PyQt4.QtCore import Qt, QObject, QEvent, QPoint, QT_VERSION_STR
+from PyQt4.QtGui import QApplication, QWidget, QMouseEvent, QKeyEvent
+
+from eventcapture.eventRecordingApp import EventRecordingApp
+import eventcapture.objectNameUtils as objectNameUtils
+from eventcapture.objectNameUtils import get_fully_qualified_name, get_named_object, assign_unique_child_index, \
+                                         remove_unique_child_index
+
+# The tree is made of plain QObjects (below a single visible top-level widget), 
+#  so that large trees can be built quickly.  Two node types, so default names use more than one class.
+class BenchNode(QObject):
+    pass
+
+class BenchLeaf(QObject):
+    pass
+
+class SyntheticTree(object):
+    """
+    A tree of about ``size`` objects, with the given depth.
+    unnamed_fraction: The proportion of children that get no name (so they get default names).
+    duplicate_fraction: The proportion of children that share a name with a sibling (so they are renamed).
+    """
+    def __init__(self, size, depth, unnamed_fraction, duplicate_fraction, seed=0):
+        self.size = size
+        self.depth = depth
+        self.fanout = max( 2, int( math.ceil( size ** (1.0 / depth) ) ) )
+        self._rng = random.Random(seed)
+        self._unnamed_fraction = unnamed_fraction
+        self._duplicate_fraction = duplicate_fraction
+        
+        self.root = QWidget()
+        self.root.setObjectName( 'BenchRoot' )
+        self.root.show()
+        self.objects = []
+        self.leaves = []
+        self.original_names = []
+        self._populate( self.root, 1 )
+
+    def _populate(self, parent, level):
+        node_type = BenchLeaf if level == self.depth else BenchNode
+        for i in range(self.fanout):
+            if len(self.objects) >= self.size:
+                return
+            child = node_type(parent)
+            r = self._rng.random()
+            if r < self._unnamed_fraction:
+                pass
+            elif r < self._unnamed_fraction + self._duplicate_fraction:
+                child.setObjectName( 'duplicate' )
+            else:
+                child.setObjectName( 'child{}'.format(i) )
+            self.objects.append(child)
+            self.original_names.append( child.objectName() )
+            if level == self.depth:
+                self.leaves.append(child)
+            else:
+                self._populate( child, level+1 )
+
+    def sample(self, n):
+        return self._rng.sample( self.objects, min(n, len(self.objects)) )
+
+    def destroy(self):
+        self.root.hide()
+        self.root.deleteLater()
+        QApplication.sendPostedEvents( None, QEvent.DeferredDelete )
+        QApplication.processEvents()
+
+def _best_of(repeat, func, setup=None):
+    """
+    Run func (repeat) times, and return the fastest time.
+    If given, setup is called (untimed) before every run.
+    """
+    best = float('inf')
+    for _ in range(repeat):
+        if setup is not None:
+            setup()
+        start = _clock()
+        func()
+        best = min( best, _clock() - start )
+    return best
+
+def _forget_names(tree):
+    """
+    Restore the tree's original names and reset all name caches and indexes, 
+    so the next name lookups start from scratch (including assigning default names).
+    """
+    for obj, name in zip( tree.objects, tree.original_names ):
+        obj.setObjectName( name )
+        remove_unique_child_index( obj )
+    objectNameUtils._qualified_name_cache.clear()
+    objectNameUtils._named_object_index.clear()
+    objectNameUtils._child_name_indexes.clear()
+    objectNameUtils._child_index_allocators.clear()
+
+def run_benchmarks(size, depth, unnamed_fraction, duplicate_fraction, samples, repeat, max_wide_children):
+    app = QApplication.instance()
+    tree = SyntheticTree( size, depth, unnamed_fraction, duplicate_fraction )
+    QApplication.processEvents()
+    results = []
+    def record(name, seconds, ops):
+        results.append( { 'benchmark' : name,
+                          'size' : size,
+                          'depth' : depth,
+                          'fanout' : tree.fanout,
+                          'ops' : ops,
+                          'seconds' : seconds,
+                          'seconds_per_op' : seconds / max(ops, 1) } )
+        sys.stderr.write( "{:>40} size={:<8} {:.3g} s/op\n".format( name, size, seconds / max(ops, 1) ) )
+
+    sample = tree.sample( samples )
+
+    # Naming
+    def name_all_cold():
+        for obj in sample:
+            get_fully_qualified_name(obj)
+    record( 'get_fully_qualified_name', _best_of(repeat, name_all_cold, lambda: _forget_names(tree)), len(sample) )
+
+    _forget_names(tree)
+    names = [ get_fully_qualified_name(obj) for obj in sample ]
+    def name_all_warm():
+        for obj in sample:
+            get_fully_qualified_name(obj)
+    record( 'get_fully_qualified_name_cached', _best_of(repeat, name_all_warm), len(sample) )
+
+    # Name resolution
+    def lookup_all_cold():
+        for name in names:
+            get_named_object(name, timeout=0.0)
+    record( 'get_named_object', _best_of(repeat, lookup_all_cold, lambda: _forget_names(tree)), len(names) )
+
+    def lookup_all_warm():
+        for name in names:
+            get_named_object(name, timeout=0.0)
+    record( 'get_named_object_indexed', _best_of(repeat, lookup_all_warm), len(names) )
+
+    # Child index assignment for one wide parent.
+    wide_parent = BenchNode(tree.root)
+    wide_children = [ BenchLeaf(wide_parent) for _ in range( min(size, max_wide_children) ) ]
+    def assign_all():
+        for child in wide_children:
+            remove_unique_child_index(child)
+        for child in wide_children:
+            assign_unique_child_index(child)
+    record( 'assign_unique_child_index', _best_of(repeat, assign_all), len(wide_children) )
+
+    # Event dispatch overhead, for the kinds of events the app sees most during recording and playback.
+    event_receivers = sample
+    def make_events():
+        return [ ( 'EventRecordingApp.notify', lambda: QEvent(QEvent.User) ),
+                 ( 'EventRecordingApp.notify_mouse_move', 
+                   lambda: QMouseEvent( QEvent.MouseMove, QPoint(1, 1), Qt.NoButton, Qt.NoButton, Qt.NoModifier ) ),
+                 ( 'EventRecordingApp.notify_mouse_press', 
+                   lambda: QMouseEvent( QEvent.MouseButtonPress, QPoint(1, 1), Qt.LeftButton, Qt.LeftButton, Qt.NoModifier ) ),
+                 ( 'EventRecordingApp.notify_key_press', 
+                   lambda: QKeyEvent( QEvent.KeyPress, Qt.Key_A, Qt.NoModifier, 'a' ) ) ]
+    for benchmark_name, make_event in make_events():
+        events = [ make_event() for _ in event_receivers ]
+        def send_events():
+            for receiver, event in zip(event_receivers, events):
+                app.notify( receiver, event )
+        record( benchmark_name, _best_of(repeat, send_events), len(event_receivers) )
+
+    tree.destroy()
+    return results
+
+def compare_to_baseline(results, baseline, max_ratio):
+    """
+    Print a comparison table.  Returns the list of regressions (benchmark, size, ratio).
+    """
+    baseline_results = dict( ( (r['benchmark'], r['size']), r ) for r in baseline['results'] )
+    regressions = []
+    print "{:>40} {:>8} {:>12} {:>12} {:>7}".format( 'benchmark', 'size', 'baseline', 'current', 'ratio' )
+    for r in results:
+        b = baseline_results.get( (r['benchmark'], r['size']) )
+        if b is None:
+            continue
+        ratio = r['seconds_per_op'] / max( b['seconds_per_op'], 1e-12 )
+        flag = ''
+        if ratio > max_ratio:
+            regressions.append( (r['benchmark'], r['size'], ratio) )
+            flag = '  <-- REGRESSION'
+        print "{:>40} {:>8} {:>12.3g} {:>12.3g} {:>7.2f}{}".format( r['benchmark'], r['size'], b['seconds_per_op'], r['seconds_per_op'], ratio, flag )
+    return regressions
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark eventcapture's object naming and name resolution.")
+    parser.add_argument('--sizes', type=int, nargs='+', default=[100, 1000, 10000, 100000], help="Number of objects in each tree")
+    parser.add_argument('--depth', type=int, default=4)
+    parser.add_argument('--unnamed-fraction', type=float, default=0.3)
+    parser.add_argument('--duplicate-fraction', type=float, default=0.05)
+    parser.add_argument('--samples', type=int, default=200, help="Number of objects to name/locate in each tree")
+    parser.add_argument('--repeat', type=int, default=3, help="Each benchmark is repeated this many times (the best time is reported)")
+    parser.add_argument('--max-wide-children', type=int, default=10000, help="Maximum number of children for the wide-parent benchmark")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--baseline', help="Compare the results to this JSON file (from a previous --output)")
+    parser.add_argument('--max-ratio', type=float, default=1.5, help="With --baseline, fail if any benchmark is this many times slower")
+    args = parser.parse_args()
+
+    app = EventRecordingApp([])
+    results = []
+    for size in args.sizes:
+        results += run_benchmarks( size, args.depth, args.unnamed_fraction, args.duplicate_fraction, 
+                                   args.samples, args.repeat, args.max_wide_children )
+
+    report = { 'environment' : { 'python' : platform.python_version(),
+                                 'qt' : QT_VERSION_STR,
+                                 'platform' : platform.platform() },
+               'parameters' : vars(args),
+               'results' : results }
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump( report, f, indent=2, sort_keys=True )
+    else:
+        print json.dumps( report, indent=2, sort_keys=True )
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare_to_baseline( results, baseline, args.max_ratio )
+        if regressions:
+            for benchmark, size, ratio in regressions:
+                sys.stderr.write( "REGRESSION: {} (size {}) is {:.2f}x slower than the baseline\n".format( benchmark, size, ratio ) )
+            sys.exit(1)
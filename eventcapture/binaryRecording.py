@@ -0,0 +1,252 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+import json
+import struct
+
+from eventSerializers import EventKinds, MaxEventArgs, write_playback_script
+
+##
+## Binary recording format
+##
+## Header:  MAGIC, then a varint-prefixed JSON blob of metadata (author_name, start_time)
+## Records: One fixed-width record per event, followed by a varint (zigzag-encoded) timestamp delta in microseconds.
+##          If the timestamp isn't a whole number of microseconds, the exact timestamp follows as a double.
+## Strings: The interned string table (receiver names, key text, comments), each one varint-prefixed UTF-8.
+## Index:   For every INDEX_STRIDE-th record, its file offset and absolute timestamp (for random access).
+## Footer:  Offsets of the string table and index, the record count, and MAGIC again.
+##
+
+MAGIC = 'ECREC\x01'
+INDEX_STRIDE = 256
+
+# kind, flags, event_type, args, text_id, name_id
+_record_struct = struct.Struct( '<BBH{}iii'.format( MaxEventArgs ) )
+_index_struct = struct.Struct( '<Qq' )
+_footer_struct = struct.Struct( '<QQI6s' )
+_exact_timestamp_struct = struct.Struct( '<d' )
+
+_FLAG_HAS_TIMESTAMP = 0x1
+_FLAG_EXACT_TIMESTAMP = 0x2
+
+def _write_varint(fileobj, value):
+    out = []
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append( chr(byte | 0x80) )
+        else:
+            out.append( chr(byte) )
+            break
+    fileobj.write( ''.join(out) )
+
+def _read_varint(data, offset):
+    result = 0
+    shift = 0
+    while True:
+        byte = ord(data[offset])
+        offset += 1
+        result |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return result, offset
+        shift += 7
+
+def _zigzag(n):
+    return (n << 1) if n >= 0 else ((-n << 1) - 1)
+
+def _unzigzag(n):
+    return (n >> 1) if not n & 1 else -((n + 1) >> 1)
+
+def is_binary_recording(path):
+    with open(path, 'rb') as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+def write_binary_recording(fileobj, records, author_name, start_time):
+    """
+    Write the given records (kind, event_type, args, text, objname, timestamp_in_seconds) in the binary format.
+    fileobj must be opened in binary mode, and must be seekable.
+    """
+    fileobj.write(MAGIC)
+    metadata = json.dumps( { 'author_name' : author_name, 'start_time' : str(start_time) } )
+    _write_varint(fileobj, len(metadata))
+    fileobj.write(metadata)
+
+    strings = []
+    string_ids = {}
+    def intern(s):
+        if s is None:
+            return -1
+        try:
+            return string_ids[s]
+        except KeyError:
+            string_ids[s] = len(strings)
+            strings.append(s)
+            return string_ids[s]
+
+    index = []
+    count = 0
+    prev_timestamp_us = 0
+    for kind, event_type, args, text, objname, timestamp_in_seconds in records:
+        if kind == EventKinds.Comment:
+            objname = None
+        if count % INDEX_STRIDE == 0:
+            index.append( (fileobj.tell(), prev_timestamp_us) )
+        flags = 0
+        if timestamp_in_seconds is not None:
+            flags |= _FLAG_HAS_TIMESTAMP
+            timestamp_us = int(round(timestamp_in_seconds * 1e6))
+            # Recorded timestamps are whole microseconds, but don't lose precision if this one isn't.
+            if timestamp_us / 1e6 != timestamp_in_seconds:
+                flags |= _FLAG_EXACT_TIMESTAMP
+        args = tuple(args) + (0,) * (MaxEventArgs - len(args))
+        fileobj.write( _record_struct.pack( kind, flags, event_type, *(args + (intern(text), intern(objname))) ) )
+        if timestamp_in_seconds is not None:
+            _write_varint( fileobj, _zigzag(timestamp_us - prev_timestamp_us) )
+            prev_timestamp_us = timestamp_us
+            if flags & _FLAG_EXACT_TIMESTAMP:
+                fileobj.write( _exact_timestamp_struct.pack( timestamp_in_seconds ) )
+        count += 1
+
+    strings_offset = fileobj.tell()
+    _write_varint(fileobj, len(strings))
+    for s in strings:
+        if isinstance(s, unicode):
+            s = s.encode('utf-8')
+        _write_varint(fileobj, len(s))
+        fileobj.write(s)
+
+    index_offset = fileobj.tell()
+    for entry in index:
+        fileobj.write( _index_struct.pack(*entry) )
+
+    fileobj.write( _footer_struct.pack( strings_offset, index_offset, count, MAGIC ) )
+
+class BinaryRecording(object):
+    """
+    Read access to a recording in the binary format.
+    Supports len(), iteration, and random access by record number.
+    Records have the same form as those of a CapturedEventBuffer:
+    (kind, event_type, args, text, objname, timestamp_in_seconds)
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(path, 'rb') as f:
+            self._data = f.read()
+        data = self._data
+        if not data.startswith(MAGIC) or not data.endswith(MAGIC):
+            raise ValueError("Not a complete eventcapture binary recording: {}".format( path ))
+
+        strings_offset, index_offset, self._count, _ = _footer_struct.unpack_from( data, len(data) - _footer_struct.size )
+
+        metadata_length, offset = _read_varint( data, len(MAGIC) )
+        metadata = json.loads( data[offset:offset+metadata_length] )
+        self.author_name = metadata['author_name'].encode('utf-8')
+        self.start_time = metadata['start_time'].encode('utf-8')
+
+        num_strings, offset = _read_varint( data, strings_offset )
+        self._strings = []
+        for _ in xrange(num_strings):
+            length, offset = _read_varint( data, offset )
+            self._strings.append( data[offset:offset+length] )
+            offset += length
+
+        self._index = []
+        for offset in xrange( index_offset, len(data) - _footer_struct.size, _index_struct.size ):
+            self._index.append( _index_struct.unpack_from( data, offset ) )
+
+    def __len__(self):
+        return self._count
+
+    def _decode(self, offset, prev_timestamp_us):
+        fields = _record_struct.unpack_from( self._data, offset )
+        offset += _record_struct.size
+        kind, flags, event_type = fields[:3]
+        args = fields[3:3+MaxEventArgs]
+        text_id, name_id = fields[3+MaxEventArgs:]
+
+        timestamp = None
+        if flags & _FLAG_HAS_TIMESTAMP:
+            delta, offset = _read_varint( self._data, offset )
+            prev_timestamp_us += _unzigzag(delta)
+            timestamp = prev_timestamp_us / 1e6
+            if flags & _FLAG_EXACT_TIMESTAMP:
+                timestamp, = _exact_timestamp_struct.unpack_from( self._data, offset )
+                offset += _exact_timestamp_struct.size
+
+        text = self._strings[text_id] if text_id != -1 else None
+        objname = self._strings[name_id] if name_id != -1 else "comment"
+        return (kind, event_type, args, text, objname, timestamp), offset, prev_timestamp_us
+
+    def iter_from(self, start):
+        """
+        Iterate over the records, starting at record number ``start``.
+        """
+        if not 0 <= start <= self._count:
+            raise IndexError(start)
+        if start == self._count:
+            return
+        offset, timestamp_us = self._index[start // INDEX_STRIDE]
+        for i in xrange( (start // INDEX_STRIDE) * INDEX_STRIDE, self._count ):
+            record, offset, timestamp_us = self._decode( offset, timestamp_us )
+            if i >= start:
+                yield record
+
+    def __iter__(self):
+        return self.iter_from(0)
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += self._count
+        if not 0 <= i < self._count:
+            raise IndexError("record index out of range: {}".format(i))
+        return next( self.iter_from(i) )
+
+def script_to_binary(script_path, binary_path):
+    from scriptParser import parse_playback_script
+    metadata, records = parse_playback_script(script_path)
+    with open(binary_path, 'wb') as f:
+        write_binary_recording( f, records, metadata['author_name'], metadata['start_time'] )
+
+def binary_to_script(binary_path, script_path):
+    recording = BinaryRecording(binary_path)
+    with open(script_path, 'w') as f:
+        write_playback_script( f, recording.author_name, recording.start_time, recording )
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert an eventcapture recording between the script format and the binary format.")
+    parser.add_argument('input_path')
+    parser.add_argument('output_path')
+    args = parser.parse_args()
+    if is_binary_recording(args.input_path):
+        binary_to_script( args.input_path, args.output_path )
+    else:
+        script_to_binary( args.input_path, args.output_path )
+    sys.exit(0)
@@ -0,0 +1,105 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+import Queue
+
+import logging
+logger = logging.getLogger(__name__)
+
+class CaptureWorker(object):
+    """
+    Moves the storage of captured events off the GUI thread.
+
+    The recorder calls append() from within EventRecordingApp.notify(), on the GUI thread.
+    That just puts the (already primitive) event fields onto a bounded queue.
+    A worker thread pops them and passes them to the sink, which does all of the expensive 
+    work (string interning, mouse-move decimation, log formatting, etc.)
+
+    If the worker falls behind and the queue fills up, then depending on ``drop_on_overflow``
+    the GUI thread either waits for space (backpressure) or drops the event.  
+    Both cases are counted.
+
+    Has the same append()/append_comment() interface as CapturedEventBuffer.
+    """
+    _Comment = object()
+
+    def __init__(self, sink, max_queue_size=10000, drop_on_overflow=False):
+        self._sink = sink
+        self._drop_on_overflow = drop_on_overflow
+        self._queue = Queue.Queue(max_queue_size)
+
+        self.dropped = 0
+        self.blocked = 0
+
+        self._thread = threading.Thread( target=self._run, name="CaptureWorker" )
+        self._thread.daemon = True
+        self._thread.start()
+
+    def append(self, *record):
+        self._put(record)
+
+    def append_comment(self, comment, *args):
+        self._put( (CaptureWorker._Comment, comment) + args )
+
+    def _put(self, item):
+        try:
+            self._queue.put_nowait(item)
+        except Queue.Full:
+            if self._drop_on_overflow:
+                self.dropped += 1
+                return
+            self.blocked += 1
+            self._queue.put(item)
+
+    def flush(self):
+        """
+        Block until the worker has passed every event appended so far to the sink.
+        """
+        self._queue.join()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item[0] is CaptureWorker._Comment:
+                    self._sink.append_comment(*item[1:])
+                else:
+                    self._sink.append(*item)
+            except:
+                logger.error( "Failed to store captured event: {}".format( item ), exc_info=True )
+            finally:
+                self._queue.task_done()
+
+    def __iter__(self):
+        self.flush()
+        return iter(self._sink)
+
+    def __len__(self):
+        self.flush()
+        return len(self._sink)
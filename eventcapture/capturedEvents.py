@@ -0,0 +1,183 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import threading
+from array import array
+
+from eventSerializers import EventKinds, MaxEventArgs
+
+_padding = [ (0,) * n for n in range(MaxEventArgs+1) ]
+
+class CapturedEventBuffer(object):
+    """
+    Compact storage for captured events.
+    
+    Each event is stored as a row in a set of parallel arrays (a 'struct of arrays'), 
+    rather than as a tuple of Python objects.  Receiver names and key text are interned
+    in a string table, so each one is stored only once.
+    
+    Iterating over the buffer yields records of the form:
+    (kind, event_type, args, text, objname, timestamp_in_seconds)
+    which can be passed directly to eventSerializers.write_playback_script()
+    """
+    def __init__(self):
+        self._kinds = array('B')
+        self._event_types = array('i')
+        self._args = array('i')
+        self._text_ids = array('i')
+        self._name_ids = array('i')
+        self._timestamps = array('d')
+        
+        self._strings = []
+        self._string_ids = {}
+
+    def _intern(self, s):
+        if s is None:
+            return -1
+        try:
+            return self._string_ids[s]
+        except KeyError:
+            string_id = len(self._strings)
+            self._strings.append(s)
+            self._string_ids[s] = string_id
+            return string_id
+
+    def append(self, kind, event_type, args, text, objname, timestamp_in_seconds):
+        self._kinds.append(kind)
+        self._event_types.append(event_type)
+        self._args.extend(args)
+        self._args.extend(_padding[MaxEventArgs - len(args)])
+        self._text_ids.append(self._intern(text))
+        self._name_ids.append(self._intern(objname))
+        self._timestamps.append(timestamp_in_seconds)
+
+    def append_comment(self, comment, timestamp_in_seconds=float('nan')):
+        self.append(EventKinds.Comment, 0, (), comment, None, timestamp_in_seconds)
+
+    def __len__(self):
+        return len(self._kinds)
+
+    def _physical_index(self, i):
+        return i
+
+    def __getitem__(self, i):
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError(i)
+        i = self._physical_index(i)
+        text_id = self._text_ids[i]
+        name_id = self._name_ids[i]
+        kind = self._kinds[i]
+        timestamp = self._timestamps[i]
+        if kind == EventKinds.Comment:
+            timestamp = None
+        return ( kind,
+                 self._event_types[i],
+                 tuple(self._args[i*MaxEventArgs:(i+1)*MaxEventArgs]),
+                 self._strings[text_id] if text_id != -1 else None,
+                 self._strings[name_id] if name_id != -1 else "comment",
+                 timestamp )
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def clear(self):
+        self.__init__()
+
+class EventRingBuffer(CapturedEventBuffer):
+    """
+    A fixed-capacity CapturedEventBuffer that keeps only the most recent events.
+    
+    All arrays are allocated up front, and appending overwrites the oldest row in place,
+    so appending is O(1) and the memory usage is bounded.
+    (The string table is not bounded, but it only grows when a new receiver name or key text is seen.)
+
+    If max_age is provided, iteration skips events older than max_age seconds (relative to the newest event).
+
+    Appending and iterating may happen in different threads (e.g. a capture worker and a dump request),
+    so iteration works on a snapshot that is taken while holding the buffer's lock.
+    """
+    def __init__(self, capacity, max_age=None):
+        CapturedEventBuffer.__init__(self)
+        self.capacity = capacity
+        self.max_age = max_age
+        self._kinds = array('B', [0]) * capacity
+        self._event_types = array('i', [0]) * capacity
+        self._args = array('i', [0]) * (capacity * MaxEventArgs)
+        self._text_ids = array('i', [0]) * capacity
+        self._name_ids = array('i', [0]) * capacity
+        self._timestamps = array('d', [0.0]) * capacity
+        self._appended = 0
+        self._lock = threading.Lock()
+
+    def append(self, kind, event_type, args, text, objname, timestamp_in_seconds):
+        with self._lock:
+            self._append(kind, event_type, args, text, objname, timestamp_in_seconds)
+
+    def _append(self, kind, event_type, args, text, objname, timestamp_in_seconds):
+        i = self._appended % self.capacity
+        self._kinds[i] = kind
+        self._event_types[i] = event_type
+        row = i * MaxEventArgs
+        for a in args:
+            self._args[row] = a
+            row += 1
+        for row in xrange(row, (i+1) * MaxEventArgs):
+            self._args[row] = 0
+        self._text_ids[i] = self._intern(text)
+        self._name_ids[i] = self._intern(objname)
+        self._timestamps[i] = timestamp_in_seconds
+        self._appended += 1
+
+    def __len__(self):
+        return min(self._appended, self.capacity)
+
+    def _physical_index(self, i):
+        oldest = max(0, self._appended - self.capacity)
+        return (oldest + i) % self.capacity
+
+    def __iter__(self):
+        with self._lock:
+            records = [ self[i] for i in xrange(len(self)) ]
+        n = len(records)
+        first = 0
+        if self.max_age is not None:
+            # Find the newest timestamp (comments don't have one)
+            newest = None
+            for i in xrange(n-1, -1, -1):
+                timestamp = records[i][5]
+                if timestamp is not None:
+                    newest = timestamp
+                    break
+            if newest is not None:
+                cutoff = newest - self.max_age
+                while first < n and (records[first][5] is None or records[first][5] < cutoff):
+                    first += 1
+        return iter(records[first:])
@@ -26,25 +26,61 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-import gc
+import sys
+import time
 import threading
+from timeit import default_timer as _clock
 
-from PyQt4.QtCore import QObject, QEvent, QTimer
-from PyQt4.QtGui import QApplication, QCursor
+from PyQt4.QtCore import QObject, QEvent, QAbstractEventDispatcher
+from PyQt4.QtGui import QApplication, QCursor, QMouseEvent
 
 from timer import Timer
 from objectNameUtils import get_named_object, NamedObjectNotFoundError
+from gcPolicy import default_collection_policy
+from eventSerializers import EventKinds, event_from_fields
+from scriptParser import ScriptParseError
+from playbackPlan import load_playback_plan, PlaybackPlanError
+from instrumentation import LatencyHistogram
+from mainThreadExecutor import main_thread_executor
+from playbackTiming import PlaybackTimingLog
+
+import logging
+logger = logging.getLogger(__name__)
 
 class EventFlusher(QObject):
+    """
+    Lives in the main thread.  The playback thread uses it to wait until 
+    the main thread has processed all events posted so far:
+    
+    .. code-block:: python
+
+        flusher.clear()
+        flusher.request()
+        flusher.wait()
+    
+    The request can also carry an event to deliver (as plain fields, see eventSerializers.event_from_fields), 
+    in which case the event is constructed and posted by the main thread before the flush.
+    A single EventFlusher is reused for every event.
+    """
     SetEvent = QEvent.Type(QEvent.registerEventType())
 
     def __init__(self, parent=None):
         QObject.__init__(self, parent)
         self._state = threading.Event()
+        self._pending_delivery = None
+        # When the last flush finished (or None if nothing has been flushed yet)
+        self.flushed_at = None
 
     def event(self, e):
         if e.type() == EventFlusher.SetEvent:
             assert threading.current_thread().name == "MainThread"
+            delivery = self._pending_delivery
+            self._pending_delivery = None
+            if delivery is not None:
+                receiver, fields = delivery
+                event = event_from_fields(*fields)
+                event.spont = True
+                QApplication.postEvent(receiver, event)
             self.set()
             return True
         return False
@@ -56,97 +92,392 @@ class EventFlusher(QObject):
         QApplication.sendPostedEvents()
         QApplication.processEvents()
         QApplication.flush()
+        self.flushed_at = _clock()
         assert not self._state.is_set()
         self._state.set()
         
     def clear(self):
         self._state.clear()
 
+    def request(self, receiver=None, fields=None):
+        """
+        Ask the main thread to flush its event queue and then set() this flusher.
+        Since the request is itself a posted event, it is handled after all previously posted events.
+        If fields are provided, the main thread first constructs that event and posts it to the receiver.
+        """
+        if fields is not None:
+            self._pending_delivery = (receiver, fields)
+        QApplication.postEvent( self, QEvent(EventFlusher.SetEvent) )
+
     def wait(self):
         assert threading.current_thread().name != "MainThread"
         self._state.wait()
 
+class IdleMonitor(QObject):
+    """
+    Lives in the main thread, and keeps track of whether or not the main event loop is idle.
+    
+    The event dispatcher emits aboutToBlock() just before the event loop goes to sleep,
+    which only happens when there are no pending posted events and no zero-timers waiting to fire.
+    It emits awake() as soon as it wakes up again.
+    """
+    def __init__(self, parent=None):
+        super(IdleMonitor, self).__init__(parent)
+        assert threading.current_thread().name == "MainThread"
+        self._idle_since = None
+        dispatcher = QAbstractEventDispatcher.instance()
+        dispatcher.aboutToBlock.connect( self._onAboutToBlock )
+        dispatcher.awake.connect( self._onAwake )
+
+    def _onAboutToBlock(self):
+        if self._idle_since is None:
+            self._idle_since = _clock()
+
+    def _onAwake(self):
+        self._idle_since = None
+
+    def idle_duration(self, since=None):
+        """
+        How long (in seconds) the event loop has been asleep, or None if it is busy right now.
+        If ``since`` is given, also return None unless the event loop went to sleep after that time.
+        """
+        idle_since = self._idle_since
+        if idle_since is None or (since is not None and idle_since < since):
+            return None
+        return _clock() - idle_since
+
 class EventPlayer(object):
-    def __init__(self, playback_speed=None, comment_display=None):
+    # Special playback_speed: Instead of reproducing the recorded timing,
+    #  send each event as soon as the application has become idle.
+    IDLE = 'idle'
+
+    def __init__(self, playback_speed=None, comment_display=None, collection_policy=None,
+                 idle_settle_time=0.005, idle_max_wait=10.0, idle_predicate=None, timing_report_path=None):
+        """
+        playback_speed: The speed multiplier for the recorded timing, 
+                        or None to play events as quickly as possible, 
+                        or EventPlayer.IDLE to send each event as soon as the application is idle.
+        idle_settle_time: In IDLE mode, how long the event loop must stay asleep before the app is considered idle.
+        idle_max_wait: In IDLE mode, the maximum time to wait for the app to become idle before sending the next event anyway.
+        idle_predicate: In IDLE mode, an optional callable that returns False while the app is busy 
+                        (e.g. while it has background jobs running).  It is called from the playback thread.
+        timing_report_path: If provided, the per-event timing of the playback (see PlaybackTimingLog) 
+                            is written to this path (.json or .csv) when playback finishes.
+        """
         self._playback_speed = playback_speed
+        self._idle_settle_time = idle_settle_time
+        self._idle_max_wait = idle_max_wait
+        self._idle_predicate = idle_predicate
+        self._idle_monitor = None
+        if collection_policy is None:
+            collection_policy = default_collection_policy
+        self._collection_policy = collection_policy
         self._timer = Timer()
         self._timer.unpause()
+        # Recorded time corresponding to the start of self._timer (nonzero when playing a slice of a recording)
+        self._time_offset = 0.0
+        self._fast_forwarding = False
+        # Cleared while playback is paused
+        self._running = threading.Event()
+        self._running.set()
+        self._flusher = None
+        self.flush_latency = LatencyHistogram()
+        # Per-event rows are only kept if they'll be written to a report.  Otherwise, memory would grow with the playback.
+        self.timing = PlaybackTimingLog( keep_rows=(timing_report_path is not None) )
+        self._timing_report_path = timing_report_path
         if comment_display is None:
             self._comment_display = self._default_comment_display
         else:
             self._comment_display = comment_display
 
-    def play_script(self, path, finish_callback=None):
+    def play_script(self, path, finish_callback=None, start=None, stop=None, breakpoints=()):
         """
         Start execution of the given script in a separate thread and return immediately.
+        The recording may be a Python playback script or a binary recording (see binaryRecording.py)
         Note: You should handle any exceptions from the playback script via sys.execpthook.
+
+        start, stop: Optionally play only part of the recording.  Each is an event index or the text 
+                     of a comment marker (see PlaybackPlan.resolve_position()).  The events before 
+                     ``start`` are still sent (the app must reach the same state), but each one is sent 
+                     as soon as the previous one has been processed, without reproducing the recorded timing.
+        breakpoints: Event indexes or comment markers at which playback pauses until resume() is called.
         """
         _globals = {}
         _locals = {}
         
         # Before we start, move the mouse cursor to (0,0) to avoid interference with the recorded events.
         QCursor.setPos(0, 0)
+
+        # The flusher must be created in the main thread.
+        assert threading.current_thread().name == "MainThread"
+        main_thread_executor()
+        if self._flusher is None:
+            self._flusher = EventFlusher( QApplication.instance() )
+        if (self._playback_speed == EventPlayer.IDLE or start is not None) and self._idle_monitor is None:
+            self._idle_monitor = IdleMonitor( QApplication.instance() )
+
+        # Load the whole recording up front (without executing it), and validate it before we start.
+        try:
+            plan = load_playback_plan(path)
+        except ScriptParseError as ex:
+            # This script was edited by hand (or it's very old).  We'll have to execute it.
+            logger.info( "Can't precompile {}, so it will be executed instead: {}".format( path, ex ) )
+        else:
+            start_index, stop_index = plan.resolve_slice(start, stop)
+            breakpoint_indexes = map( plan.resolve_position, breakpoints )
+            self._start_playback_thread( lambda: self.play_records(plan, start_index, stop_index, breakpoint_indexes), 
+                                         finish_callback )
+            return
+
+        if start is not None or stop is not None or breakpoints:
+            raise PlaybackPlanError( "Can't seek within {}: it contains custom code, so it can only be executed from the beginning."
+                                     .format( path ) )
         
         """ 
         Calls to events in the playback script like: player.post_event(obj,PyQt4.QtGui.QMouseEvent(...),t)
         are/were responsible for the xcb-error on Ubuntu, because you may not use
-        a Gui-object from a thread other than the MainThread running the Gui
+        a Gui-object from a thread other than the MainThread running the Gui.
+        (That's why we prefer to load recordings as a PlaybackPlan, above.)
         """
         execfile(path, _globals, _locals)
+        self._start_playback_thread( lambda: _locals['playback_events'](player=self), finish_callback )
+
+    def _start_playback_thread(self, playback_func, finish_callback):
         def run():
-            _locals['playback_events'](player=self)
+            try:
+                playback_func()
+            except:
+                # Write the timing report first: it's most useful when playback failed.
+                self._write_timing_report()
+                # Exceptions in non-main threads don't reach sys.excepthook on their own.
+                sys.excepthook( *sys.exc_info() )
+                return
+            logger.info( "Event flush round trips: {}".format( self.flush_stats() ) )
+            logger.info( "Main-thread queries: {}".format( main_thread_executor().stats() ) )
+            logger.info( "Slowest receivers to locate (p95): {}".format( self.timing.worst_receivers('lookup', 5) ) )
+            self._write_timing_report()
             if finish_callback is not None:
                 finish_callback()
         th = threading.Thread( target=run )
         th.daemon = True
         th.start()
     
+    def _write_timing_report(self):
+        if self._timing_report_path is not None:
+            self.timing.dump(self._timing_report_path)
+            logger.info( "Wrote playback timing report to {}".format( self._timing_report_path ) )
+
+    def play_records(self, records, start=0, stop=None, breakpoints=()):
+        """
+        Play the given records (kind, event_type, args, text, objname, timestamp_in_seconds),
+        e.g. from a PlaybackPlan.  Must be called from the playback thread.
+
+        start, stop: Record indexes.  Records before ``start`` are fast-forwarded (each one is sent as soon as the previous one has been processed), 
+                     and playback ends just before ``stop``.
+        breakpoints: Record indexes at which playback pauses (see pause() and resume())
+        """
+        if stop is None:
+            stop = len(records)
+        breakpoints = set(breakpoints)
+        
+        self.display_comment("SCRIPT STARTING")
+        self._fast_forwarding = (start > 0)
+        if self._fast_forwarding:
+            self.display_comment("FAST-FORWARDING TO EVENT {}".format( start ))
+        for index in xrange(stop):
+            kind, event_type, args, text, objname, timestamp_in_seconds = records[index]
+            if index == start:
+                self._begin_slice(records, start, stop)
+            if index in breakpoints:
+                self.display_comment("BREAKPOINT AT EVENT {}".format( index ))
+                self.pause()
+            self._wait_while_paused()
+
+            if kind == EventKinds.Comment:
+                self.display_comment(text)
+            else:
+                self.post_record(kind, event_type, args, text, objname, timestamp_in_seconds)
+        self.display_comment("SCRIPT COMPLETE")
+
+    def _begin_slice(self, records, start, stop):
+        """
+        Stop fast-forwarding, and restart the clock so the first event of the slice is sent at its recorded time.
+        """
+        if self._fast_forwarding:
+            self._fast_forwarding = False
+            self.display_comment("FAST-FORWARD COMPLETE")
+        self._time_offset = 0.0
+        if start > 0:
+            for record in records[start:stop]:
+                if record[0] != EventKinds.Comment:
+                    self._time_offset = record[5]
+                    break
+        self._timer.reset()
+        self._timer.unpause()
+
+    def pause(self):
+        """
+        Pause playback before the next event.  May be called from any thread.
+        """
+        self._running.clear()
+
+    def resume(self):
+        """
+        Resume paused playback.  May be called from any thread.
+        """
+        self._running.set()
+
+    @property
+    def paused(self):
+        return not self._running.is_set()
+
+    def _wait_while_paused(self):
+        if self._running.is_set():
+            return
+        self.display_comment("PLAYBACK PAUSED (call resume() to continue)")
+        # The recorded timing resumes where it left off.
+        self._timer.pause()
+        self._running.wait()
+        self._timer.unpause()
+        self.display_comment("PLAYBACK RESUMED")
+
+    def post_record(self, kind, event_type, args, text, obj_name, timestamp_in_seconds):
+        """
+        Like post_event(), but the event is given as plain fields (see eventSerializers.extract_event_fields).
+        The event itself is constructed on the main thread.
+        """
+        mouse_state = tuple(args[4:7]) if kind == EventKinds.Mouse else None
+        def deliver(obj):
+            return self._flush( obj, (kind, event_type, args, text) )
+        self._post(obj_name, event_type, mouse_state, timestamp_in_seconds, deliver)
+
     def post_event(self, obj_name, event, timestamp_in_seconds):
-        # Remove any lingering widgets (which might have conflicting names with our receiver)
-        gc.collect()
+        mouse_state = None
+        if isinstance(event, QMouseEvent):
+            mouse_state = ( int(event.button()), int(event.buttons()), int(event.modifiers()) )
+        def deliver(obj):
+            event.spont = True
+            QApplication.postEvent(obj, event)
+            return self._flush()
+        self._post(obj_name, event.type(), mouse_state, timestamp_in_seconds, deliver)
+
+    def _post(self, obj_name, event_type, mouse_state, timestamp_in_seconds, deliver):
+        """
+        Locate the receiver, wait until it's time to send the event, 
+        and then call deliver(receiver), which must post the event and return the flush duration.
+        The timing of each step is recorded in self.timing.
+        """
+        lookup_stats = {}
+        t_start = _clock()
+        obj = self._locate_receiver(obj_name, event_type, mouse_state, lookup_stats)
+        if obj is None:
+            return
+        t_located = _clock()
+        scheduled = self._wait_for_timestamp(timestamp_in_seconds)
+        sleep_duration = _clock() - t_located
+
+        assert threading.current_thread().name != "MainThread"
+        assert QApplication.instance().thread() == obj.thread()
+        posted = self._timer.seconds()
+        flush_duration = deliver(obj)
+        self.timing.record( event_type, obj_name, scheduled, posted, 
+                            t_located - t_start, sleep_duration, flush_duration, 
+                            lookup_stats.get('attempts', 1) )
+
+    def _locate_receiver(self, obj_name, event_type, mouse_state, lookup_stats=None):
+        """
+        Locate the receiver object.
+        Returns None if it couldn't be found, but the event wasn't important anyway.
+        
+        mouse_state: For mouse events, (button, buttons, modifiers).  Otherwise None.
+        lookup_stats: Passed to get_named_object()
+        """
+        # Remove any lingering widgets (which might have conflicting names with our receiver),
+        #  but only if the collection policy thinks there might be some.
+        self._collection_policy.collect()
         
         try:
-            # Locate the receiver object.
-            obj = get_named_object(obj_name)
+            return get_named_object(obj_name, stats=lookup_stats)
         except NamedObjectNotFoundError:
             # If the object couldn't be found, check to see if this smells 
             # like a silly mouse-move event that was sent after a window closed.
-            if event.type() == QEvent.MouseMove \
-                and int(event.button()) == 0 \
-                and int(event.buttons()) == 0 \
-                and int(event.modifiers()) == 0:
+            if event_type == QEvent.MouseMove and mouse_state == (0, 0, 0):
                 # Just proceed. We shouldn't raise an exception just because we failed to 
                 # deliver a pointless mouse-movement to a widget that doesn't exist anymore.
-                return
-            elif event.type() == QEvent.KeyRelease:
+                return None
+            elif event_type == QEvent.KeyRelease:
                 # Sometimes we try to send a KeyRelease to a just-closed dialog.
                 # Ignore errors from such cases.
-                return
-            elif event.type() == QEvent.Wheel:
+                return None
+            elif event_type == QEvent.Wheel:
                 # Also don't freak out if we can't find an object that is supposed to be receiving wheel events.
                 # If there's a real problem, it will be noticed that object is sent a mousepress or key event.
-                return
+                return None
             else:
                 # This isn't a plain mouse-move.
                 # It was probably important, and something went wrong.
                 raise
 
-        if self._playback_speed is not None:
-            self._timer.sleep_until(timestamp_in_seconds / self._playback_speed)
-        assert threading.current_thread().name != "MainThread"
-        event.spont = True
-        QApplication.postEvent(obj, event)
-        assert QApplication.instance().thread() == obj.thread()
-        
-        flusher = EventFlusher()
-        flusher.moveToThread( obj.thread() )
-        flusher.setParent( QApplication.instance() )
+    def _wait_for_timestamp(self, timestamp_in_seconds):
+        """
+        Wait until it's time to send the next event.
+        Returns the scheduled time (in player time), or None if the event isn't scheduled for a particular time.
+        """
+        if self._fast_forwarding:
+            # Don't wait for the app to settle.  Just make sure it has finished processing the previous event
+            # (and isn't busy, according to the idle_predicate, if any).
+            self._wait_until_idle( settle_time=0.0 )
+        elif self._playback_speed == EventPlayer.IDLE:
+            self._wait_until_idle()
+        elif self._playback_speed is not None:
+            scheduled = (timestamp_in_seconds - self._time_offset) / self._playback_speed
+            self._timer.sleep_until(scheduled)
+            return scheduled
+        return None
 
-        # Note: We are allowed to use QTimer outside of the main thread like this 
-        #        because the target function belongs to a QObject
-        QTimer.singleShot( 0, flusher.set )    
-        flusher.wait()
-        flusher.clear()
+    def _flush(self, receiver=None, fields=None):
+        """
+        Wait for the main thread to process all posted events (and anything else they triggered).
+        If fields are provided, the main thread first constructs that event and posts it to the receiver.
+        Returns the round-trip time.
+        """
+        t_start = _clock()
+        self._flusher.clear()
+        self._flusher.request(receiver, fields)
+        self._flusher.wait()
+        duration = _clock() - t_start
+        self.flush_latency.record( duration )
+        return duration
+
+    def _wait_until_idle(self, settle_time=None):
+        """
+        Block the playback thread until the main event loop has been asleep for at least 
+        settle_time seconds (default: idle_settle_time) and the idle_predicate (if any) agrees, 
+        or until idle_max_wait seconds have passed.
+        Returns True if the application became idle.
+
+        The event loop only counts as asleep if it went to sleep after the previous event was flushed.
+        (Posted events aren't the only kind of work: zero-timers, sockets, etc. keep the loop awake, too.)
+        """
+        if settle_time is None:
+            settle_time = self._idle_settle_time
+        deadline = _clock() + self._idle_max_wait
+        poll_interval = max( 0.001, settle_time / 5.0 )
+        while True:
+            idle_duration = self._idle_monitor.idle_duration( since=self._flusher.flushed_at )
+            if idle_duration is not None and idle_duration >= settle_time \
+               and (self._idle_predicate is None or self._idle_predicate()):
+                return True
+            if _clock() >= deadline:
+                logger.warn( "Application didn't become idle within {} seconds.  Proceeding anyway.".format( self._idle_max_wait ) )
+                return False
+            time.sleep( poll_interval )
+
+    def flush_stats(self):
+        """
+        Summary of the round-trip times spent waiting for the main thread to process each event.
+        """
+        return self.flush_latency.summary()
 
     def display_comment(self, comment):
         self._comment_display(comment)
@@ -28,16 +28,22 @@
 
 import sip
 from PyQt4.QtCore import QObject, QEvent, QChildEvent, QTimerEvent
-from PyQt4.QtGui import QApplication, QMouseEvent, QGraphicsSceneMouseEvent, QWindowStateChangeEvent, QMoveEvent, QCursor, QComboBox, QMenu
+from PyQt4.QtGui import QApplication, QWidget, QMouseEvent, QGraphicsSceneMouseEvent, QWindowStateChangeEvent, QMoveEvent, QCursor, QComboBox, QMenu
 
 from objectNameUtils import get_fully_qualified_name
-from eventSerializers import event_to_string
+from eventSerializers import extract_event_fields, write_playback_script
+from capturedEvents import CapturedEventBuffer
+from recordingLog import RecordingLogWriter
+from motionDecimation import MotionDecimator
+from captureWorker import CaptureWorker
+import instrumentation
 from eventTypeNames import EventTypes
 from eventRecordingApp import EventRecordingApp
+from gcPolicy import default_collection_policy
 
 from timer import Timer
 
-import gc
+import weakref
 import logging
 logger = logging.getLogger(__name__)
 
@@ -55,17 +61,59 @@ class EventRecorder( QObject ):
     """
     Records spontaneous events from the UI and serializes them as strings that can be evaluated in Python.
     """
-    def __init__(self, parent=None, ignore_parent_events=True):
+    def __init__(self, parent=None, ignore_parent_events=True, collection_policy=None, log_path=None, event_store=None,
+                 decimation_tolerance=None, decimation_max_rate=None,
+                 threaded=True, max_queue_size=10000, drop_on_overflow=False, use_event_timestamps=False):
+        """
+        collection_policy: A gcPolicy.CollectionPolicy.  If not provided, the default (shared) policy is used.
+        log_path: If provided, captured events are streamed to a crash-safe recording log at this path 
+                  instead of being kept in memory.  (See recordingLog.py)
+        event_store: Alternatively, provide the object that stores the captured events, 
+                  e.g. a capturedEvents.EventRingBuffer.  Must not be combined with log_path.
+        decimation_tolerance, decimation_max_rate: If either is provided, runs of mouse-move events are 
+                  decimated before they are stored.  (See motionDecimation.py)
+        threaded, max_queue_size, drop_on_overflow: If threaded is True, captured events are stored by a 
+                  worker thread instead of the GUI thread.  (See captureWorker.py)
+        use_event_timestamps: If True, input events are recorded with the time they were generated by the 
+                  windowing system (QInputEvent.timestamp()), rather than the time the recorder saw them.
+                  Only Qt5 provides event timestamps; otherwise, this option has no effect.
+        """
         QObject.__init__(self, parent=parent)
+        if collection_policy is None:
+            collection_policy = default_collection_policy
+        self._collection_policy = collection_policy
         self._ignore_parent_events = False
         if parent is not None and ignore_parent_events:
             self._ignore_parent_events = True
             self._parent_name = get_fully_qualified_name(parent)
-        self._captured_events = []
+        assert log_path is None or event_store is None, "Provide log_path or event_store, not both."
+        self._recording_log = None
+        if event_store is not None:
+            self._captured_events = event_store
+        elif log_path is not None:
+            self._recording_log = RecordingLogWriter(log_path)
+            self._captured_events = self._recording_log
+        else:
+            self._captured_events = CapturedEventBuffer()
+
+        self.decimator = None
+        if decimation_tolerance is not None or decimation_max_rate is not None:
+            self.decimator = MotionDecimator( self._captured_events, decimation_tolerance, decimation_max_rate )
+            self._captured_events = self.decimator
+
+        self.capture_worker = None
+        if threaded:
+            self.capture_worker = CaptureWorker( self._captured_events, max_queue_size, drop_on_overflow )
+            self._captured_events = self.capture_worker
         self._timer = Timer()
+        self._use_event_timestamps = use_event_timestamps
+        # Difference between our timer and the windowing system's event clock (in seconds).  See _eventTimestamp()
+        self._event_time_offset = None
         
         assert isinstance(QApplication.instance(), EventRecordingApp)
-        QApplication.instance().aboutToNotify.connect( self.handleApplicationEvent )
+        QApplication.instance().connect_subscriber( self.handleApplicationEvent )
+        # While we're paused, we only need to follow the cursor.
+        QApplication.instance().register_interest( self, self.CursorTrackingEventTypes )
 
         # We keep track of which mouse buttons are currently checked in this set.
         # If we see a Release event for a button we think isn't pressed, then we missed something.
@@ -77,10 +125,74 @@ class EventRecorder( QObject ):
         # This hack allows us to recognize that we missed the click and generate it anyway.
         self._current_observed_mouse_presses = set()
 
+        # To decide whether or not a plain mouse-move is worth saving, we need to know which widget is under the cursor.
+        # Rather than hit-testing with QApplication.widgetAt() for every move, we follow Enter/Leave events.
+        self._widget_under_cursor = None # weakref
+        self._widget_move_decisions = weakref.WeakKeyDictionary() # widget -> bool
+
+        # Cache of (event class) -> decision.  See _shouldSaveEvent()
+        self._event_class_decisions = {}
+
     def handleApplicationEvent(self, receiver, event):
+        if event.type() in self.CursorTrackingEventTypes:
+            self._trackCursor(receiver, event)
         if not self.paused:
             self.captureEvent(receiver, event)
 
+    CursorTrackingEventTypes = set( [ QEvent.Enter, QEvent.Leave, QEvent.HoverMove ] )
+
+    def _trackCursor(self, receiver, event):
+        if not isinstance(receiver, QWidget) or sip.isdeleted(receiver):
+            return
+        current = None if self._widget_under_cursor is None else self._widget_under_cursor()
+        if event.type() == QEvent.Enter:
+            self._widget_under_cursor = weakref.ref(receiver)
+        elif event.type() == QEvent.Leave:
+            if current is receiver:
+                # If the cursor is still within the parent, we'll see an Enter event for it.
+                # Otherwise, we'll see a Leave event for it, too.
+                parent = None if receiver.isWindow() else receiver.parentWidget()
+                self._widget_under_cursor = None if parent is None else weakref.ref(parent)
+        elif current is None:
+            # HoverMove events are also sent to ancestors of the widget under the cursor,
+            #  so we only use them to recover if we missed an Enter event.
+            self._widget_under_cursor = weakref.ref(receiver)
+
+    def _widgetUnderCursor(self):
+        widget = None if self._widget_under_cursor is None else self._widget_under_cursor()
+        if widget is None or sip.isdeleted(widget):
+            # We haven't seen an Enter event yet.  Do it the slow way.
+            widget = QApplication.instance().widgetAt( QCursor.pos() )
+        return widget
+
+    def _shouldSaveMouseMove(self, widget):
+        """
+        Decide whether or not a plain mouse-move (no buttons or modifiers) over the given widget should be saved.
+        """
+        if widget is None:
+            return False
+
+        # If mouse tracking is enabled for this widget, 
+        #  then we'll assume mouse movements are important to it.
+        # (Mouse tracking can be switched at any time, so we don't cache this.)
+        if widget.hasMouseTracking():
+            return True
+
+        try:
+            return self._widget_move_decisions[widget]
+        except KeyError:
+            pass
+        
+        # Somewhat hackish (and slow), but we have to record mouse movements during combo box usage.
+        # Same for QMenu usage (on Mac, it doesn't seem to matter, but on Fedora it does matter.)
+        # Fortunately, we only need to check once per widget.
+        if widget.objectName() == "qt_scrollarea_viewport":
+            decision = has_ancestor(widget, QComboBox)
+        else:
+            decision = isinstance(widget, QMenu)
+        self._widget_move_decisions[widget] = decision
+        return decision
+
     @property
     def paused(self):
         return self._timer.paused
@@ -104,19 +216,28 @@ class EventRecorder( QObject ):
     IgnoredEventClasses = (QChildEvent, QTimerEvent, QGraphicsSceneMouseEvent, QWindowStateChangeEvent, QMoveEvent)
 
     def captureEvent(self, watched, event):
-        if self._shouldSaveEvent(event):
+        inst = instrumentation.active
+        t = inst and inst.start()
+        save = self._shouldSaveEvent(event)
+        if inst: t = inst.lap('filtering', int(event.type()), type(watched), t)
+        if save:
             try:
-                eventstr = event_to_string(event)
+                # Copy the event's fields now.  They are formatted as a string only when the script is written.
+                kind, event_type, args, text = extract_event_fields(event)
             except KeyError:
                 logger.warn("Don't know how to record event: {}".format( str(event) ))
                 print "Don't know how to record", str(event)
             else:
-                # Perform a full garbage collection before determining the name of this widget
-                gc.collect()
+                if inst: t = inst.lap('serialization', event_type, type(watched), t)
+                # Remove any lingering widgets before determining the name of this widget
+                # (if the collection policy thinks there might be some)
+                self._collection_policy.collect()
+                if inst: t = inst.lap('gc', event_type, type(watched), t)
                 if sip.isdeleted(watched):
                     return
-                timestamp_in_seconds = self._timer.seconds()
+                timestamp_in_seconds = self._eventTimestamp(event)
                 objname = str(get_fully_qualified_name(watched))
+                if inst: t = inst.lap('name_resolution', event_type, type(watched), t)
                 if not ( self._ignore_parent_events and objname.startswith(self._parent_name) ):
                     # Special case: If this is a MouseRelease and we somehow missed the MousePress,
                     #               then create a "synthetic" MousePress and insert it immediately before the release
@@ -126,45 +247,76 @@ class EventRecorder( QObject ):
                         try:
                             self._current_observed_mouse_presses.remove( event.button() )
                         except KeyError:
-                            synthetic_press_event = QMouseEvent( QEvent.MouseButtonPress, event.pos(), event.globalPos(), event.button(), event.buttons(), event.modifiers() )
-                            synthetic_eventstr = event_to_string(synthetic_press_event)
-                            self._captured_events.append( (synthetic_eventstr, objname, timestamp_in_seconds) )
-                    self._captured_events.append( (eventstr, objname, timestamp_in_seconds) )
+                            # The synthetic press has exactly the same fields as the release, except for its type.
+                            self._captured_events.append( kind, int(QEvent.MouseButtonPress), args, text, objname, timestamp_in_seconds )
+                    self._captured_events.append( kind, event_type, args, text, objname, timestamp_in_seconds )
+                    if inst: t = inst.lap('storage', event_type, type(watched), t)
         return
 
+    def _eventTimestamp(self, event):
+        """
+        Return the timestamp to record for the given event, in seconds since recording started.
+        Timestamps are rounded to whole microseconds, so they survive conversion to a script and back unchanged.
+        """
+        now = self._timer.microseconds() / 1e6
+        if not self._use_event_timestamps:
+            return now
+        event_timestamp = getattr(event, 'timestamp', None)
+        if event_timestamp is None:
+            # Qt4 events have no timestamp.
+            return now
+        event_seconds = event_timestamp() / 1000.0
+        if not event_seconds:
+            # Synthesized events have no timestamp.
+            return now
+        
+        # Map the windowing system's clock onto our timer.
+        # If the mapped time isn't plausible (the event clock wrapped around, or we were paused), then resync.
+        if self._event_time_offset is not None:
+            timestamp_in_seconds = round( event_seconds + self._event_time_offset, 6 )
+            if now - 1.0 <= timestamp_in_seconds <= now:
+                return timestamp_in_seconds
+        self._event_time_offset = now - event_seconds
+        return now
+
     def insertComment(self, comment):
-        self._captured_events.append( (comment, "comment", None) )
+        self._captured_events.append_comment( str(comment) )
+
+    # Event class decisions.  See _shouldSaveEvent()
+    _MouseEventClass, _IgnoredEventClass, _OtherEventClass = range(3)
+
+    def _classifyEventClass(self, event_class):
+        if issubclass(event_class, QMouseEvent):
+            decision = EventRecorder._MouseEventClass
+        elif issubclass(event_class, self.IgnoredEventClasses):
+            decision = EventRecorder._IgnoredEventClass
+        else:
+            decision = EventRecorder._OtherEventClass
+        self._event_class_decisions[event_class] = decision
+        return decision
 
     def _shouldSaveEvent(self, event):
-        if isinstance(event, QMouseEvent):
+        try:
+            decision = self._event_class_decisions[type(event)]
+        except KeyError:
+            decision = self._classifyEventClass(type(event))
+
+        if decision == EventRecorder._MouseEventClass:
             # Ignore most mouse movement events if the user isn't pressing anything.
             if event.type() == QEvent.MouseMove \
                 and int(event.button()) == 0 \
                 and int(event.buttons()) == 0 \
                 and int(event.modifiers()) == 0:
-
-                # If mouse tracking is enabled for this widget, 
-                #  then we'll assume mouse movements are important to it.
-                widgetUnderCursor = QApplication.instance().widgetAt( QCursor.pos() )
-                if widgetUnderCursor is not None and widgetUnderCursor.hasMouseTracking():
-                    return True
-
-                # Somewhat hackish (and slow), but we have to record mouse movements during combo box usage.
-                # Same for QMenu usage (on Mac, it doesn't seem to matter, but on Fedora it does matter.)
-                if widgetUnderCursor is not None and widgetUnderCursor.objectName() == "qt_scrollarea_viewport":
-                    return has_ancestor(widgetUnderCursor, QComboBox)
-                if isinstance(widgetUnderCursor, QMenu):
-                    return True
-                return False
+                return self._shouldSaveMouseMove( self._widgetUnderCursor() )
             else:
                 return True
         
         # Ignore non-spontaneous events
         if not event.spontaneous():
             return False
-        if event.type() in self.IgnoredEventTypes:
+        if decision == EventRecorder._IgnoredEventClass:
             return False
-        if isinstance(event, self.IgnoredEventClasses):
+        if event.type() in self.IgnoredEventTypes:
             return False
         return True
 
@@ -173,56 +325,34 @@ class EventRecorder( QObject ):
         # That's because (contrary to the documentation), the QApplication eventFilter does NOT get to see every event in the application.
         # Testing shows that events that were "filtered out" by a different event filter may not be seen by the QApplication event filter.
         self._timer.unpause()
+        self._event_time_offset = None
+        QApplication.instance().register_interest( self )
 
     def pause(self):
         self._timer.pause()
+        QApplication.instance().register_interest( self, self.CursorTrackingEventTypes )
     
-    def writeScript(self, fileobj, author_name):
-        # Write header comments
-        fileobj.write(
-"""
-# Event Recording
-# Created by {}
-# Started at: {}
-""".format( author_name, str(self._timer.start_time) ) )
-
-        # Write playback function definition
-        fileobj.write(
-"""
-def playback_events(player):
-    import PyQt4.QtCore
-    from PyQt4.QtCore import Qt, QEvent, QPoint
-    import PyQt4.QtGui
-    
-    # The getMainWindow() function is provided by EventRecorderApp
-    mainwin = PyQt4.QtGui.QApplication.instance().getMainWindow()
-
-    player.display_comment("SCRIPT STARTING")
-
-""")
-
-        # Write all events and comments
-        for eventstr, objname, timestamp_in_seconds in self._captured_events:
-            if objname == "comment":
-                eventstr = eventstr.replace('\\', '\\\\')
-                eventstr = eventstr.replace('"', '\\"')
-                eventstr = eventstr.replace("'", "\\'")
-                fileobj.write(
-"""
-    ########################
-    player.display_comment(\"""{eventstr}\""")
-    ########################
-""".format( **locals() ) )
-            else:
-                fileobj.write(
-"""
-    event = {eventstr}
-    player.post_event( '{objname}', event , {timestamp_in_seconds} )
-""".format( **locals() )
-)
-        fileobj.write(
-"""
-    player.display_comment("SCRIPT COMPLETE")
-""")
+    def flush(self):
+        """
+        Make sure every event captured so far has been stored.
+        """
+        if self.capture_worker is not None:
+            self.capture_worker.flush()
+            if self.capture_worker.dropped > 0:
+                logger.warn( "The capture worker fell behind and dropped {} events".format( self.capture_worker.dropped ) )
+        if self.decimator is not None:
+            self.decimator.flush()
 
-    
+    def setRecordingLogDisposable(self, disposable):
+        """
+        If disposable is True, the recording log is deleted when it is closed (at exit), 
+        because everything in it has been saved to a script.
+        """
+        if self._recording_log is not None:
+            self._recording_log.delete_on_close = disposable
+
+    def writeScript(self, fileobj, author_name):
+        self.flush()
+        if self.decimator is not None:
+            logger.info( "Mouse-move decimation kept {} events and dropped {}".format( self.decimator.kept, self.decimator.dropped ) )
+        write_playback_script( fileobj, author_name, self._timer.start_time, self._captured_events )
@@ -29,12 +29,14 @@
 import os
 import sys
 import datetime
+import tempfile
 
 from PyQt4 import uic
 from PyQt4.QtCore import Qt, QSettings, QString
 from PyQt4.QtGui import QApplication, QWidget, QIcon, QFileDialog, QMessageBox
 
 from eventcapture.eventRecorder import EventRecorder
+from eventcapture.recordingLog import RecordingLogError
 
 def encode_from_qstring(qstr):
     """Convert the given QString into a Python str with the same encoding as the filesystem."""
@@ -55,7 +57,13 @@ class EventRecorderGui(QWidget):
         self.saveButton.clicked.connect( self._onSave )
         self.insertCommentButton.clicked.connect( self._onInsertComment )
         
-        self._recorder = EventRecorder( parent=self )
+        # Stream the recording to a log file as we go, so it can be recovered if the app crashes.
+        # (See recordingLog.py for the conversion tool.)
+        # The file isn't created until the first event is recorded, and it is deleted at exit if the recording was saved.
+        now = datetime.datetime.now()
+        timestr = "{:04d}{:02d}{:02d}-{:02d}{:02d}{:02d}".format( now.year, now.month, now.day, now.hour, now.minute, now.second )
+        self.log_path = os.path.join( tempfile.gettempdir(), "eventcapture-{}-{}.log".format( timestr, os.getpid() ) )
+        self._recorder = EventRecorder( parent=self, log_path=self.log_path )
         
         self.pauseButton.setEnabled(False)
         self.saveButton.setEnabled(False)
@@ -104,6 +112,8 @@ class EventRecorderGui(QWidget):
                 self._onInsertComment()
             # Unpause the recorder
             self._recorder.unpause()
+            # New events aren't in any saved script yet, so keep the log.
+            self._recorder.setRecordingLogDisposable(False)
             self.pauseButton.setText( "Pause" )
             self.pauseButton.setChecked( False )
             if not self._autopaused:
@@ -164,9 +174,16 @@ class EventRecorderGui(QWidget):
         default_dir = os.path.split(script_path)[0]
         settings.setValue( "recordings_directory", default_dir )
         
-        with open(script_path, 'w') as f:
-            self._recorder.writeScript(f, author_name)
+        try:
+            with open(script_path, 'w') as f:
+                self._recorder.writeScript(f, author_name)
+        except RecordingLogError as ex:
+            message = "Some events could not be recorded, so the saved script is incomplete:\n{}".format( ex )
+            QMessageBox.critical(self, "Recording incomplete", message)
+            return
         self._saved = True
+        # Everything in the recording log is in the script now.
+        self._recorder.setRecordingLogDisposable(True)
             
     def _onInsertComment(self):
         comment = self.newCommentEdit.toPlainText()
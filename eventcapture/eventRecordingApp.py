@@ -26,25 +26,87 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import weakref
 import functools
 import sip
-from PyQt4.QtCore import pyqtSignal, Qt, QEvent, QTimer, QT_VERSION_STR
+from PyQt4.QtCore import pyqtSignal, Qt, QObject, QEvent, QTimer, SIGNAL, QT_VERSION_STR
 from PyQt4.QtGui import QApplication, QWidget, QMainWindow, QLineEdit
 
-from objectNameUtils import assign_unique_child_index, remove_unique_child_index
+from objectNameUtils import schedule_unique_child_index, remove_unique_child_index, invalidate_qualified_name, notify_tree_changed, \
+                            forget_named_object, invalidate_child_names, remove_child_name, invalidate_toplevel_widgets
+from gcPolicy import default_collection_policy
+import instrumentation
 
 class EventRecordingApp(QApplication):
     """
     Special QApplication subclass that overrides the notify() function.
     Using notify() instead of QApplication.instance().installEventFilter() is more general,
     and necessary for our purposes.
+
+    aboutToNotify is only emitted for events that some subscriber has registered an interest in.
+    (See connect_subscriber() and register_interest())  If any listener is connected to aboutToNotify 
+    some other way, or without having registered, every event is emitted, 
+    as if it had registered an interest in all events.
     """
     aboutToNotify = pyqtSignal(object, object)
+    _AboutToNotifySignature = SIGNAL("aboutToNotify(PyQt_PyObject,PyQt_PyObject)")
+
+    # Events that (may) change the fully qualified name of the receiver or its descendants
+    # (Qt4 doesn't have the ObjectNameChange event.)
+    RenamingEventTypes = set( [ QEvent.ParentChange ] )
+    if hasattr(QEvent, 'ObjectNameChange'):
+        RenamingEventTypes.add( QEvent.ObjectNameChange )
+
+    # Events that (may) change the names of the receiver's children
+    ChildrenChangedEventTypes = set( [ QEvent.ChildAdded,
+                                       QEvent.ChildRemoved ] )
+
+    # Events that (may) make new objects appear in the tree.  
+    # Lookups that are waiting for their target object are woken up when we see them.
+    TreeGrowthEventTypes = set( [ QEvent.ChildAdded,
+                                  QEvent.Show ] )
+    if hasattr(QEvent, 'ObjectNameChange'):
+        TreeGrowthEventTypes.add( QEvent.ObjectNameChange )
+
+    ObjectNameChangeEventType = getattr(QEvent, 'ObjectNameChange', None)
+
+    # Events that (may) change the list of top-level widgets, when sent to a window.
+    ToplevelChangeEventTypes = set( [ QEvent.Show,
+                                      QEvent.Hide,
+                                      QEvent.Close,
+                                      QEvent.DeferredDelete,
+                                      QEvent.ParentChange ] )
+    if hasattr(QEvent, 'ObjectNameChange'):
+        ToplevelChangeEventTypes.add( QEvent.ObjectNameChange )
+
+    PossibleOrphanEventTypes = set( [ QEvent.ChildRemoved,
+                                      QEvent.DeferredDelete,
+                                      QEvent.Close ] )
+
+    # Events that give us a chance to remove a QLineEdit's completer before it is used.
+    CompleterCheckEventTypes = set( [ QEvent.Polish,
+                                      QEvent.Show,
+                                      QEvent.FocusIn ] )
+
+    # All events that require any bookkeeping in notify().  
+    # Other events are passed straight through (unless a subscriber is interested in them).
+    BookkeepingEventTypes = set( [ QEvent.ChildPolished, QEvent.ChildRemoved, QEvent.ChildAdded, QEvent.DeferredDelete ] ) \
+                            | RenamingEventTypes | ChildrenChangedEventTypes | TreeGrowthEventTypes \
+                            | ToplevelChangeEventTypes | PossibleOrphanEventTypes | CompleterCheckEventTypes
     
     def __init__(self, *args, **kwargs):
         super(EventRecordingApp, self).__init__(*args, **kwargs)
         self._notify = functools.partial( QApplication.notify, QApplication.instance() )
 
+        # subscriber -> (event_types, receiver_classes).  See register_interest()
+        self._interests = weakref.WeakKeyDictionary()
+        # subscriber -> number of its slots connected to aboutToNotify.  See connect_subscriber()
+        self._subscriber_connections = weakref.WeakKeyDictionary()
+        self._interested_in_all_events = False
+        self._interesting_event_types = frozenset()
+        self._interesting_receiver_classes = ()
+        self._prefilter_event_types = frozenset(self.BookkeepingEventTypes)
+
         # Since playback speed can be laggy (especially if running from a VM),
         #  we want to give a generous double-click timeout.
         # Unfortunately, this API is NOT supported in Qt5!
@@ -61,37 +123,153 @@ class EventRecordingApp(QApplication):
         # to ensure that it isn't deleted while the app is alive
         # (It does not belong to the MainWindow.)        
         self.recorder_control_window = EventRecorderGui()
+
+        # The EventPlayer, in playback mode (see create_app()).
+        # Callers need it to resume() playback after a breakpoint.
+        self.player = None
     
+    def connect_subscriber(self, slot):
+        """
+        Connect a method of a subscriber to aboutToNotify, 
+        so the events it sees can be limited with register_interest().
+        """
+        subscriber = slot.__self__
+        self._subscriber_connections[subscriber] = self._subscriber_connections.get(subscriber, 0) + 1
+        self.aboutToNotify.connect( slot )
+
+    def disconnect_subscriber(self, slot):
+        self.aboutToNotify.disconnect( slot )
+        subscriber = slot.__self__
+        count = self._subscriber_connections.get(subscriber, 0) - 1
+        if count > 0:
+            self._subscriber_connections[subscriber] = count
+        else:
+            self._subscriber_connections.pop(subscriber, None)
+        self._update_interests()
+
+    def register_interest(self, subscriber, event_types=None, receiver_classes=None):
+        """
+        Declare which events the given subscriber (connected to aboutToNotify via connect_subscriber()) needs to see.
+        Calling this again for the same subscriber replaces its previous interest.
+
+        event_types: A collection of QEvent types.
+        receiver_classes: A tuple of classes.  All events sent to instances of these classes are interesting.
+        If neither is provided, the subscriber is interested in all events.
+        """
+        if event_types is not None:
+            event_types = frozenset(event_types)
+        self._interests[subscriber] = ( event_types, tuple(receiver_classes or ()) )
+        self._update_interests()
+
+    def unregister_interest(self, subscriber):
+        self._interests.pop(subscriber, None)
+        self._update_interests()
+
+    def connectNotify(self, signal):
+        super(EventRecordingApp, self).connectNotify(signal)
+        if 'aboutToNotify' in str(signal) and hasattr(self, '_interests'):
+            self._update_interests()
+
+    def disconnectNotify(self, signal):
+        super(EventRecordingApp, self).disconnectNotify(signal)
+        if 'aboutToNotify' in str(signal) and hasattr(self, '_interests'):
+            self._update_interests()
+
+    def _update_interests(self):
+        # Listeners that never called register_interest() (or weren't connected via connect_subscriber()) 
+        #  still expect to see every event.
+        registered_connections = sum( count for subscriber, count in self._subscriber_connections.items()
+                                      if subscriber in self._interests )
+        interested_in_all_events = ( self.receivers(self._AboutToNotifySignature) > registered_connections )
+        event_types = set()
+        receiver_classes = ()
+        for subscriber_event_types, subscriber_receiver_classes in self._interests.values():
+            if subscriber_event_types is None and not subscriber_receiver_classes:
+                interested_in_all_events = True
+            event_types |= (subscriber_event_types or set())
+            receiver_classes += subscriber_receiver_classes
+        self._interested_in_all_events = interested_in_all_events
+        self._interesting_event_types = frozenset(event_types)
+        self._interesting_receiver_classes = receiver_classes
+        self._prefilter_event_types = frozenset( self.BookkeepingEventTypes | event_types )
+
     def notify(self, receiver, event):
+        # Fast path: Nobody needs to see this event.
+        if not self._interested_in_all_events \
+           and event.type() not in self._prefilter_event_types \
+           and not self._interesting_receiver_classes \
+           and instrumentation.active is None:
+            if sip.isdeleted(receiver):
+                return False
+            return self._notify( receiver, event )
+
         if sip.isdeleted(receiver):
             return False
         
         f = self._notify
+        inst = instrumentation.active
+        t_start = inst and inst.start()
 
         # Special hack: Remove completers from all QLineEdits.
         # They tend to cause timing issues during playback.
-        if isinstance(receiver, QLineEdit):
+        # (We only need to check before the QLineEdit could use its completer.)
+        if event.type() in self.CompleterCheckEventTypes and isinstance(receiver, QLineEdit) \
+           and receiver.completer() is not None:
             receiver.setCompleter(None)
 
         # Whenever a new object is created and added to a parent, 
         #  we update the special unique_child_index attribute for that new object and any siblings.
         # Note: Since this is sent by the event system, there may be several queued up "child polished" events to be processed at once.
-        # The assign_unique_child_index function does not assume that this is the ONLY new object that needs a unique id assigned to it.
+        # Indexes are assigned in a batch once they have all been processed.  (See schedule_unique_child_index())
         if event.type() == QEvent.ChildPolished:
-            child = event.child()
-            remove_unique_child_index(child)
-            assign_unique_child_index(child)
+            schedule_unique_child_index(event.child())
         if event.type() == QEvent.ChildRemoved:
             child = event.child()
-            remove_unique_child_index(child)
+            remove_unique_child_index(child, receiver)
+            forget_named_object(child)
+            remove_child_name(receiver, child)
+        if event.type() == QEvent.ChildAdded:
+            # (Don't touch the new child yet: it may still be under construction.)
+            invalidate_child_names(receiver)
+        if event.type() == self.ObjectNameChangeEventType:
+            invalidate_child_names( QObject.parent(receiver) )
 
-        # If gc is collected while this signal is handled,
-        #  this object may no longer be valid.
-        # If that's the case, this event is not important, anyway
-        self.aboutToNotify.emit(receiver, event)
-        if sip.isdeleted(receiver):
-            return False
+        # A widget that was just reparented may have become a window, or stopped being one.
+        if event.type() in self.ToplevelChangeEventTypes and isinstance(receiver, QWidget) \
+           and (receiver.isWindow() or event.type() == QEvent.ParentChange):
+            invalidate_toplevel_widgets()
+
+        # Discard cached names that may have just become stale.
+        # ChildAdded/ChildRemoved can cause siblings to be renamed, so we invalidate the 
+        #  receiver (the parent), which also invalidates all of its children.
+        if event.type() in self.RenamingEventTypes or event.type() in self.ChildrenChangedEventTypes:
+            invalidate_qualified_name(receiver)
+
+        # Discard index entries for objects that were renamed, moved, or are about to be deleted.
+        if event.type() in self.RenamingEventTypes or event.type() == QEvent.DeferredDelete:
+            forget_named_object(receiver)
+
+        if event.type() in self.TreeGrowthEventTypes:
+            notify_tree_changed()
+
+        # These events indicate that an object may have been orphaned,
+        #  so the next name lookup should be preceded by a garbage collection.
+        if event.type() in self.PossibleOrphanEventTypes:
+            default_collection_policy.request_collection()
+
+        if inst: inst.lap('bookkeeping', int(event.type()), type(receiver), t_start)
+
+        if self._interested_in_all_events \
+           or event.type() in self._interesting_event_types \
+           or (self._interesting_receiver_classes and isinstance(receiver, self._interesting_receiver_classes)):
+            # If gc is collected while this signal is handled,
+            #  this object may no longer be valid.
+            # If that's the case, this event is not important, anyway
+            self.aboutToNotify.emit(receiver, event)
+            if sip.isdeleted(receiver):
+                return False
 
+        if inst: inst.lap('notify', int(event.type()), type(receiver), t_start)
         return f( receiver, event )
 
     def getMainWindow(self):
@@ -125,13 +303,20 @@ class EventRecordingApp(QApplication):
                    playback_speed=1.0,
                    comment_display=None,
                    finish_callback=None,
+                   timing_report_path=None,
+                   playback_start=None,
+                   playback_stop=None,
+                   breakpoints=(),
                    qapp_args=([],)):
         """
         Create the application.
 
         mode: must be either 'record' or 'playback'.
         playback_script: Path to a previously recorded playback script.  Used only if mode='playback'
-        playback_speed, comment_display, finish_callback: See EventPlayer and EventPlayer.play_script()
+        playback_speed, comment_display, timing_report_path, finish_callback: See EventPlayer and EventPlayer.play_script()
+                        (Use playback_speed=EventPlayer.IDLE to send each event as soon as the app is idle.)
+        playback_start, playback_stop, breakpoints: Play only part of the recording.  See EventPlayer.play_script()
+                        (At a breakpoint, playback pauses until app.player.resume() is called.)
         qapp_args: The list of arguments to provide to the QApplication constructor.
         """
         QApplication.setAttribute(Qt.AA_DontUseNativeMenuBar, True)
@@ -143,11 +328,14 @@ class EventRecordingApp(QApplication):
             QTimer.singleShot( 110, app.recorder_control_window.activateWindow )
         elif mode == 'playback':
             from eventcapture.eventPlayer import EventPlayer
-            player = EventPlayer(playback_speed, comment_display)
+            from eventcapture.playbackRunner import wrap_finish_callback
+            # If we were launched by the playback runner, report the result to it.
+            finish_callback = wrap_finish_callback(finish_callback)
+            player = app.player = EventPlayer(playback_speed, comment_display, timing_report_path=timing_report_path)
             # Playback must be launched from within the event loop,
             # after application has started up.
             assert playback_script is not None, "Can't playback without a playback script path!"
-            QTimer.singleShot( 0, lambda: player.play_script(playback_script, finish_callback) )
+            QTimer.singleShot( 0, lambda: player.play_script(playback_script, finish_callback, playback_start, playback_stop, breakpoints) )
         else:
             assert False, "Unknown mode: {}".format( mode )
         
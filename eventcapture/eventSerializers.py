@@ -26,93 +26,324 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
-from PyQt4.QtCore import QEvent, QPoint
+from PyQt4.QtCore import Qt, QEvent, QPoint, QSize
 from PyQt4.QtGui import QMouseEvent, QWheelEvent, QKeyEvent, QMoveEvent, QWindowStateChangeEvent, \
                         QResizeEvent, QContextMenuEvent, QCloseEvent, QApplication
 
 from eventTypeNames import get_event_type_name, get_mouse_button_string, get_key_modifiers_string
 
-event_serializers = {}
+##
+## Events are serialized in two steps:
+##
+## 1. When an event is captured, an 'extractor' copies its primitive fields: (event type, args, text)
+##    where args is a tuple of at most MaxEventArgs ints, and text is a string (or None).
+## 2. When the recording is saved, a 'formatter' converts those fields into a string that can be eval'd in Python.
+##
+## That way, no string formatting happens while the user is interacting with the app.
+##
+
+class EventKinds(object):
+    """
+    Identifies the extractor/formatter pair for each supported event class.
+    """
+    Comment = 0
+    Mouse = 1
+    Wheel = 2
+    Key = 3
+    Move = 4
+    ContextMenu = 5
+    Resize = 6
+    WindowStateChange = 7
+    Close = 8
+    Generic = 9
+
+MaxEventArgs = 8
 
-def register_serializer(eventType):
+event_extractors = {}
+event_formatters = {}
+event_constructors = {}
+
+def register_extractor(eventType, kind):
+    def _dec(f):
+        event_extractors[eventType] = (kind, f)
+        return f
+    return _dec
+
+def register_formatter(kind):
     def _dec(f):
-        event_serializers[eventType] = f
+        event_formatters[kind] = f
         return f
     return _dec
 
+def register_constructor(kind):
+    def _dec(f):
+        event_constructors[kind] = f
+        return f
+    return _dec
+
+def extract_event_fields(e):
+    """
+    Copy the primitive fields of the given event.
+    Returns (kind, event_type, args, text).
+    Raises KeyError if we don't know how to serialize this type of event.
+    """
+    kind, extractor = event_extractors[type(e)]
+    event_type, args, text = extractor(e)
+    return kind, event_type, args, text
+
+def format_event_fields(kind, event_type, args, text):
+    """
+    Convert the fields returned by extract_event_fields() into a string that can be eval'd in Python.
+    """
+    return event_formatters[kind](event_type, args, text)
+
+def event_from_fields(kind, event_type, args, text):
+    """
+    The inverse of extract_event_fields(): Construct a new event from the given fields.
+    (Global positions are computed relative to the current position of the main window.)
+    """
+    return event_constructors[kind](event_type, args, text)
+
 def event_to_string(e):
     """
     Convert the given event into a string that can be eval'd in Python.
     """
-    return event_serializers[type(e)](e)
+    return format_event_fields( *extract_event_fields(e) )
 
 ##
 ## Note: Some events use 'global' coordinates, which are global to the screen (not the main window).
 ##       We serialize the coordinates relative to the main window's corner window, 
 ##        and then calculate the global coordinates from the relative ones during playback.
 ##       This allows us to not worry about moving the main window around the screen while we're recording test cases.
+##       (The main window position must be read at capture time, so the extractors compute the relative position.)
 ##
 
-@register_serializer(QMouseEvent)
-def QMouseEvent_to_string(mouseEvent):
-    type_name = get_event_type_name( mouseEvent.type() )
-    button_str = get_mouse_button_string(mouseEvent.button())
-    buttons_str = get_mouse_button_string(mouseEvent.buttons())
-    key_str = get_key_modifiers_string(mouseEvent.modifiers())
+def _relative_global_pos(event):
     mainwin = QApplication.instance().getMainWindow()
     topLeftCorner_global = mainwin.mapToGlobal( QPoint(0,0) )
-    relPos = mouseEvent.globalPos() - topLeftCorner_global
-    return "PyQt4.QtGui.QMouseEvent({}, {}, mainwin.mapToGlobal( QPoint(0,0) ) + {}, {}, {}, {})".format( type_name, mouseEvent.pos(), relPos, button_str, buttons_str, key_str )
+    return event.globalPos() - topLeftCorner_global
 
-@register_serializer(QWheelEvent)
-def QWheelEvent_to_string(wheelEvent):
-    buttons_str = get_mouse_button_string(wheelEvent.buttons())
-    key_str = get_key_modifiers_string(wheelEvent.modifiers())
-    mainwin = QApplication.instance().getMainWindow()
-    topLeftCorner_global = mainwin.mapToGlobal( QPoint(0,0) )
-    relPos = wheelEvent.globalPos() - topLeftCorner_global
-    return "PyQt4.QtGui.QWheelEvent({}, mainwin.mapToGlobal( QPoint(0,0) ) + {}, {}, {}, {}, {})".format( wheelEvent.pos(), relPos, wheelEvent.delta(), buttons_str, key_str, wheelEvent.orientation() )
+def _point_str(x, y):
+    return "PyQt4.QtCore.QPoint({}, {})".format(x, y)
+
+def _size_str(w, h):
+    return "PyQt4.QtCore.QSize({}, {})".format(w, h)
+
+@register_extractor(QMouseEvent, EventKinds.Mouse)
+def QMouseEvent_fields(mouseEvent):
+    pos = mouseEvent.pos()
+    relPos = _relative_global_pos(mouseEvent)
+    args = ( pos.x(), pos.y(), relPos.x(), relPos.y(),
+             int(mouseEvent.button()), int(mouseEvent.buttons()), int(mouseEvent.modifiers()) )
+    return int(mouseEvent.type()), args, None
+
+@register_formatter(EventKinds.Mouse)
+def QMouseEvent_to_string(event_type, args, text):
+    x, y, rel_x, rel_y, button, buttons, modifiers = args[:7]
+    type_name = get_event_type_name( event_type )
+    button_str = get_mouse_button_string(button)
+    buttons_str = get_mouse_button_string(buttons)
+    key_str = get_key_modifiers_string(modifiers)
+    return "PyQt4.QtGui.QMouseEvent({}, {}, mainwin.mapToGlobal( QPoint(0,0) ) + {}, {}, {}, {})".format( type_name, _point_str(x, y), _point_str(rel_x, rel_y), button_str, buttons_str, key_str )
 
-@register_serializer(QKeyEvent)
-def QKeyEvent_to_string(keyEvent):
-    text = str(keyEvent.text())
+@register_extractor(QWheelEvent, EventKinds.Wheel)
+def QWheelEvent_fields(wheelEvent):
+    pos = wheelEvent.pos()
+    relPos = _relative_global_pos(wheelEvent)
+    args = ( pos.x(), pos.y(), relPos.x(), relPos.y(), wheelEvent.delta(),
+             int(wheelEvent.buttons()), int(wheelEvent.modifiers()), int(wheelEvent.orientation()) )
+    return int(wheelEvent.type()), args, None
+
+@register_formatter(EventKinds.Wheel)
+def QWheelEvent_to_string(event_type, args, text):
+    x, y, rel_x, rel_y, delta, buttons, modifiers, orientation = args[:8]
+    buttons_str = get_mouse_button_string(buttons)
+    key_str = get_key_modifiers_string(modifiers)
+    return "PyQt4.QtGui.QWheelEvent({}, mainwin.mapToGlobal( QPoint(0,0) ) + {}, {}, {}, {}, {})".format( _point_str(x, y), _point_str(rel_x, rel_y), delta, buttons_str, key_str, orientation )
+
+@register_extractor(QKeyEvent, EventKinds.Key)
+def QKeyEvent_fields(keyEvent):
+    args = ( keyEvent.key(), int(keyEvent.modifiers()), int(keyEvent.isAutoRepeat()), keyEvent.count() )
+    return int(keyEvent.type()), args, str(keyEvent.text())
+
+@register_formatter(EventKinds.Key)
+def QKeyEvent_to_string(event_type, args, text):
+    key, modifiers, autorepeat, count = args[:4]
     text = text.replace('\n', '\\n')
     text = text.replace('"', '\\"')
     text = text.replace("'", "\\'")
     text = '"""' + text + '"""'
-    type_name = get_event_type_name( keyEvent.type() )
-    mod_str = get_key_modifiers_string(keyEvent.modifiers())
-    return "PyQt4.QtGui.QKeyEvent({}, 0x{:x}, {}, {}, {}, {})".format( type_name, keyEvent.key(), mod_str, text, keyEvent.isAutoRepeat(), keyEvent.count() )
+    type_name = get_event_type_name( event_type )
+    mod_str = get_key_modifiers_string(modifiers)
+    return "PyQt4.QtGui.QKeyEvent({}, 0x{:x}, {}, {}, {}, {})".format( type_name, key, mod_str, text, bool(autorepeat), count )
 
-@register_serializer(QMoveEvent)
-def QMoveEvent_to_string(moveEvent):
-    return "PyQt4.QtGui.QMoveEvent({}, {})".format( moveEvent.pos(), moveEvent.oldPos() )
+@register_extractor(QMoveEvent, EventKinds.Move)
+def QMoveEvent_fields(moveEvent):
+    pos = moveEvent.pos()
+    oldPos = moveEvent.oldPos()
+    return int(moveEvent.type()), ( pos.x(), pos.y(), oldPos.x(), oldPos.y() ), None
 
-@register_serializer(QContextMenuEvent)
-def QContextMenuEvent_to_string(contextMenuEvent):
-    key_str = get_key_modifiers_string(contextMenuEvent.modifiers())
-    mainwin = QApplication.instance().getMainWindow()
-    topLeftCorner_global = mainwin.mapToGlobal( QPoint(0,0) )
-    relPos = contextMenuEvent.globalPos() - topLeftCorner_global
-    return "PyQt4.QtGui.QContextMenuEvent({}, {}, mainwin.mapToGlobal( QPoint(0,0) ) + {}, {})".format( int(contextMenuEvent.reason()), contextMenuEvent.pos(), relPos, key_str )
+@register_formatter(EventKinds.Move)
+def QMoveEvent_to_string(event_type, args, text):
+    x, y, old_x, old_y = args[:4]
+    return "PyQt4.QtGui.QMoveEvent({}, {})".format( _point_str(x, y), _point_str(old_x, old_y) )
+
+@register_extractor(QContextMenuEvent, EventKinds.ContextMenu)
+def QContextMenuEvent_fields(contextMenuEvent):
+    pos = contextMenuEvent.pos()
+    relPos = _relative_global_pos(contextMenuEvent)
+    args = ( int(contextMenuEvent.reason()), pos.x(), pos.y(), relPos.x(), relPos.y(), int(contextMenuEvent.modifiers()) )
+    return int(contextMenuEvent.type()), args, None
+
+@register_formatter(EventKinds.ContextMenu)
+def QContextMenuEvent_to_string(event_type, args, text):
+    reason, x, y, rel_x, rel_y, modifiers = args[:6]
+    key_str = get_key_modifiers_string(modifiers)
+    return "PyQt4.QtGui.QContextMenuEvent({}, {}, mainwin.mapToGlobal( QPoint(0,0) ) + {}, {})".format( reason, _point_str(x, y), _point_str(rel_x, rel_y), key_str )
+
+@register_extractor(QResizeEvent, EventKinds.Resize)
+def QResizeEvent_fields(resizeEvent):
+    size = resizeEvent.size()
+    oldSize = resizeEvent.oldSize()
+    return int(resizeEvent.type()), ( size.width(), size.height(), oldSize.width(), oldSize.height() ), None
 
-@register_serializer(QResizeEvent)
-def QResizeEvent_to_string(resizeEvent):
-    return "PyQt4.QtGui.QResizeEvent({}, {})".format( resizeEvent.size(), resizeEvent.oldSize() )
+@register_formatter(EventKinds.Resize)
+def QResizeEvent_to_string(event_type, args, text):
+    w, h, old_w, old_h = args[:4]
+    return "PyQt4.QtGui.QResizeEvent({}, {})".format( _size_str(w, h), _size_str(old_w, old_h) )
 
-@register_serializer(QWindowStateChangeEvent)
-def QWindowStateChangeEvent_to_string(windowStateChangeEvent):
-    return "PyQt4.QtGui.QWindowStateChangeEvent(0x{:x})".format( int(windowStateChangeEvent.oldState()) )
+@register_extractor(QWindowStateChangeEvent, EventKinds.WindowStateChange)
+def QWindowStateChangeEvent_fields(windowStateChangeEvent):
+    return int(windowStateChangeEvent.type()), ( int(windowStateChangeEvent.oldState()), ), None
 
-@register_serializer(QCloseEvent)
-def QCloseEvent_to_string(closeEvent):
+@register_formatter(EventKinds.WindowStateChange)
+def QWindowStateChangeEvent_to_string(event_type, args, text):
+    return "PyQt4.QtGui.QWindowStateChangeEvent(0x{:x})".format( args[0] )
+
+@register_extractor(QCloseEvent, EventKinds.Close)
+def QCloseEvent_fields(closeEvent):
+    return int(closeEvent.type()), (), None
+
+@register_formatter(EventKinds.Close)
+def QCloseEvent_to_string(event_type, args, text):
     return "PyQt4.QtGui.QCloseEvent()"
 
-@register_serializer(QEvent)
-def QEvent_to_string(event):
-    type_name = get_event_type_name( event.type() )
+@register_extractor(QEvent, EventKinds.Generic)
+def QEvent_fields(event):
+    return int(event.type()), (), None
+
+@register_formatter(EventKinds.Generic)
+def QEvent_to_string(event_type, args, text):
+    type_name = get_event_type_name( event_type )
     # Some event types are not exposed in pyqt as symbols
     if not hasattr( QEvent, type_name.split('.')[1] ):
-        type_name = int(event.type())
+        type_name = event_type
     return "PyQt4.QtCore.QEvent({})".format( type_name )
 
+##
+## Constructors (used when playing a recording that isn't a Python script)
+##
+
+def _global_pos(rel_x, rel_y):
+    mainwin = QApplication.instance().getMainWindow()
+    return mainwin.mapToGlobal( QPoint(0,0) ) + QPoint(rel_x, rel_y)
+
+@register_constructor(EventKinds.Mouse)
+def QMouseEvent_from_fields(event_type, args, text):
+    x, y, rel_x, rel_y, button, buttons, modifiers = args[:7]
+    return QMouseEvent( QEvent.Type(event_type), QPoint(x, y), _global_pos(rel_x, rel_y), 
+                        Qt.MouseButton(button), Qt.MouseButtons(buttons), Qt.KeyboardModifiers(modifiers) )
+
+@register_constructor(EventKinds.Wheel)
+def QWheelEvent_from_fields(event_type, args, text):
+    x, y, rel_x, rel_y, delta, buttons, modifiers, orientation = args[:8]
+    return QWheelEvent( QPoint(x, y), _global_pos(rel_x, rel_y), delta, 
+                        Qt.MouseButtons(buttons), Qt.KeyboardModifiers(modifiers), Qt.Orientation(orientation) )
+
+@register_constructor(EventKinds.Key)
+def QKeyEvent_from_fields(event_type, args, text):
+    key, modifiers, autorepeat, count = args[:4]
+    return QKeyEvent( QEvent.Type(event_type), key, Qt.KeyboardModifiers(modifiers), text, bool(autorepeat), count )
+
+@register_constructor(EventKinds.Move)
+def QMoveEvent_from_fields(event_type, args, text):
+    x, y, old_x, old_y = args[:4]
+    return QMoveEvent( QPoint(x, y), QPoint(old_x, old_y) )
+
+@register_constructor(EventKinds.ContextMenu)
+def QContextMenuEvent_from_fields(event_type, args, text):
+    reason, x, y, rel_x, rel_y, modifiers = args[:6]
+    return QContextMenuEvent( QContextMenuEvent.Reason(reason), QPoint(x, y), _global_pos(rel_x, rel_y), Qt.KeyboardModifiers(modifiers) )
+
+@register_constructor(EventKinds.Resize)
+def QResizeEvent_from_fields(event_type, args, text):
+    w, h, old_w, old_h = args[:4]
+    return QResizeEvent( QSize(w, h), QSize(old_w, old_h) )
+
+@register_constructor(EventKinds.WindowStateChange)
+def QWindowStateChangeEvent_from_fields(event_type, args, text):
+    return QWindowStateChangeEvent( Qt.WindowStates(args[0]) )
+
+@register_constructor(EventKinds.Close)
+def QCloseEvent_from_fields(event_type, args, text):
+    return QCloseEvent()
+
+@register_constructor(EventKinds.Generic)
+def QEvent_from_fields(event_type, args, text):
+    return QEvent( QEvent.Type(event_type) )
+
+def write_playback_script(fileobj, author_name, start_time, records):
+    """
+    Write a playback script (i.e. a Python module that defines playback_events()).
+    
+    records: An iterable of (kind, event_type, args, text, objname, timestamp_in_seconds), 
+             e.g. from a CapturedEventBuffer.  For comments, kind is EventKinds.Comment and text is the comment.
+    """
+    # Write header comments
+    fileobj.write(
+"""
+# Event Recording
+# Created by {}
+# Started at: {}
+""".format( author_name, str(start_time) ) )
+
+    # Write playback function definition
+    fileobj.write(
+"""
+def playback_events(player):
+    import PyQt4.QtCore
+    from PyQt4.QtCore import Qt, QEvent, QPoint
+    import PyQt4.QtGui
+    
+    # The getMainWindow() function is provided by EventRecorderApp
+    mainwin = PyQt4.QtGui.QApplication.instance().getMainWindow()
+
+    player.display_comment("SCRIPT STARTING")
+
+""")
+
+    # Write all events and comments
+    for kind, event_type, args, text, objname, timestamp_in_seconds in records:
+        if kind == EventKinds.Comment:
+            eventstr = text
+            eventstr = eventstr.replace('\\', '\\\\')
+            eventstr = eventstr.replace('"', '\\"')
+            eventstr = eventstr.replace("'", "\\'")
+            fileobj.write(
+"""
+    ########################
+    player.display_comment(\"""{eventstr}\""")
+    ########################
+""".format( **locals() ) )
+        else:
+            eventstr = format_event_fields( kind, event_type, args, text )
+            fileobj.write(
+"""
+    event = {eventstr}
+    player.post_event( '{objname}', event , {timestamp_in_seconds} )
+""".format( **locals() )
+)
+    fileobj.write(
+"""
+    player.display_comment("SCRIPT COMPLETE")
+""")
@@ -31,24 +31,24 @@ from PyQt4.QtCore import Qt
 def get_event_type_name( event_type ):
     return EventTypeNameDict[event_type]
 
-def get_mouse_button_string(buttons):
-    buttonNames = [ ('Qt.LeftButton',   0x00000001),
-                    ('Qt.RightButton',  0x00000002),
-                    ('Qt.MiddleButton', 0x00000004),
-                    ('Qt.XButton1',     0x00000008),
-                    ('Qt.XButton2',     0x00000010) ]
+MouseButtonNames = [ ('Qt.LeftButton',   0x00000001),
+                     ('Qt.RightButton',  0x00000002),
+                     ('Qt.MiddleButton', 0x00000004),
+                     ('Qt.XButton1',     0x00000008),
+                     ('Qt.XButton2',     0x00000010) ]
+
+KeyModifierNames = [ ('Qt.ShiftModifier',       0x02000000),
+                     ('Qt.ControlModifier',     0x04000000),
+                     ('Qt.AltModifier',         0x08000000),
+                     ('Qt.MetaModifier',        0x10000000),
+                     ('Qt.KeypadModifier',      0x20000000),
+                     ('Qt.GroupSwitchModifier', 0x40000000) ]
 
-    return _get_flags_string(buttons, 'Qt.NoButton', buttonNames)
+def get_mouse_button_string(buttons):
+    return _get_flags_string(buttons, 'Qt.NoButton', MouseButtonNames)
 
 def get_key_modifiers_string(modifiers):
-    modifierNames = [ ('Qt.ShiftModifier',       0x02000000),
-                      ('Qt.ControlModifier',     0x04000000),
-                      ('Qt.AltModifier',         0x08000000),
-                      ('Qt.MetaModifier',        0x10000000),
-                      ('Qt.KeypadModifier',      0x20000000),
-                      ('Qt.GroupSwitchModifier', 0x40000000) ]
-
-    return _get_flags_string(modifiers, 'Qt.NoModifier', modifierNames)
+    return _get_flags_string(modifiers, 'Qt.NoModifier', KeyModifierNames)
 
 def get_focus_reason_string(reason):
     reasonStrings = { Qt.MouseFocusReason : 'Qt.MouseFocusReason',
@@ -312,7 +312,10 @@ class EventTypes(object):
 EventTypeNameDict = {}
 for k,v in EventTypes.__dict__.items():
     EventTypeNameDict[v] = 'QEvent.' + k
-    
-
 
-            
\ No newline at end of file
+# Reverse lookup for the symbolic names used in playback scripts, e.g. 'QEvent.MouseMove' or 'Qt.LeftButton'
+SymbolValueDict = dict( (name, value) for value, name in EventTypeNameDict.items() if isinstance(value, int) )
+SymbolValueDict.update( MouseButtonNames )
+SymbolValueDict.update( KeyModifierNames )
+SymbolValueDict['Qt.NoButton'] = 0
+SymbolValueDict['Qt.NoModifier'] = 0
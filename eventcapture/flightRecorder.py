@@ -0,0 +1,115 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import signal
+import datetime
+import tempfile
+
+from PyQt4.QtCore import QTimer
+
+from eventRecorder import EventRecorder
+from capturedEvents import EventRingBuffer
+from eventSerializers import EventKinds, write_playback_script
+
+import logging
+logger = logging.getLogger(__name__)
+
+class FlightRecorder(EventRecorder):
+    """
+    An always-on EventRecorder that keeps only the most recent events in a fixed-size ring buffer.
+
+    The buffer can be dumped as a normal playback script at any time via dump(),
+    and it is dumped automatically on an unhandled exception (via sys.excepthook)
+    and when the process receives ``dump_signal``.
+    """
+    def __init__(self, capacity=10000, max_age=None, dump_dir=None, 
+                 install_excepthook=True, dump_signal=getattr(signal, 'SIGUSR1', None), **kwargs):
+        """
+        capacity: The maximum number of events to keep.
+        max_age: If provided, dumps only include the events from the last max_age seconds.
+        dump_dir: Where automatic dumps are written.  Defaults to the temp directory.
+        install_excepthook: If True, dump the buffer whenever an unhandled exception reaches sys.excepthook.
+        dump_signal: Dump the buffer (from the event loop) whenever this signal is received.  (None means don't install a signal handler.)
+        kwargs: Passed to EventRecorder.__init__
+        """
+        EventRecorder.__init__( self, event_store=EventRingBuffer(capacity, max_age), **kwargs )
+        self._dump_dir = dump_dir or tempfile.gettempdir()
+
+        if install_excepthook:
+            self._prev_excepthook = sys.excepthook
+            sys.excepthook = self._excepthook
+        if dump_signal is not None:
+            signal.signal( dump_signal, self._signal_handler )
+
+        # Always on.
+        self.unpause()
+
+    def dump(self, path=None, reason="requested"):
+        """
+        Write the buffered events as a playback script.
+        Timestamps are shifted so that playback starts immediately.
+        Returns the path of the script.
+        """
+        if path is None:
+            timestr = datetime.datetime.now().strftime("%Y%m%d-%H%M%S")
+            path = os.path.join( self._dump_dir, "flight-recording-{}-{}.py".format( timestr, os.getpid() ) )
+        self.flush()
+        with open(path, 'w') as f:
+            write_playback_script( f, "eventcapture flight recorder", self._timer.start_time, self._rebased_records(reason) )
+        logger.info( "Flight recorder dumped to {} ({})".format( path, reason ) )
+        return path
+
+    def _rebased_records(self, reason):
+        yield (EventKinds.Comment, 0, (), "Flight recorder dump ({})".format( reason ), "comment", None)
+        first_timestamp = None
+        for kind, event_type, args, text, objname, timestamp_in_seconds in self._captured_events:
+            if timestamp_in_seconds is not None:
+                if first_timestamp is None:
+                    first_timestamp = timestamp_in_seconds
+                timestamp_in_seconds = round( timestamp_in_seconds - first_timestamp, 6 )
+            yield kind, event_type, args, text, objname, timestamp_in_seconds
+
+    def _excepthook(self, *exc_info):
+        try:
+            self.dump( reason="unhandled {}".format( exc_info[0].__name__ ) )
+        except:
+            logger.error( "Flight recorder failed to dump its buffer", exc_info=True )
+        self._prev_excepthook(*exc_info)
+
+    def _signal_handler(self, signum, frame):
+        # The handler can interrupt the main thread anywhere (even while it holds a lock that dump() needs),
+        # so don't dump from here.  Let the event loop do it as soon as it can.
+        QTimer.singleShot( 0, lambda: self._dump_on_signal(signum) )
+
+    def _dump_on_signal(self, signum):
+        try:
+            self.dump( reason="signal {}".format( signum ) )
+        except:
+            logger.error( "Flight recorder failed to dump its buffer", exc_info=True )
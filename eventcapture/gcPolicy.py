@@ -0,0 +1,126 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import gc
+import threading
+
+class CollectionPolicy(object):
+    """
+    Decides when a full garbage collection is needed before resolving widget names.
+
+    Lingering (orphaned, but not yet collected) widgets can have names that conflict 
+    with live widgets, so both the recorder and the player used to run gc.collect() 
+    before every event.  With a large heap, that is very expensive.
+    This policy only collects when an object may actually have been orphaned since 
+    the last collection, i.e. after EventRecordingApp.notify() saw a ChildRemoved, 
+    DeferredDelete, or Close event, or after a name lookup turned out to be ambiguous.
+
+    Modes:
+    
+    - 'always': Run a full collection for every event (the old behavior).
+    - 'on-demand': Run a full collection only if something requested it.
+    - 'generation-0': Run a cheap generation-0 collection for every event, 
+                      and a full collection only if something requested it.
+    """
+    ALWAYS = 'always'
+    ON_DEMAND = 'on-demand'
+    GENERATION_0 = 'generation-0'
+    Modes = (ALWAYS, ON_DEMAND, GENERATION_0)
+
+    def __init__(self, mode=ON_DEMAND):
+        self.mode = mode
+        self._lock = threading.Lock()
+        self._requested = True # Start with a collection, just in case.
+        self.reset_counters()
+
+    @property
+    def mode(self):
+        return self._mode
+
+    @mode.setter
+    def mode(self, mode):
+        assert mode in self.Modes, "Unknown garbage collection mode: {}".format( mode )
+        self._mode = mode
+
+    def reset_counters(self):
+        self.full_collections = 0
+        self.partial_collections = 0
+        self.skipped_collections = 0
+        self.requests = 0
+
+    def request_collection(self):
+        """
+        Note that some objects may have been orphaned.
+        The next call to collect() will run a full collection.
+        """
+        # No lock: Assigning a bool is atomic, and this is called from notify() for many events.
+        self._requested = True
+        self.requests += 1
+
+    def collect(self):
+        """
+        Run a garbage collection if the current mode says we need one.
+        Returns True if a full collection was performed.
+        """
+        with self._lock:
+            requested = self._requested
+            self._requested = False
+
+        if self._mode == CollectionPolicy.ALWAYS or requested:
+            gc.collect()
+            self.full_collections += 1
+            return True
+
+        if self._mode == CollectionPolicy.GENERATION_0:
+            gc.collect(0)
+            self.partial_collections += 1
+        else:
+            self.skipped_collections += 1
+        return False
+
+    def collect_for_ambiguous_name(self):
+        """
+        Called when a name lookup found more than one candidate (or none).
+        Collect now (unless we just did) in case the culprit is a lingering dead widget.
+        Returns True if a collection was performed, in which case the lookup is worth retrying.
+        """
+        if self._mode == CollectionPolicy.ALWAYS:
+            # We already collected before this lookup started.
+            return False
+        self.request_collection()
+        return self.collect()
+
+    def counters(self):
+        return { 'mode' : self._mode,
+                 'full_collections' : self.full_collections,
+                 'partial_collections' : self.partial_collections,
+                 'skipped_collections' : self.skipped_collections,
+                 'requests' : self.requests }
+
+# The policy shared by the recorder, the player, and EventRecordingApp.
+default_collection_policy = CollectionPolicy()
@@ -0,0 +1,226 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import math
+import json
+import atexit
+import threading
+from array import array
+from timeit import default_timer as _clock
+
+from eventTypeNames import EventTypeNameDict
+
+class LatencyHistogram(object):
+    """
+    A compact log-linear histogram of durations (in seconds).
+    
+    Each power of two (in nanoseconds) is divided into ``SubBuckets`` linear buckets,
+    so the relative error of any reported percentile is at most 1/SubBuckets.
+    Recording a sample is O(1) and allocates nothing.
+    """
+    SubBuckets = 8
+    MaxExponent = 40 # 2**40 ns is about 18 minutes
+
+    def __init__(self):
+        self._counts = array('L', [0] * (self.MaxExponent * self.SubBuckets))
+        self.count = 0
+        self.total = 0.0
+        self.min = float('inf')
+        self.max = 0.0
+
+    def record(self, seconds):
+        self.count += 1
+        self.total += seconds
+        if seconds < self.min:
+            self.min = seconds
+        if seconds > self.max:
+            self.max = seconds
+        self._counts[self._bucket_index(seconds)] += 1
+
+    def _bucket_index(self, seconds):
+        nanoseconds = seconds * 1e9
+        if nanoseconds < 1.0:
+            return 0
+        mantissa, exponent = math.frexp(nanoseconds) # 0.5 <= mantissa < 1.0
+        index = exponent * self.SubBuckets + int((mantissa - 0.5) * 2 * self.SubBuckets)
+        return min(index, len(self._counts)-1)
+
+    def _bucket_upper_bound(self, index):
+        exponent, sub_bucket = divmod(index, self.SubBuckets)
+        mantissa = 0.5 + (sub_bucket + 1) / (2.0 * self.SubBuckets)
+        return math.ldexp(mantissa, exponent) / 1e9
+
+    def merge(self, other):
+        for i, c in enumerate(other._counts):
+            self._counts[i] += c
+        self.count += other.count
+        self.total += other.total
+        self.min = min(self.min, other.min)
+        self.max = max(self.max, other.max)
+
+    def percentile(self, p):
+        """
+        Return (an upper bound of) the p-th percentile, in seconds.
+        """
+        if self.count == 0:
+            return 0.0
+        threshold = p / 100.0 * self.count
+        seen = 0
+        for index, c in enumerate(self._counts):
+            seen += c
+            if c and seen >= threshold:
+                return min( self._bucket_upper_bound(index), self.max )
+        return self.max
+
+    def mean(self):
+        if self.count == 0:
+            return 0.0
+        return self.total / self.count
+
+    def summary(self):
+        return { 'count' : self.count,
+                 'total' : self.total,
+                 'mean' : self.mean(),
+                 'min' : self.min if self.count else 0.0,
+                 'max' : self.max,
+                 'p50' : self.percentile(50),
+                 'p95' : self.percentile(95),
+                 'p99' : self.percentile(99) }
+
+class Instrumentation(object):
+    """
+    Measures the time spent in eventcapture's hooks, i.e. how much recording slows the application down.
+    
+    Each measurement is recorded in a histogram keyed by (bucket, event type, receiver class).
+    The hooks use these buckets:
+    
+    - 'notify': All of our overhead in EventRecordingApp.notify(), including the recorder.
+    - 'bookkeeping': Child index assignment and cache invalidation in EventRecordingApp.notify()
+    - 'filtering': EventRecorder._shouldSaveEvent()
+    - 'serialization': Copying the event fields.
+    - 'gc': Garbage collection (see gcPolicy.py)
+    - 'name_resolution': get_fully_qualified_name()
+    - 'storage': Handing the event to the event store.
+
+    Hooks use this pattern, which costs nothing more than a global lookup when instrumentation is disabled:
+    
+    .. code-block:: python
+
+        inst = instrumentation.active
+        t = inst and inst.start()
+        do_some_work()
+        if inst: t = inst.lap('some_bucket', event_type, receiver_class, t)
+        do_more_work()
+        if inst: t = inst.lap('another_bucket', event_type, receiver_class, t)
+    """
+    def __init__(self):
+        self._histograms = {}
+        self._lock = threading.Lock()
+
+    def start(self):
+        return _clock()
+
+    def lap(self, bucket, event_type, receiver_class, start):
+        """
+        Record the time since ``start``, and return the current time (for the next lap).
+        """
+        now = _clock()
+        self.record(bucket, event_type, receiver_class, now - start)
+        return now
+
+    def record(self, bucket, event_type, receiver_class, seconds):
+        key = (bucket, event_type, receiver_class)
+        try:
+            histogram = self._histograms[key]
+        except KeyError:
+            with self._lock:
+                histogram = self._histograms.setdefault(key, LatencyHistogram())
+        histogram.record(seconds)
+
+    def reset(self):
+        with self._lock:
+            self._histograms = {}
+
+    def histogram(self, bucket, event_type=None, receiver_class=None):
+        """
+        Return the combined histogram of the given bucket, 
+        optionally restricted to a particular event type and/or receiver class.
+        """
+        combined = LatencyHistogram()
+        for (b, t, c), histogram in self._histograms.items():
+            if b == bucket \
+               and (event_type is None or t == int(event_type)) \
+               and (receiver_class is None or c is receiver_class):
+                combined.merge(histogram)
+        return combined
+
+    def worst_receivers(self, bucket='notify', n=10):
+        """
+        Return the n receiver classes with the highest total time in the given bucket,
+        as a list of (class name, histogram summary).
+        """
+        by_class = {}
+        for (b, t, c), histogram in self._histograms.items():
+            if b == bucket:
+                by_class.setdefault(c, LatencyHistogram()).merge(histogram)
+        ranked = sorted( by_class.items(), key=lambda (c, h): h.total, reverse=True )
+        return [ (c.__name__, h.summary()) for c, h in ranked[:n] ]
+
+    def summary(self):
+        """
+        Return a JSON-friendly dict: { bucket : { event type name : { receiver class name : histogram summary } } }
+        """
+        result = {}
+        for (bucket, event_type, receiver_class), histogram in sorted(self._histograms.items()):
+            type_name = EventTypeNameDict.get(event_type, str(event_type))
+            result.setdefault(bucket, {}).setdefault(type_name, {})[receiver_class.__name__] = histogram.summary()
+        return result
+
+    def dump_json(self, path):
+        with open(path, 'w') as f:
+            json.dump( self.summary(), f, indent=2, sort_keys=True )
+
+# The active Instrumentation, or None if instrumentation is disabled.
+active = None
+
+def enable(dump_path=None):
+    """
+    Start measuring the overhead of eventcapture's hooks.
+    If dump_path is provided, the results are written to it (as JSON) when the process exits.
+    Returns the Instrumentation object, which can be queried at any time.
+    """
+    global active
+    if active is None:
+        active = Instrumentation()
+    if dump_path is not None:
+        atexit.register( active.dump_json, dump_path )
+    return active
+
+def disable():
+    global active
+    active = None
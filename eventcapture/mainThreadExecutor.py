@@ -0,0 +1,158 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import sys
+import threading
+import collections
+from timeit import default_timer as _clock
+
+from PyQt4.QtCore import QObject, QEvent
+from PyQt4.QtGui import QApplication
+
+from instrumentation import LatencyHistogram
+
+class _Call(object):
+    __slots__ = ('func', 'args', 'result', 'exc_info', 'done')
+    def __init__(self, func, args):
+        self.func = func
+        self.args = args
+        self.result = None
+        self.exc_info = None
+        self.done = None
+
+class MainThreadExecutor(QObject):
+    """
+    Runs functions on the main (GUI) thread on behalf of other threads, and returns their results.
+
+    Calls are queued in a deque.  The first call queued while the main thread is idle 
+    posts a single wakeup event, and the main thread then runs every queued call in one 
+    go (one 'hop').  While it does so, the GUI is effectively paused, so a batch of 
+    calls sees a consistent object tree.
+
+    When called from the main thread itself, functions are simply called directly.
+    """
+    WakeupEvent = QEvent.Type(QEvent.registerEventType())
+
+    def __init__(self):
+        super(MainThreadExecutor, self).__init__()
+        self.moveToThread( QApplication.instance().thread() )
+        self._queue = collections.deque()
+        self._lock = threading.Lock()
+        self._wakeup_pending = False
+
+        # Statistics
+        self.hops = 0
+        self.calls = 0
+        self.stall_time = LatencyHistogram() # Time the main thread spent running each batch
+        self.round_trip_time = LatencyHistogram() # Time each caller waited
+
+    def call(self, func, *args):
+        """
+        Run func(*args) on the main thread and return its result (or raise its exception).
+        """
+        return self.call_batch( [(func, args)] )[0]
+
+    def call_batch(self, calls):
+        """
+        Run a list of (func, args) on the main thread, in a single hop.
+        Returns the list of results.  If any call raises, the exception is re-raised here 
+        (after the whole batch has run).
+        """
+        calls = [ _Call(func, args) for func, args in calls ]
+        if threading.current_thread().name == "MainThread":
+            self._run(calls)
+        else:
+            t_start = _clock()
+            done = threading.Event()
+            for c in calls:
+                c.done = done
+            with self._lock:
+                self._queue.extend(calls)
+                wakeup = not self._wakeup_pending
+                self._wakeup_pending = True
+            if wakeup:
+                QApplication.postEvent( self, QEvent(MainThreadExecutor.WakeupEvent) )
+            done.wait()
+            self.round_trip_time.record( _clock() - t_start )
+
+        for c in calls:
+            if c.exc_info is not None:
+                raise c.exc_info[0], c.exc_info[1], c.exc_info[2]
+        return [ c.result for c in calls ]
+
+    def event(self, e):
+        if e.type() == MainThreadExecutor.WakeupEvent:
+            assert threading.current_thread().name == "MainThread"
+            with self._lock:
+                calls = list(self._queue)
+                self._queue.clear()
+                self._wakeup_pending = False
+            t_start = _clock()
+            self._run(calls)
+            self.stall_time.record( _clock() - t_start )
+            self.hops += 1
+            for c in calls:
+                c.done.set()
+            return True
+        return super(MainThreadExecutor, self).event(e)
+
+    def _run(self, calls):
+        for c in calls:
+            self.calls += 1
+            try:
+                c.result = c.func(*c.args)
+            except:
+                c.exc_info = sys.exc_info()
+
+    def stats(self):
+        """
+        Summary of the main-thread hops made so far, and how long they took.
+        """
+        return { 'hops' : self.hops,
+                 'calls' : self.calls,
+                 'stall' : self.stall_time.summary(),
+                 'round_trip' : self.round_trip_time.summary() }
+
+_executor = [None]
+_executor_lock = threading.Lock()
+
+def main_thread_executor():
+    """
+    Return the shared MainThreadExecutor, creating it if necessary.
+    """
+    if _executor[0] is None:
+        with _executor_lock:
+            if _executor[0] is None:
+                _executor[0] = MainThreadExecutor()
+    return _executor[0]
+
+def run_in_main_thread(func, *args):
+    """
+    Shortcut for main_thread_executor().call(func, *args)
+    """
+    return main_thread_executor().call(func, *args)
@@ -0,0 +1,190 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import bisect
+
+from PyQt4.QtCore import QEvent
+
+from eventSerializers import EventKinds
+
+import logging
+logger = logging.getLogger(__name__)
+
+def simplify_path(points, tolerance):
+    """
+    Ramer-Douglas-Peucker path simplification.
+    Returns the (sorted) indexes of the points to keep.
+    The first and last points are always kept, and every dropped point 
+    lies within ``tolerance`` pixels of the simplified path.
+    """
+    return sorted( _path_significance(points, tolerance) )
+
+def _path_significance(points, tolerance=None):
+    """
+    Run Ramer-Douglas-Peucker path simplification, and return a dict of { index : significance }
+    for the points it keeps, where the significance is the point's distance from the simplified path 
+    at the time it was added.  (The endpoints have infinite significance.)
+    If tolerance is None, every point is kept (but they are still ranked).
+    """
+    n = len(points)
+    if n <= 2:
+        return dict( (i, float('inf')) for i in xrange(n) )
+
+    keep = { 0 : float('inf'), n-1 : float('inf') }
+    stack = [(0, n-1)]
+    while stack:
+        first, last = stack.pop()
+        (x1, y1), (x2, y2) = points[first], points[last]
+        dx, dy = x2 - x1, y2 - y1
+        seg_length_sq = float(dx*dx + dy*dy)
+
+        max_dist_sq = -1.0
+        max_index = None
+        for i in xrange(first+1, last):
+            px, py = points[i]
+            if seg_length_sq == 0.0:
+                dist_sq = (px - x1)**2 + (py - y1)**2
+            else:
+                # Distance from the point to the line through the segment endpoints
+                cross = dx*(py - y1) - dy*(px - x1)
+                dist_sq = cross*cross / seg_length_sq
+            if dist_sq > max_dist_sq:
+                max_dist_sq = dist_sq
+                max_index = i
+
+        if max_index is not None and (tolerance is None or max_dist_sq > tolerance*tolerance):
+            keep[max_index] = max_dist_sq ** 0.5
+            stack.append( (first, max_index) )
+            stack.append( (max_index, last) )
+
+    return keep
+
+class MotionDecimator(object):
+    """
+    Decimates runs of consecutive MouseMove events before they reach the recorder's event store.
+
+    A 'run' is a sequence of consecutive MouseMove events sent to the same widget 
+    with the same buttons and modifiers.  Any other event (e.g. a press or release) ends the run.
+    Each run is reduced in two steps:
+    
+    1. Path simplification: moves that lie within ``tolerance`` pixels of the simplified path are dropped.
+    2. Rate limiting: of the remaining moves, those that would exceed the widget's max rate are dropped.
+       The most significant moves (the ones farthest from the path without them) are kept first, 
+       so the 'turning points' of the path survive.
+    
+    The first and last move of every run are always kept.
+    Since button or modifier changes end a run, the moves around them are always kept, too.
+    All other events are passed through untouched.
+
+    Has the same append()/append_comment() interface as CapturedEventBuffer, 
+    and forwards everything to the given sink.
+    """
+    def __init__(self, sink, tolerance=2.0, max_rate=None, widget_max_rates=None, max_run_length=1000):
+        """
+        sink: Where the decimated events are stored, e.g. a CapturedEventBuffer.
+        tolerance: Path simplification tolerance, in pixels.  (None means no path simplification.)
+        max_rate: Default maximum number of moves per second per widget (None means no limit).
+        widget_max_rates: dict of { fully-qualified-widget-name : max_rate } to override the default for specific widgets.
+        max_run_length: Runs longer than this are flushed in pieces to keep memory usage bounded.
+        """
+        self._sink = sink
+        self._tolerance = tolerance
+        self._max_rate = max_rate
+        self._widget_max_rates = widget_max_rates or {}
+        self._max_run_length = max_run_length
+
+        self._run = []
+        self._run_key = None
+
+        self.kept = 0
+        self.dropped = 0
+
+    def append(self, kind, event_type, args, text, objname, timestamp_in_seconds):
+        if kind == EventKinds.Mouse and event_type == QEvent.MouseMove:
+            # args: (x, y, rel_x, rel_y, button, buttons, modifiers)
+            run_key = (objname, args[5], args[6])
+            if run_key != self._run_key or len(self._run) >= self._max_run_length:
+                self.flush()
+                self._run_key = run_key
+            self._run.append( (kind, event_type, args, text, objname, timestamp_in_seconds) )
+        else:
+            self.flush()
+            self._sink.append( kind, event_type, args, text, objname, timestamp_in_seconds )
+
+    def append_comment(self, comment, *args):
+        self.flush()
+        self._sink.append_comment(comment, *args)
+
+    def flush(self):
+        """
+        Decimate the current run of moves (if any) and pass the survivors to the sink.
+        """
+        run = self._run
+        self._run = []
+        self._run_key = None
+        if not run:
+            return
+
+        # Step 1: Path simplification
+        points = [ record[2][:2] for record in run ]
+        significance = _path_significance(points, self._tolerance)
+
+        # Step 2: Rate limiting, among the moves that survived step 1.
+        # The most significant moves (e.g. the corners of the path) are considered first, 
+        # and a move is only kept if it isn't too close (in time) to any move we've already kept.
+        max_rate = self._widget_max_rates.get( run[0][4], self._max_rate )
+        if max_rate is None:
+            kept = significance.keys()
+        else:
+            min_interval = 1.0 / max_rate
+            kept = [0, len(run)-1]
+            kept_times = sorted( set( [ run[0][5], run[-1][5] ] ) )
+            by_significance = sorted( significance.items(), key=lambda item: -item[1] )
+            for i, _ in by_significance:
+                if i in (0, len(run)-1):
+                    continue
+                t = run[i][5]
+                pos = bisect.bisect_left(kept_times, t)
+                if (pos == len(kept_times) or kept_times[pos] - t >= min_interval) \
+                   and (pos == 0 or t - kept_times[pos-1] >= min_interval):
+                    kept.append(i)
+                    kept_times.insert(pos, t)
+        survivors = [ run[i] for i in sorted(set(kept)) ]
+
+        for record in survivors:
+            self._sink.append(*record)
+
+        self.kept += len(survivors)
+        self.dropped += len(run) - len(survivors)
+
+    def __iter__(self):
+        self.flush()
+        return iter(self._sink)
+
+    def __len__(self):
+        return len(self._sink) + len(self._run)
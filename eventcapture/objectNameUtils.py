@@ -26,14 +26,28 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import os
 import time
 import threading
+import heapq
+import weakref
+import collections
 
 import sip
-from PyQt4.QtCore import QObject, QTimer, QVariant
+from PyQt4.QtCore import QObject, QEvent, QTimer, QVariant
 from PyQt4.QtGui import QApplication, QWidget, QMenu, QPushButton
 
+from gcPolicy import default_collection_policy
+from mainThreadExecutor import main_thread_executor, run_in_main_thread
+
 class MainThreadPausedContext(QObject):
+    """
+    Pauses the main thread for the duration of the context.
+    
+    .. note:: Every use costs a full round trip to the main thread.  
+              To query the object tree from another thread, prefer the MainThreadExecutor, 
+              which can run a whole batch of queries in one hop.
+    """
     def __init__(self, *args, **kwargs):
         super(MainThreadPausedContext, self).__init__(*args, **kwargs)
         self.moveToThread( QApplication.instance().thread() )
@@ -63,6 +77,32 @@ class MainThreadPausedContext(QObject):
         # Allow the main thread to exit the suspend func
         self._pauser.set()
 
+# The list of top-level widgets is cached until the generation changes.  (See invalidate_toplevel_widgets())
+_toplevel_generation = [0]
+_toplevel_cache = [None, [], {}] # [generation, widgets, { name : widget }]
+
+def invalidate_toplevel_widgets():
+    """
+    Discard the cached list of top-level widgets.
+    Must be called whenever a top-level widget is shown, hidden, closed, deleted, renamed, or reparented.
+    (EventRecordingApp.notify() takes care of this.)
+    """
+    _toplevel_generation[0] += 1
+
+def _cached_toplevel_widgets():
+    generation = _toplevel_generation[0]
+    if _toplevel_cache[0] != generation:
+        toplevel_widgets = QApplication.topLevelWidgets()
+        toplevel_widgets = filter( lambda w: not isinstance(w, QMenu), toplevel_widgets )
+        toplevel_widgets = filter( lambda w: not sip.isdeleted(w), toplevel_widgets )
+        toplevel_widgets = filter( lambda w: w.isVisible(), toplevel_widgets )
+        
+        # The QApplication isn't a widget, but include it anyway, 
+        #  since some widgets may use it as a parent.
+        toplevel_widgets.append( QApplication.instance() ) 
+        _toplevel_cache[:] = [ generation, toplevel_widgets, None ]
+    return _toplevel_cache
+
 def get_toplevel_widgets():
     """
     Get all "top-level" widgets EXCEPT:
@@ -70,178 +110,837 @@ def get_toplevel_widgets():
     - Exclude widgets that are already deleted on the C++ side
     - Exclude widgets that aren't visible
     """
-    toplevel_widgets = QApplication.topLevelWidgets()
-    toplevel_widgets = filter( lambda w: not isinstance(w, QMenu), toplevel_widgets )
-    toplevel_widgets = filter( lambda w: not sip.isdeleted(w), toplevel_widgets )
-    toplevel_widgets = filter( lambda w: w.isVisible(), toplevel_widgets )
+    toplevel_widgets = _cached_toplevel_widgets()[1]
+    # A widget can be deleted without any event, so we can't trust the cache for that.
+    return filter( lambda w: not sip.isdeleted(w), toplevel_widgets )
+
+def _get_toplevel_widget_by_name(name):
+    """
+    Return the top-level widget with the given name (see get_toplevel_widgets()), or None.
+    """
+    cache = _cached_toplevel_widgets()
+    if cache[2] is None:
+        cache[2] = dict( (str(w.objectName()), w) for w in reversed(cache[1]) if not sip.isdeleted(w) )
+    widget = cache[2].get(name)
+    if widget is not None and not sip.isdeleted(widget) and widget.objectName() == name:
+        return widget
+    # Maybe it was renamed (Qt4 has no ObjectNameChange event), or the dict was built before some 
+    #  widgets were given default names.  Search the list instead.
+    for widget in get_toplevel_widgets():
+        if widget.objectName() == name:
+            cache[2] = None
+            return widget
+    return None
+
+
+class _QualifiedNameCache(object):
+    """
+    Remembers the fully qualified name of each object we have already named.
     
-    # The QApplication isn't a widget, but include it anyway, 
-    #  since some widgets may use it as a parent.
-    toplevel_widgets.append( QApplication.instance() ) 
-    return toplevel_widgets
+    Each object has a 'version', which is bumped by invalidate().
+    A cached name is valid as long as the object and all of its ancestors still 
+    have the same versions they had when the name was computed.
+    All objects are held via weak references.
+    
+    As a fast path, a global epoch counts all invalidations.  
+    If nothing has been invalidated since an entry was last checked, it is valid.
+
+    Qt4 doesn't send ObjectNameChange events, so we also double-check the names of 
+    the object and all of its ancestors on every lookup.  That's O(depth), but no tree walk.
+    """
+    def __init__(self):
+        self._entries = weakref.WeakKeyDictionary() # obj -> [fullname, epoch, [(weakref(ancestor), version, name), ...]]
+        self._versions = weakref.WeakKeyDictionary() # obj -> version
+        self._epoch = 0
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, obj):
+        entry = self._entries.get(obj)
+        if entry is None:
+            self.misses += 1
+            return None
+        fullname, epoch, chain = entry
+        check_versions = (epoch != self._epoch)
+        for ancestor_ref, version, name in chain:
+            ancestor = ancestor_ref()
+            if ancestor is None or sip.isdeleted(ancestor) or ancestor.objectName() != name \
+               or (check_versions and self._versions.get(ancestor, 0) != version):
+                self._entries.pop(obj, None)
+                self.misses += 1
+                return None
+        entry[1] = self._epoch
+        self.hits += 1
+        return fullname
 
+    def store(self, obj, parent, fullname):
+        chain = [ (weakref.ref(obj), self._versions.get(obj, 0), str(obj.objectName())) ]
+        if parent is not None:
+            parent_entry = self._entries.get(parent)
+            if parent_entry is None:
+                # Can't vouch for the parent's name, so don't cache this one either.
+                return
+            chain += parent_entry[2]
+        self._entries[obj] = [fullname, self._epoch, chain]
+
+    def invalidate(self, obj):
+        """
+        Invalidate the cached name of obj and all of its descendants.
+        """
+        self._versions[obj] = self._versions.get(obj, 0) + 1
+        self._entries.pop(obj, None)
+        self._epoch += 1
+
+    def clear(self):
+        self._entries.clear()
+        self._epoch += 1
+
+_qualified_name_cache = _QualifiedNameCache()
+
+def invalidate_qualified_name(obj):
+    """
+    Discard the cached fully qualified name of the given object and all of its descendants.
+    Must be called whenever an object's name, parent, or set of siblings changes.
+    (EventRecordingApp.notify() takes care of this.)
+    """
+    try:
+        _qualified_name_cache.invalidate(obj)
+    except TypeError:
+        # Not weak-referenceable
+        pass
 
 def get_fully_qualified_name(obj):
     """
     Return a fully qualified object name of the form: someobject.somechild.somegrandchild.etc
     Before returning, this function **renames** any children that don't have unique names within their parent.
+    
+    Results are cached until invalidate_qualified_name() is called for the object or one of its ancestors.
 
     Note: The name uniqueness check and renaming algorithm are terribly inefficient, 
           but it doesn't seem to slow things down much.  We could improve this later if it becomes a problem.
     """
-    with MainThreadPausedContext():
-        # Must call QObject.parent this way because obj.parent() is *shadowed* in 
-        #  some subclasses (e.g. QModelIndex), which really is very ugly on Qt's part.
-        parent = QObject.parent(obj)
-        objName = obj.objectName()
-        if objName == "":
-            _assign_default_object_name(obj)
-        if not _has_unique_name(obj):
+    fullname = _qualified_name_cache.lookup(obj)
+    if fullname is not None:
+        return fullname
+    # The whole chain of ancestors is named in a single trip to the main thread.
+    return run_in_main_thread(_compute_fully_qualified_name, obj)
+
+def get_fully_qualified_names(objs):
+    """
+    Like get_fully_qualified_name(), for a list of objects.  
+    When called from a non-main thread, all of the names are computed in a single trip to the main thread.
+    """
+    return main_thread_executor().call_batch( [ (get_fully_qualified_name, (obj,)) for obj in objs ] )
+
+def _compute_fully_qualified_name(obj):
+    """
+    Implementation of get_fully_qualified_name().  Must be called from the main thread.
+    """
+    # Must call QObject.parent this way because obj.parent() is *shadowed* in 
+    #  some subclasses (e.g. QModelIndex), which really is very ugly on Qt's part.
+    parent = QObject.parent(obj)
+    objName = obj.objectName()
+    if objName == "":
+        _assign_default_object_name(obj)
+    if not _has_unique_name(obj):
+        # The conflicting sibling might be a lingering dead widget.
+        # If so, collecting it resolves the ambiguity without renaming anything.
+        if not default_collection_policy.collect_for_ambiguous_name() or not _has_unique_name(obj):
             _normalize_child_names(parent)
-        
-        objName = str(obj.objectName())
-        
-        # We combine object names using periods, which means they better not have periods themselves...
-        assert objName.find('.') == -1, "Objects names must not use periods!  Found an object named: {}".format( objName )
     
-        if parent is None:
-            return objName
-        
-        fullname = "{}.".format( get_fully_qualified_name(parent) ) + objName
+    objName = str(obj.objectName())
     
-        # Make sure no siblings have the same name!
-        assert _has_unique_name(obj), "Detected multiple objects with full name: {}".format( fullname )
+    # We combine object names using periods, which means they better not have periods themselves...
+    assert objName.find('.') == -1, "Objects names must not use periods!  Found an object named: {}".format( objName )
+
+    if parent is None:
+        _qualified_name_cache.store(obj, None, objName)
+        _named_object_index.add(objName, obj)
+        return objName
     
-        return fullname
+    fullname = "{}.".format( get_fully_qualified_name(parent) ) + objName
+
+    # Make sure no siblings have the same name!
+    assert _has_unique_name(obj), "Detected multiple objects with full name: {}".format( fullname )
+
+    _qualified_name_cache.store(obj, parent, fullname)
+    _named_object_index.add(fullname, obj)
+    return fullname
+
+def snapshot_object_tree(root=None):
+    """
+    Return the fully qualified names of all visible objects in the tree below the given root 
+    (or below all top-level widgets), as computed in a single trip to the main thread.
+    Like get_fully_qualified_name(), this **renames** objects that don't have unique names.
+    """
+    def snapshot():
+        names = []
+        if root is None:
+            pending = list(get_toplevel_widgets())
+        else:
+            pending = [root]
+        while pending:
+            obj = pending.pop()
+            if sip.isdeleted(obj) or (isinstance(obj, QWidget) and not obj.isVisible()):
+                continue
+            names.append( get_fully_qualified_name(obj) )
+            pending += obj.children()
+        return sorted(names)
+    return run_in_main_thread(snapshot)
+
+class _NamedObjectIndex(object):
+    """
+    Maps fully qualified names to the objects they refer to, so get_named_object() can 
+    usually skip the walk down the object tree (which scans every sibling at every level).
+
+    The index is populated lazily: every name we resolve (in either direction) is added to it.
+    EventRecordingApp.notify() discards entries for objects that are renamed, reparented, 
+    or deleted (see forget_named_object()).  Entries for their descendants are not discarded 
+    right away, so every entry is validated before it is used: the object must still exist, 
+    be visible, and have the same name and ancestor names it had when it was indexed.
+    All objects are held via weak references.
+    """
+    def __init__(self):
+        self._objects = {} # fullname -> weakref(obj)
+        self._names = weakref.WeakKeyDictionary() # obj -> fullname
+        self.hits = 0
+        self.misses = 0
+
+    def add(self, fullname, obj):
+        try:
+            self._objects[fullname] = weakref.ref(obj)
+            self._names[obj] = fullname
+        except TypeError:
+            # Not weak-referenceable
+            pass
+
+    def discard(self, obj):
+        try:
+            fullname = self._names.pop(obj, None)
+        except TypeError:
+            return
+        if fullname is not None:
+            ref = self._objects.get(fullname)
+            if ref is not None and ref() is obj:
+                del self._objects[fullname]
+
+    def lookup(self, names, depth):
+        """
+        Return the indexed object whose name is names[:depth], or None.
+        """
+        fullname = '.'.join(names[:depth])
+        ref = self._objects.get(fullname)
+        obj = ref and ref()
+        if obj is not None and _is_valid_indexed_object(obj, names, depth):
+            return obj
+        if ref is not None:
+            del self._objects[fullname]
+        return None
+
+    def lookup_deepest(self, names):
+        """
+        Find the deepest indexed ancestor of the object named by names (or the object itself).
+        Returns the object and the number of names it matches, or (None, 0).
+        """
+        for depth in xrange(len(names), 0, -1):
+            obj = self.lookup(names, depth)
+            if obj is not None:
+                if depth == len(names):
+                    self.hits += 1
+                else:
+                    self.misses += 1
+                return obj, depth
+        self.misses += 1
+        return None, 0
+
+    def clear(self):
+        self._objects.clear()
+        self._names.clear()
+
+_named_object_index = _NamedObjectIndex()
+
+# If True, every object found via the index is double-checked against a full walk of the object tree.  
+# That defeats the purpose of the index, so it is only meant for debugging.
+CROSS_CHECK_NAMED_OBJECT_INDEX = bool( os.environ.get('EVENTCAPTURE_CROSS_CHECK_NAME_INDEX', '') )
+
+def forget_named_object(obj):
+    """
+    Remove the given object from the name -> object index.
+    Must be called whenever an object is renamed, reparented, or deleted.
+    (EventRecordingApp.notify() takes care of this.)
+    """
+    _named_object_index.discard(obj)
+
+def _is_valid_indexed_object(obj, names, depth):
+    """
+    Check whether obj can still be found by walking the tree along names[:depth].
+    """
+    visibility_checked = False
+    for name in reversed(names[:depth]):
+        if obj is None or sip.isdeleted(obj) or obj.objectName() != name:
+            return False
+        # Only visible widgets are found by walking the tree.
+        # (If a widget is visible, then so are its ancestors, so we only need to check the nearest one.)
+        if not visibility_checked and isinstance(obj, QWidget):
+            if not obj.isVisible():
+                return False
+            visibility_checked = True
+        top = obj
+        obj = QObject.parent(obj)
+    # Parentless menus aren't considered top-level widgets.  (See get_toplevel_widgets())
+    return obj is None and not isinstance(top, QMenu)
 
 class NamedObjectNotFoundError(Exception):
     pass
 
-def get_named_object(full_name, timeout=5.0):
+# Lookups that can't find their target wait on this condition, which is notified by
+#  notify_tree_changed() whenever new objects might have appeared in the tree.
+_tree_changed = threading.Condition()
+_tree_generation = [0]
+_lookup_waiters = [0]
+
+def notify_tree_changed():
+    """
+    Wake up any lookups that are waiting for an object to appear.
+    EventRecordingApp.notify() calls this for ChildAdded, Show, and ObjectNameChange events.
+    """
+    _tree_generation[0] += 1
+    if _lookup_waiters[0]:
+        with _tree_changed:
+            _tree_changed.notify_all()
+
+def _wait_for_tree_change(generation, timeout):
+    """
+    Wait until notify_tree_changed() is called (unless it was already called since ``generation``), 
+    or until the timeout expires.
+    Returns True if the tree changed.
+    """
+    with _tree_changed:
+        if _tree_generation[0] != generation:
+            return True
+        _lookup_waiters[0] += 1
+        try:
+            _tree_changed.wait(timeout)
+        finally:
+            _lookup_waiters[0] -= 1
+        return _tree_generation[0] != generation
+
+def get_named_object(full_name, timeout=5.0, stats=None):
     """
     Locate the object with the given fully qualified name.
     While searching for the object, actively **rename** any objects that do not have unique names within their parent.
     Since the renaming scheme is consistent with get_fully_qualified name, we should always be able to locate the target object, even if it was renamed when the object was originally recorded.
+
+    If the object can't be found right away, we wait for it to appear (up to ``timeout`` seconds).
+    Each retry is triggered by a change in the object tree (see notify_tree_changed()), or by a short backoff timer.
+    Retries resume the search from the deepest ancestor that was already found.
+
+    stats: If provided, a dict that is updated with timing information:
+           'waited' (seconds spent waiting for the object), 'attempts', and 'wakeups' (retries triggered by tree changes)
     """
-    timeout_ = timeout
-    with MainThreadPausedContext():
-        obj = _locate_descendent(None, full_name)
-    while obj is None and timeout > 0.0:
-        time.sleep(1.0)
-        timeout -= 1.0
-        with MainThreadPausedContext():
-            obj = _locate_descendent(None, full_name)
-    
-    if obj is not None:
-        # Success.
-        return obj
-    
-    # We couldn't find the child.
-    # To give a better error message, find the deepest object that COULD be found
-    ancestor_name = None
     names = full_name.split('.')
-    for i in range(len(names)-1):
-        ancestor_name = ".".join( names[:-i-1] )
-        with MainThreadPausedContext():
-            obj = _locate_descendent(None, ancestor_name)
-        if obj is not None:
+    assert names[0] != ''
+    start_time = time.time()
+    deadline = start_time + timeout
+    backoff = 0.005
+    attempts = 0
+    wakeups = 0
+    collected = False
+
+    # The deepest ancestor found so far, and how many names it resolved.
+    ancestor = None
+    depth = 0
+    while True:
+        generation = _tree_generation[0]
+        ancestor, depth = run_in_main_thread(_lookup_step, ancestor, names, depth)
+        attempts += 1
+        if depth == len(names):
             break
+
+        remaining = deadline - time.time()
+        if remaining <= 0.0:
+            break
+        # Maybe a lingering dead widget is in the way.
+        if not collected:
+            collected = True
+            if default_collection_policy.collect_for_ambiguous_name():
+                continue
+        if _wait_for_tree_change(generation, min(backoff, remaining)):
+            wakeups += 1
         else:
-            ancestor_name = None
+            backoff = min(2*backoff, 0.25)
+
+    if stats is not None:
+        stats['waited'] = time.time() - start_time
+        stats['attempts'] = attempts
+        stats['wakeups'] = wakeups
 
-    msg = "Couldn't locate object: {} within timeout of {} seconds\n".format( full_name, timeout_ )
-    if ancestor_name:
-        msg += "Deepest found object was: {}\n".format( ancestor_name )
-        msg += "Existing children were: {}".format( map(QObject.objectName, obj.children()) )
+    if depth == len(names):
+        # Success.
+        return ancestor
+    
+    # We couldn't find the child.
+    msg = "Couldn't locate object: {} within timeout of {} seconds\n".format( full_name, timeout )
+    if depth > 0:
+        children_names = run_in_main_thread( lambda: map(QObject.objectName, ancestor.children()) )
+        msg += "Deepest found object was: {}\n".format( ".".join( names[:depth] ) )
+        msg += "Existing children were: {}".format( children_names )
     else:
-        msg += "Failed to find the top-level widget {}".format( full_name.split('.')[0] )
+        msg += "Failed to find the top-level widget {}".format( names[0] )
     raise NamedObjectNotFoundError( msg )
 
-def assign_unique_child_index( child ):
+def get_named_objects(full_names, timeout=5.0):
     """
-    Assign a unique 'child index' to this child AND all its siblings of the same type.
+    Like get_named_object(), for a list of names.
+    Objects that already exist are all located in a single trip to the main thread.
+    (For any others, we wait, as in get_named_object().)
     """
-    # Must call QObject.parent this way because obj.parent() is *shadowed* in 
-    #  some subclasses (e.g. QModelIndex), which really is very ugly on Qt's part.
-    parent = QObject.parent(child)
-    # Find all siblings of matching type
+    name_lists = [ full_name.split('.') for full_name in full_names ]
+    results = main_thread_executor().call_batch( [ (_lookup_step, (None, names, 0)) for names in name_lists ] )
+    objs = []
+    for full_name, names, (obj, depth) in zip(full_names, name_lists, results):
+        if depth < len(names):
+            obj = get_named_object(full_name, timeout)
+        objs.append(obj)
+    return objs
+
+def _lookup_step(ancestor, names, depth):
+    """
+    One attempt of get_named_object(): Resume the search from the given ancestor (if it's still valid)
+    or the name index, and locate as much of the path as possible.  Must be called from the main thread.
+    """
+    if not _is_valid_ancestor(ancestor, names, depth):
+        ancestor, depth = _named_object_index.lookup_deepest(names)
+        if CROSS_CHECK_NAMED_OBJECT_INDEX and depth == len(names):
+            _cross_check_named_object('.'.join(names), ancestor)
+    return _resolve_path(ancestor, names, depth)
+
+def _is_valid_ancestor(ancestor, names, depth):
+    """
+    Check whether a previously located ancestor can still be used to resume a search.
+    """
+    if ancestor is None or sip.isdeleted(ancestor):
+        return False
+    if isinstance(ancestor, QWidget) and not ancestor.isVisible():
+        return False
+    return ancestor.objectName() == names[depth-1]
+
+def _resolve_path(parent, names, depth):
+    """
+    Starting from ``parent`` (which matches names[:depth]), locate as many of the remaining names as possible.
+    Returns the deepest object found and the number of names it matches.
+    Every object found is added to the name -> object index.
+    """
+    while depth < len(names):
+        child = _locate_immediate_child(parent, names[depth])
+        if child is None:
+            break
+        parent = child
+        depth += 1
+        _named_object_index.add( '.'.join(names[:depth]), child )
+    return parent, depth
+
+def _cross_check_named_object(full_name, indexed_obj):
+    """
+    Debug check: Verify that the object found via the index is the same one a full tree walk finds.
+    """
+    walked_obj = _locate_descendent(None, full_name)
+    assert walked_obj is indexed_obj, \
+        "Name index is stale for {}: index has {}, but the object tree has {}".format( full_name, indexed_obj, walked_obj )
+
+# Children waiting for an index (in the order they were polished), and whether a flush has been scheduled.
+# (Strong references, so a child can't be missed just because its Python wrapper was discarded in the meantime.)
+_pending_child_indexes = []
+_child_index_flush_scheduled = [False]
+
+def _get_child_index( obj ):
+    """
+    Return the object's unique_child_index as an int, or None if it doesn't have one.
+    """
+    prop = obj.property('unique_child_index')
+    if not prop.isValid():
+        return None
+    index = prop.toInt()
+    if isinstance(index, tuple):
+        # QVariant API v1 returns (value, ok)
+        index = index[0]
+    return index
+
+def schedule_unique_child_index( child ):
+    """
+    Give this child a unique 'child index' soon, i.e. after the current burst of events has been processed.
+    All children scheduled in the meantime are handled in one batch (see flush_unique_child_indexes()).
+    EventRecordingApp.notify() calls this when a child is polished.
+    """
+    _pending_child_indexes.append( child )
+    if not _child_index_flush_scheduled[0]:
+        _child_index_flush_scheduled[0] = True
+        QTimer.singleShot( 0, flush_unique_child_indexes )
+
+def flush_unique_child_indexes():
+    """
+    Assign child indexes to all children passed to schedule_unique_child_index() so far.
+    Each child costs O(log n): indexes come from the _ChildIndexAllocator of its (parent, type), 
+    so the siblings are scanned only the first time we see that (parent, type), 
+    or if someone else has set their indexes.
+    """
+    _child_index_flush_scheduled[0] = False
+    if not _pending_child_indexes:
+        return
+    pending = filter( lambda c: not sip.isdeleted(c), _pending_child_indexes )
+    del _pending_child_indexes[:]
+
+    scanned_toplevel_types = set()
+    for child in pending:
+        parent = QObject.parent(child)
+        if parent is None:
+            # Top-level widgets don't tell us when they go away, so we always scan them (there aren't many).
+            if _get_child_index(child) is None and type(child) not in scanned_toplevel_types:
+                scanned_toplevel_types.add( type(child) )
+                _assign_missing_child_indexes( child, None )
+            continue
+
+        index = _get_child_index(child)
+        allocator = _get_child_index_allocator( parent, type(child) )
+        if allocator is None:
+            _assign_missing_child_indexes( child, parent )
+        elif index is None:
+            child.setProperty( 'unique_child_index', allocator.allocate() )
+        elif index not in allocator.in_use:
+            # This index wasn't handed out by us: The indexes were seeded externally, so start over.
+            _assign_missing_child_indexes( child, parent )
+
+def _matching_siblings( child, parent ):
     if parent is not None:
-        matching_siblings = filter( lambda c:type(c) == type(child), parent.children() )
+        siblings = parent.children()
     else:
-        matching_siblings = filter( lambda c:type(c) == type(child), get_toplevel_widgets() )
-
-    matching_siblings = filter( lambda w: w is not None, matching_siblings)
-    matching_siblings = filter(lambda w: not sip.isdeleted(w), matching_siblings)
-    existing_indexes = set()
-    for sibling in matching_siblings:
-        prop = sibling.property('unique_child_index')
-        if prop.isValid():
-            existing_indexes.add( prop.toInt() )
-    
-    next_available_index = 0
-    for sibling in matching_siblings:
-        while next_available_index in existing_indexes:
-            next_available_index += 1
-        prop = sibling.property('unique_child_index')
-        if not prop.isValid():
-            sibling.setProperty( 'unique_child_index', next_available_index )
-            existing_indexes.add( next_available_index )
-
-def remove_unique_child_index( obj ):
+        siblings = get_toplevel_widgets()
+    siblings = filter( lambda c: c is not None and type(c) == type(child), siblings )
+    return filter( lambda w: not sip.isdeleted(w), siblings )
+
+class _ChildIndexAllocator(object):
+    """
+    Hands out the child indexes for the children of one type of one parent: 
+    the smallest index that was freed when a child was removed, 
+    or else the next index above the highest one handed out so far.
+    That's the same index a scan of the siblings would choose (the smallest unused one), without the scan.
+    """
+    def __init__(self, siblings):
+        self.in_use = set( filter( lambda i: i is not None, map(_get_child_index, siblings) ) )
+        self.high_water_mark = max( self.in_use or [-1] ) + 1
+        self.free = sorted( set( range(self.high_water_mark) ) - self.in_use ) # (a heap)
+
+    def allocate(self):
+        if self.free:
+            index = heapq.heappop( self.free )
+        else:
+            index = self.high_water_mark
+            self.high_water_mark += 1
+        self.in_use.add( index )
+        return index
+
+    def release(self, index):
+        """
+        Return False if the index wasn't handed out by this allocator.
+        """
+        if index not in self.in_use:
+            return False
+        self.in_use.remove( index )
+        heapq.heappush( self.free, index )
+        return True
+
+# parent -> { child type : _ChildIndexAllocator }
+_child_index_allocators = weakref.WeakKeyDictionary()
+
+def _get_child_index_allocator( parent, child_type ):
+    allocators = _child_index_allocators.get(parent)
+    if allocators is None:
+        return None
+    return allocators.get(child_type)
+
+def _assign_missing_child_indexes( child, parent ):
+    """
+    Scan the siblings of the given child (of the same type), and give an index to each of them 
+    that doesn't have one yet, in the order of parent.children().
+    The allocator for the siblings is (re)built from the indexes they already have.
+    """
+    siblings = _matching_siblings(child, parent)
+    allocator = _ChildIndexAllocator( siblings )
+    if parent is not None:
+        try:
+            _child_index_allocators.setdefault( parent, {} )[type(child)] = allocator
+        except TypeError:
+            # Not weak-referenceable
+            pass
+    for sibling in siblings:
+        if _get_child_index(sibling) is None:
+            sibling.setProperty( 'unique_child_index', allocator.allocate() )
+
+def assign_unique_child_index( child ):
+    """
+    Assign a unique 'child index' to this child AND all its siblings of the same type.
+    Any children still waiting for an index (see schedule_unique_child_index()) are handled first.
+    """
+    flush_unique_child_indexes()
+    if _get_child_index(child) is None:
+        # Must call QObject.parent this way because obj.parent() is *shadowed* in 
+        #  some subclasses (e.g. QModelIndex), which really is very ugly on Qt's part.
+        _assign_missing_child_indexes( child, QObject.parent(child) )
+
+def remove_unique_child_index( obj, parent=None ):
+    """
+    Remove the object's child index, so it can be reused by a new sibling.
+    parent: The parent the object is being removed from (by default, its current parent).
+    """
+    index = _get_child_index(obj)
     obj.setProperty( 'unique_child_index', QVariant() )
     assert not obj.property('unique_child_index').isValid()
 
-def _assign_default_object_name( obj ):
-    # Ensure that this object and its siblings have a child index
-    assign_unique_child_index(obj)
+    if parent is None:
+        parent = QObject.parent(obj)
+    if index is None or parent is None:
+        return
+    allocator = _get_child_index_allocator( parent, type(obj) )
+    if allocator is not None and not allocator.release(index):
+        # This index wasn't handed out by the allocator: The indexes were seeded externally.
+        # Rescan the siblings next time.
+        del _child_index_allocators[parent][type(obj)]
+
+class _ChildNameIndex(object):
+    """
+    The names (and types) of all children of one parent, so we can check a name's 
+    uniqueness in O(1) instead of scanning all of the siblings.
+
+    Kept current by _set_object_name() and EventRecordingApp.notify() (see invalidate_child_names()).
+    Qt4 has no ObjectNameChange event, so the app could rename a child behind our back.
+    Therefore, callers double-check the name of any child they get from the index.
     
-    prop = obj.property('unique_child_index')
-    if type(obj) == QPushButton and prop.isValid() and prop.toInt() == 0:
+    Children are held by weak reference: Qt doesn't send ChildRemoved when it deletes a parent 
+    and its children, and child wrappers often refer back to their parent, so strong references 
+    would keep deleted parents (and their entries in _child_name_indexes) alive forever.
+    If a child's Python wrapper is discarded while it's still in the index, the index is marked stale 
+    (the child might get a different wrapper next time), and it is rebuilt the next time it's needed.
+    """
+    def __init__(self, children):
+        self._names = {} # weakref(child) -> name
+        self._by_name = {} # name -> [weakref(child), ...]
+        self._by_type = {} # type -> [weakref(child), ...]
+        # The number of names (including '') that are shared by more than one child.
+        self.duplicates = 0
+        self.stale = False
+        for child in children:
+            if child is not None and not sip.isdeleted(child):
+                ref = weakref.ref(child, self._on_child_discarded)
+                self._add(ref, str(child.objectName()))
+                self._by_type.setdefault( type(child), [] ).append(ref)
+
+    def _on_child_discarded(self, ref):
+        self.stale = True
+
+    def _add(self, ref, name):
+        self._names[ref] = name
+        same_name = self._by_name.setdefault(name, [])
+        same_name.append(ref)
+        if len(same_name) == 2:
+            self.duplicates += 1
+
+    def _remove_name(self, ref):
+        name = self._names.pop(ref)
+        same_name = self._by_name[name]
+        same_name.remove(ref)
+        if len(same_name) == 1:
+            self.duplicates -= 1
+        elif not same_name:
+            del self._by_name[name]
+
+    def remove(self, child):
+        # (A new weakref compares equal to the one in the index, as long as the child is alive.)
+        ref = weakref.ref(child)
+        if ref in self._names:
+            self._remove_name(ref)
+            self._by_type[type(child)].remove(ref)
+
+    def rename(self, child, newname):
+        ref = weakref.ref(child)
+        if ref in self._names:
+            self._remove_name(ref)
+            self._add(ref, newname)
+
+    def name_of(self, child):
+        return self._names.get( weakref.ref(child) )
+
+    def sync(self, children):
+        """
+        Re-read the names of the given children (the parent's current children), 
+        in case the app renamed some of them behind our back.
+        Return False if the children don't match the ones in the index, in which case it must be rebuilt.
+        """
+        if len(children) != len(self._names):
+            return False
+        for child in children:
+            ref = weakref.ref(child)
+            name = self._names.get(ref)
+            if name is None:
+                return False
+            current_name = str(child.objectName())
+            if current_name != name:
+                self._remove_name(ref)
+                self._add(ref, current_name)
+        return True
+
+    def is_unique(self, name):
+        return len( self._by_name.get(name, ()) ) == 1
+
+    def has_unnamed_children(self):
+        return '' in self._by_name
+
+    def children_named(self, name):
+        return _live_children( self._by_name.get(name, ()) )
+
+    def is_current(self, name):
+        """
+        Return True if every child indexed under the given name still exists and still has that name.
+        """
+        for ref in self._by_name.get(name, ()):
+            child = ref()
+            if child is None or sip.isdeleted(child) or child.objectName() != name:
+                return False
+        return True
+
+    def children_of_type(self, child_type):
+        return _live_children( self._by_type.get(child_type, ()) )
+
+def _live_children(refs):
+    children = map( lambda ref: ref(), refs )
+    return filter( lambda c: c is not None, children )
+
+# parent -> _ChildNameIndex
+_child_name_indexes = weakref.WeakKeyDictionary()
+
+# Qt4 doesn't send ObjectNameChange events, so we can't trust an index 
+#  until we've re-read the names of the children it covers.
+_names_change_silently = not hasattr(QEvent, 'ObjectNameChange')
+
+def _get_child_name_index( parent, rebuild=False ):
+    index = None
+    if not rebuild:
+        index = _child_name_indexes.get(parent)
+    if index is None or index.stale:
+        index = _child_name_indexes[parent] = _ChildNameIndex( parent.children() )
+    return index
+
+def _get_current_child_name_index( parent, rebuild=False ):
+    """
+    Like _get_child_name_index(), but on Qt4 the names in the index are re-read first, 
+    since the app may have renamed a child (e.g. to the name of one of its siblings) without telling us.
+    """
+    index = _get_child_name_index(parent, rebuild)
+    if _names_change_silently and not rebuild and not index.sync( parent.children() ):
+        index = _get_child_name_index(parent, rebuild=True)
+    return index
+
+def invalidate_child_names( parent ):
+    """
+    Discard the index of the given object's child names.
+    Must be called when the parent gains a child, or when one of its children is renamed by the app.
+    (EventRecordingApp.notify() takes care of this.)
+    """
+    try:
+        _child_name_indexes.pop(parent, None)
+    except TypeError:
+        # Not weak-referenceable
+        pass
+
+def remove_child_name( parent, child ):
+    """
+    Remove the given child from the parent's index of child names.
+    (EventRecordingApp.notify() calls this for ChildRemoved events.)
+    """
+    try:
+        index = _child_name_indexes.get(parent)
+    except TypeError:
+        return
+    if index is not None:
+        index.remove(child)
+
+def _assign_default_object_name( obj ):
+    _assign_default_object_names( [obj] )
+
+def _assign_default_object_names( objs ):
+    """
+    Give each of the given objects a default name (and renumber its default-named siblings).
+    All of the objects must have the same parent and type, so the siblings are renumbered only once.
+    """
+    for obj in objs:
+        # Ensure that this object and its siblings have a child index
         assign_unique_child_index(obj)
+        
+        prop = obj.property('unique_child_index')
+        if type(obj) == QPushButton and prop.isValid() and prop.toInt() == 0:
+            assign_unique_child_index(obj)
     
-    # Find all siblings (including this object) that appear to have auto-defined names
-    parent = QObject.parent(obj)
+    # Find all siblings (including these objects) that appear to have auto-defined names
+    parent = QObject.parent(objs[0])
     # Find all siblings of matching type
     if parent is not None:
-        siblings = filter( lambda c:type(c) == type(obj), parent.children() )
+        siblings = _get_child_name_index(parent).children_of_type( type(objs[0]) )
         siblings = filter(lambda w: not sip.isdeleted(w), siblings)
     else:
-        siblings = filter( lambda c:type(c) == type(obj), get_toplevel_widgets() )
+        siblings = filter( lambda c:type(c) == type(objs[0]), get_toplevel_widgets() )
 
-    if obj not in siblings:
-        # Special case for top-level widgets, since not all of its 'siblings' are included included in get_toplevel_widgets()
-        index_among_default_names = obj.property('unique_child_index').toInt()
-        newname = '{}_{}'.format( obj.__class__.__name__, index_among_default_names )
-        obj.setObjectName( newname )
-    else:
-        siblings = filter( lambda c: str(c.objectName()) == "" or str(c.objectName()).startswith( '{}_'.format( obj.__class__.__name__ ) ), siblings )
-        if obj not in siblings:
-            siblings.append(obj)
+    sibling_ids = set( map(id, siblings) )
+    for obj in objs:
+        if id(obj) not in sibling_ids:
+            # Special case for top-level widgets, since not all of its 'siblings' are included included in get_toplevel_widgets()
+            index_among_default_names = obj.property('unique_child_index').toInt()
+            newname = '{}_{}'.format( obj.__class__.__name__, index_among_default_names )
+            _set_object_name( obj, newname )
+
+    objs = filter( lambda obj: id(obj) in sibling_ids, objs )
+    if objs:
+        default_prefix = '{}_'.format( objs[0].__class__.__name__ )
+        siblings = filter( lambda c: str(c.objectName()) == "" or str(c.objectName()).startswith( default_prefix ), siblings )
+        default_named_ids = set( map(id, siblings) )
+        siblings += filter( lambda obj: id(obj) not in default_named_ids, objs )
         siblings = sorted( siblings, key=lambda c: c.property('unique_child_index').toInt() )
 
         # Rename everything we might have touched
-        for obj in siblings:
-            index_among_default_names = siblings.index( obj )
-            newname = '{}_{}'.format( obj.__class__.__name__, index_among_default_names )
-            obj.setObjectName( newname )
+        for index_among_default_names, sibling in enumerate(siblings):
+            newname = '{}_{}'.format( sibling.__class__.__name__, index_among_default_names )
+            _set_object_name( sibling, newname )
+
+def _set_object_name( obj, newname ):
+    if obj.objectName() != newname:
+        obj.setObjectName( newname )
+        invalidate_qualified_name( obj )
+        forget_named_object( obj )
+        parent = QObject.parent(obj)
+        if parent is None:
+            _toplevel_cache[2] = None
+        else:
+            index = _child_name_indexes.get(parent)
+            if index is not None:
+                index.rename(obj, str(newname))
 
 def _has_unique_name(obj):
-    if obj.objectName() == '':
+    obj_name = str(obj.objectName())
+    if obj_name == '':
         return False
     # Must call QObject.parent this way because obj.parent() is *shadowed* in 
     #  some subclasses (e.g. QModelIndex), which really is very ugly on Qt's part.
     parent = QObject.parent(obj)
     if parent is None:
         siblings = get_toplevel_widgets()
-    else:
-        siblings = parent.children()        
-        siblings = filter( lambda w: w is not None, siblings)
-        siblings = filter(lambda w: not sip.isdeleted(w), siblings)
-    obj_name = obj.objectName()
-    for child in siblings:
-        if child is not obj and child.objectName() == obj_name:
-            return False
-    return True
+        for child in siblings:
+            if child is not obj and child.objectName() == obj_name:
+                return False
+        return True
+
+    index = _get_current_child_name_index(parent)
+    if index.name_of(obj) != obj_name or not index.is_current(obj_name):
+        # The index is stale: obj or one of the siblings that shared its name was renamed behind our back.
+        index = _get_child_name_index(parent, rebuild=True)
+    return index.is_unique(obj_name)
 
 def _normalize_child_names(parent):
     """
@@ -259,35 +958,53 @@ def _normalize_child_names(parent):
                 "Top-level widgets (i.e. widgets without a parent) MUST have unique names.  "\
                 "I found multiple top-level widgets named '{}'".format( child.objectName() )
     else:
+        if _get_current_child_name_index(parent).duplicates == 0:
+            return
         children = parent.children()        
         existing_names = set()
+        duplicates_by_type = collections.OrderedDict()
         for child in children:
             if child.objectName() in existing_names:
-                _assign_default_object_name(child)
+                duplicates_by_type.setdefault( type(child), [] ).append(child)
             existing_names.add( child.objectName() )
+        # Rename the duplicates of each type in one go, rather than renumbering their siblings once per duplicate.
+        for duplicates in duplicates_by_type.values():
+            _assign_default_object_names(duplicates)
 
 def _locate_immediate_child(parent, childname):
     if parent is None:
         assert childname != "", "top-level widgets must have names!"
-        siblings = get_toplevel_widgets()
-    else:
-        siblings = parent.children()
-        siblings = filter( lambda w: w is not None, siblings)
-        siblings = filter(lambda w: not sip.isdeleted(w), siblings)
+        for child in get_toplevel_widgets():
+            if child.objectName() == "":
+                _assign_default_object_name(child)
+        return _get_toplevel_widget_by_name(childname)
+
+    for rebuild in (False, True):
+        index = _prepare_child_names(parent, rebuild)
+        candidates = index.children_named(childname)
+        if candidates and index.is_current(childname):
+            break
+        # Maybe the app renamed a child behind our back.  Try again with a fresh index.
+
+    for child in candidates:
         # Only consider visible children (or non-widgets)
-        def isVisible(obj):
-            return not isinstance(obj, QWidget) or obj.isVisible()
-        siblings = filter( isVisible, siblings )
-
-    for child in siblings:
-        if child.objectName() == "":
-            _assign_default_object_name(child)
-        if parent is not None and not _has_unique_name(child):
-            _normalize_child_names(parent)
-        if child.objectName() == childname:
+        if not sip.isdeleted(child) and (not isinstance(child, QWidget) or child.isVisible()):
             return child
     return None
 
+def _prepare_child_names(parent, rebuild=False):
+    """
+    Make sure all of the parent's children have unique names, and return the index of their names.
+    """
+    index = _get_current_child_name_index(parent, rebuild)
+    if index.has_unnamed_children():
+        for child in index.children_named(''):
+            # (Naming one child names all of its siblings of the same type, too.)
+            if not sip.isdeleted(child) and child.objectName() == "":
+                _assign_default_object_name(child)
+    _normalize_child_names(parent)
+    return index
+
 def _locate_descendent(parent, full_name):
     names = full_name.split('.')
     assert names[0] != ''
@@ -0,0 +1,146 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+from eventTypeNames import EventTypes, EventTypeNameDict
+from eventSerializers import EventKinds, MaxEventArgs, event_constructors
+from scriptParser import parse_playback_script
+from binaryRecording import is_binary_recording, BinaryRecording
+
+class PlaybackPlanError(Exception):
+    pass
+
+class PlaybackPlan(object):
+    """
+    A recording, loaded up front as a list of plain-data event descriptors:
+    (kind, event_type, args, text, objname, timestamp_in_seconds)
+
+    No QEvents are constructed when the plan is loaded.  
+    The player constructs each event on the main thread, just before it is delivered.
+
+    Positions in the plan are record indexes (comments included).
+    The comment markers are indexed when the plan is created, so playback can start or stop at a marker.
+    """
+    def __init__(self, records, author_name='', start_time='', path=None):
+        self.records = records
+        self.author_name = author_name
+        self.start_time = start_time
+        self.path = path
+        # List of (index, comment text)
+        self.markers = [ (i, record[3]) for i, record in enumerate(records) if record[0] == EventKinds.Comment ]
+
+    def __len__(self):
+        return len(self.records)
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def __getitem__(self, i):
+        return self.records[i]
+
+    def find_marker(self, text):
+        """
+        Return the index of the comment marker with the given text.
+        If no marker matches exactly, a marker that contains the text is accepted, as long as there's only one.
+        """
+        matches = [ i for i, comment in self.markers if comment == text ]
+        if not matches:
+            matches = [ i for i, comment in self.markers if text in comment ]
+        if len(matches) == 1:
+            return matches[0]
+        if not matches:
+            raise PlaybackPlanError( "No comment marker matches '{}' in recording {}".format( text, self.path or '' ) )
+        raise PlaybackPlanError( "Comment marker '{}' is ambiguous in recording {}: it matches events {}"
+                                 .format( text, self.path or '', matches ) )
+
+    def resolve_position(self, position):
+        """
+        Convert a position (a record index, or the text of a comment marker) into a record index.
+        Negative indexes count from the end of the recording.
+        """
+        if isinstance(position, basestring) and position.lstrip('-').isdigit():
+            position = int(position)
+        if not isinstance(position, (int, long)):
+            return self.find_marker(position)
+        if position < 0:
+            position += len(self.records)
+        if not 0 <= position <= len(self.records):
+            raise PlaybackPlanError( "Position {} is out of range for recording {} ({} events)"
+                                     .format( position, self.path or '', len(self.records) ) )
+        return position
+
+    def resolve_slice(self, start=None, stop=None):
+        """
+        Return the (start, stop) record indexes for the given positions (see resolve_position()).
+        The stop position is exclusive, so stopping at a marker means the marker itself isn't played.
+        """
+        start_index = 0 if start is None else self.resolve_position(start)
+        stop_index = len(self.records) if stop is None else self.resolve_position(stop)
+        if stop_index < start_index:
+            raise PlaybackPlanError( "Playback can't stop (at {}) before it starts (at {})".format( stop, start ) )
+        return start_index, stop_index
+
+    def validate(self):
+        """
+        Check every descriptor before playback starts, so a bad recording fails immediately
+        instead of halfway through.  Raises PlaybackPlanError listing all of the problems found.
+        """
+        problems = []
+        for i, (kind, event_type, args, text, objname, timestamp_in_seconds) in enumerate(self.records):
+            if kind == EventKinds.Comment:
+                if text is None:
+                    problems.append( "Event {}: Comment has no text".format(i) )
+                continue
+            if kind not in event_constructors:
+                problems.append( "Event {}: Unknown event kind: {}".format(i, kind) )
+            if event_type not in EventTypeNameDict and not EventTypes.User <= event_type <= EventTypes.MaxUser:
+                problems.append( "Event {}: Unknown event type: {}".format(i, event_type) )
+            if len(args) > MaxEventArgs:
+                problems.append( "Event {}: Too many event arguments".format(i) )
+            if kind == EventKinds.Key and text is None:
+                problems.append( "Event {}: Key event has no text".format(i) )
+            if not objname or any( name == '' or name != name.strip() for name in objname.split('.') ):
+                problems.append( "Event {}: Invalid receiver name: '{}'".format(i, objname) )
+            if timestamp_in_seconds is None or timestamp_in_seconds < 0:
+                problems.append( "Event {}: Invalid timestamp: {}".format(i, timestamp_in_seconds) )
+        if problems:
+            raise PlaybackPlanError( "Invalid recording {}:\n".format( self.path or '' ) + "\n".join(problems) )
+
+def load_playback_plan(path):
+    """
+    Load and validate the recording at the given path (either a playback script or a binary recording).
+    Raises scriptParser.ScriptParseError if the script contains custom code, i.e. it can only be executed.
+    Raises PlaybackPlanError if the recording is invalid.
+    """
+    if is_binary_recording(path):
+        recording = BinaryRecording(path)
+        plan = PlaybackPlan( list(recording), recording.author_name, recording.start_time, path )
+    else:
+        metadata, records = parse_playback_script(path)
+        plan = PlaybackPlan( records, metadata['author_name'], metadata['start_time'], path )
+    plan.validate()
+    return plan
@@ -0,0 +1,405 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import json
+import glob
+import time
+import shlex
+import Queue
+import shutil
+import tempfile
+import traceback
+import subprocess
+from distutils.spawn import find_executable
+from multiprocessing.pool import ThreadPool
+from xml.etree import ElementTree
+
+import logging
+logger = logging.getLogger(__name__)
+
+##
+## Runs a suite of recordings in parallel, one application process per recording.
+##
+## Each process gets its own Xvfb display (and therefore its own mouse cursor and keyboard focus),
+## its own home directory (and therefore its own QSettings), and a result file.
+## EventRecordingApp.create_app() writes the playback result to that file (see wrap_finish_callback()).
+##
+
+RESULT_PATH_ENV_VAR = "EVENTCAPTURE_RESULT_PATH"
+
+# Each worker gets its own Xvfb server number, starting here (xvfb-run's default).
+FIRST_XVFB_SERVER_NUM = 99
+
+# If another X server already has a worker's display, the worker moves on to another number (this many times).
+MAX_XVFB_STARTS = 5
+
+def wrap_finish_callback(finish_callback):
+    """
+    If this process was launched by the playback runner, return a finish_callback 
+    that also reports the playback result to the runner, and install a sys.excepthook 
+    that reports any unhandled exception.  Otherwise, return finish_callback unchanged.
+
+    If the finish_callback raises (e.g. an AssertionError), the recording failed.
+    Any other unhandled exception is an error.
+    """
+    result_path = os.environ.get(RESULT_PATH_ENV_VAR)
+    if not result_path:
+        return finish_callback
+
+    def write_result(result):
+        tmp_path = result_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(result, f)
+        os.rename(tmp_path, result_path)
+
+    prev_excepthook = sys.excepthook
+    def excepthook(*exc_info):
+        write_result( { 'status' : 'error',
+                        'exception' : ''.join( traceback.format_exception(*exc_info) ) } )
+        prev_excepthook(*exc_info)
+    sys.excepthook = excepthook
+
+    def reporting_finish_callback():
+        result = None
+        if finish_callback is not None:
+            try:
+                result = finish_callback()
+            except:
+                exc_info = sys.exc_info()
+                write_result( { 'status' : 'failed',
+                                'exception' : ''.join( traceback.format_exception(*exc_info) ) } )
+                prev_excepthook(*exc_info)
+                return
+        write_result( { 'status' : 'passed', 'result' : repr(result) } )
+    return reporting_finish_callback
+
+class RecordingJob(object):
+    def __init__(self, path, expected_duration):
+        self.path = path
+        self.name = os.path.splitext( os.path.basename(path) )[0]
+        self.expected_duration = expected_duration
+        self.status = 'not run'
+        self.attempts = 0
+        self.duration = 0.0
+        self.result = None
+        self.exception = None
+        self.output = ''
+
+    def to_dict(self):
+        return { 'path' : self.path,
+                 'name' : self.name,
+                 'status' : self.status,
+                 'attempts' : self.attempts,
+                 'duration' : self.duration,
+                 'expected_duration' : self.expected_duration,
+                 'result' : self.result,
+                 'exception' : self.exception,
+                 'output' : self.output }
+
+def find_recordings(path):
+    """
+    Return the recordings in the given directory, or listed in the given manifest.
+    A manifest is either a JSON list of paths or a text file with one path per line.
+    Relative paths in a manifest are relative to the manifest's directory.
+    """
+    if os.path.isdir(path):
+        recordings = glob.glob( os.path.join(path, '*.py') ) + glob.glob( os.path.join(path, '*.ecrec') )
+        return sorted( filter( lambda p: not os.path.basename(p).startswith('__'), recordings ) )
+
+    with open(path, 'r') as f:
+        contents = f.read()
+    try:
+        entries = json.loads(contents)
+    except ValueError:
+        entries = [ line.strip() for line in contents.splitlines() ]
+        entries = [ line for line in entries if line and not line.startswith('#') ]
+    manifest_dir = os.path.dirname( os.path.abspath(path) )
+    return [ os.path.join(manifest_dir, entry) for entry in entries ]
+
+def recorded_duration(path):
+    """
+    Return the timestamp of the last event in the recording, or 0.0 if the recording can't be loaded.
+    """
+    try:
+        from eventcapture.playbackPlan import load_playback_plan
+        plan = load_playback_plan(path)
+    except Exception:
+        logger.debug( "Couldn't determine duration of {}".format( path ), exc_info=True )
+        return 0.0
+    timestamps = [ record[5] for record in plan if record[5] is not None ]
+    return max( timestamps or [0.0] )
+
+class PlaybackRunner(object):
+    """
+    Plays a suite of recordings in a pool of worker processes.
+
+    command: The command that launches the application in playback mode.
+             '{recording}' is replaced with the path of the recording, e.g. "python demo_app.py --playback {recording}"
+    """
+    def __init__(self, command, processes=None, timeout=600.0, retries=0, use_xvfb=True, exit_grace_period=5.0, history=None):
+        """
+        processes: Number of recordings to run at once (default: number of cores, or 1 without Xvfb)
+        timeout: Maximum time (in seconds) for each attempt at each recording
+        retries: Number of times to retry a failed recording
+        use_xvfb: If True, run each process under its own Xvfb display (via xvfb-run).
+                  Otherwise, every process uses the current display.  Since they would all share the same 
+                  mouse cursor and keyboard focus, only one recording can be played at a time.
+                  (Qt4 has no offscreen platform, so there is no other way to isolate the processes.)
+        exit_grace_period: How long to wait for the application to exit after playback has finished.
+        history: A previous JSON report.  Its durations are used to schedule the longest recordings first.
+        """
+        import multiprocessing
+        self._command = command
+        if use_xvfb:
+            if find_executable('xvfb-run') is None:
+                raise RuntimeError("Can't find xvfb-run.  Install Xvfb, or play the recordings one at a time without it.")
+            self._processes = processes or multiprocessing.cpu_count()
+        else:
+            if processes is not None and processes > 1:
+                raise ValueError("Without Xvfb, the applications would share the same display, "
+                                 "so only one recording can be played at a time.")
+            self._processes = 1
+        self._timeout = timeout
+        self._retries = retries
+        self._use_xvfb = use_xvfb
+        # One Xvfb server number per worker, so no two workers ever try to start the same display.
+        self._xvfb_server_nums = Queue.Queue()
+        for i in range(self._processes):
+            self._xvfb_server_nums.put( FIRST_XVFB_SERVER_NUM + i )
+        self._exit_grace_period = exit_grace_period
+        self._previous_durations = {}
+        if history is not None:
+            with open(history, 'r') as f:
+                for entry in json.load(f)['recordings']:
+                    self._previous_durations[ entry['path'] ] = entry['duration']
+
+    def run(self, recording_paths):
+        """
+        Play all of the given recordings, longest first.  Returns a list of RecordingJobs.
+        """
+        jobs = []
+        for path in recording_paths:
+            path = os.path.abspath(path)
+            duration = self._previous_durations.get(path)
+            if duration is None:
+                duration = recorded_duration(path)
+            jobs.append( RecordingJob(path, duration) )
+        jobs.sort( key=lambda job: job.expected_duration, reverse=True )
+
+        pool = ThreadPool(self._processes)
+        try:
+            # Note: ThreadPool dispatches jobs in the order they were submitted, so the longest ones start first.
+            for job in pool.imap_unordered( self._run_job, jobs ):
+                logger.info( "{}: {} ({:.1f} seconds, {} attempt(s))".format( job.name, job.status, job.duration, job.attempts ) )
+        finally:
+            pool.close()
+            pool.join()
+        return jobs
+
+    def _run_job(self, job):
+        while job.attempts <= self._retries:
+            job.attempts += 1
+            self._run_attempt(job)
+            if job.status == 'passed':
+                break
+        return job
+
+    def _run_attempt(self, job):
+        if not self._use_xvfb:
+            self._run_process(job, None)
+            return
+
+        server_num = self._xvfb_server_nums.get()
+        try:
+            for _ in range(MAX_XVFB_STARTS):
+                if self._run_process(job, server_num):
+                    return
+                # Some other X server is using this display.
+                # Skip to the worker's next number (the other workers' numbers differ modulo the number of workers).
+                logger.warn( "{}: Xvfb display :{} is already in use.  Trying another one.".format( job.name, server_num ) )
+                server_num += self._processes
+            job.status = 'error'
+            job.exception = "Couldn't start Xvfb: all displays tried were already in use."
+        finally:
+            self._xvfb_server_nums.put( server_num )
+
+    def _run_process(self, job, server_num):
+        """
+        Run one attempt at the job, under Xvfb with the given server number (if not None).
+        Returns False if Xvfb couldn't start because the display was already in use.
+        """
+        scratch_dir = tempfile.mkdtemp(prefix="eventcapture-{}-".format(job.name))
+        try:
+            result_path = os.path.join(scratch_dir, 'result.json')
+            output_path = os.path.join(scratch_dir, 'output.txt')
+            xvfb_errors_path = os.path.join(scratch_dir, 'xvfb.txt')
+
+            env = dict(os.environ)
+            env[RESULT_PATH_ENV_VAR] = result_path
+            # Isolate QSettings (and anything else the app stores in the home directory)
+            env['HOME'] = scratch_dir
+            env['XDG_CONFIG_HOME'] = os.path.join(scratch_dir, '.config')
+
+            args = [ a.format(recording=job.path) for a in shlex.split(self._command) ]
+            if server_num is not None:
+                args = ['xvfb-run', '--server-num', str(server_num), '--error-file', xvfb_errors_path] + args
+
+            start = time.time()
+            with open(output_path, 'w') as output:
+                process = subprocess.Popen( args, env=env, stdout=output, stderr=subprocess.STDOUT )
+                wait_status = self._wait(process, result_path, start)
+            job.duration = time.time() - start
+            with open(output_path, 'r') as output:
+                job.output = output.read()
+
+            if server_num is not None and not os.path.exists(result_path) and os.path.exists(xvfb_errors_path):
+                with open(xvfb_errors_path, 'r') as f:
+                    if 'already active' in f.read():
+                        return False
+
+            result = {}
+            if os.path.exists(result_path):
+                with open(result_path, 'r') as f:
+                    result = json.load(f)
+            job.result = result.get('result')
+            job.exception = result.get('exception')
+            job.status, exception = self._attempt_status( wait_status, process.returncode, result.get('status') )
+            job.exception = job.exception or exception
+            return True
+        finally:
+            shutil.rmtree(scratch_dir, ignore_errors=True)
+
+    def _attempt_status(self, wait_status, returncode, result_status):
+        """
+        Return the status of an attempt and an explanation (or None):
+
+        - 'passed': Playback finished and the app exited cleanly.
+        - 'failed': The finish callback raised, or the app exited with a nonzero exit code.
+        - 'timeout': Playback didn't finish in time.
+        - 'error': The app crashed (an unhandled exception, or killed by a signal), 
+                   or exited before playback finished.
+        """
+        if wait_status == 'timeout':
+            return 'timeout', None
+        if result_status == 'error':
+            return 'error', None
+        crashed = returncode < 0
+        if self._use_xvfb and returncode > 128:
+            # xvfb-run is a shell script: it reports death by a signal as 128 + the signal number.
+            crashed = True
+        if wait_status == 'killed':
+            # Playback finished, but the app didn't quit on its own, so we terminated it.
+            crashed = False
+        if result_status is None:
+            if crashed or returncode == 0:
+                return 'error', "Application exited (code {}) before playback finished".format( returncode )
+            return 'failed', "Application exited with code {}".format( returncode )
+        if crashed:
+            return 'error', "Application crashed (code {}) after playback finished".format( returncode )
+        if result_status == 'passed' and wait_status == 'exited' and returncode != 0:
+            return 'failed', "Application exited with code {}".format( returncode )
+        return result_status, None
+
+    def _wait(self, process, result_path, start):
+        """
+        Wait for the process to finish playback (or exit, or time out).
+        Returns 'exited', 'killed' (playback finished, but the app didn't exit), or 'timeout'.
+        """
+        finished_at = None
+        while process.poll() is None:
+            now = time.time()
+            if finished_at is None and os.path.exists(result_path):
+                finished_at = now
+            if finished_at is not None and now - finished_at > self._exit_grace_period:
+                # Playback is done, but the app didn't quit on its own.
+                _kill(process)
+                return 'killed'
+            if now - start > self._timeout:
+                _kill(process)
+                return 'timeout'
+            time.sleep(0.1)
+        return 'exited'
+
+def _kill(process):
+    try:
+        process.terminate()
+        for _ in range(20):
+            if process.poll() is not None:
+                return
+            time.sleep(0.1)
+        process.kill()
+        process.wait()
+    except OSError:
+        pass
+
+def write_json_report(jobs, path):
+    with open(path, 'w') as f:
+        json.dump( { 'recordings' : [ job.to_dict() for job in jobs ] }, f, indent=2 )
+
+def write_junit_report(jobs, path):
+    suite = ElementTree.Element( 'testsuite', name='eventcapture', tests=str(len(jobs)),
+                                 failures=str(len(filter( lambda j: j.status == 'failed', jobs ))),
+                                 errors=str(len(filter( lambda j: j.status not in ('passed', 'failed'), jobs ))),
+                                 time='{:.3f}'.format( sum( j.duration for j in jobs ) ) )
+    for job in jobs:
+        case = ElementTree.SubElement( suite, 'testcase', classname='eventcapture.recordings', 
+                                       name=job.name, time='{:.3f}'.format(job.duration) )
+        if job.status != 'passed':
+            # A failed recording is a test failure.  Anything else (a timeout, a crash) is an error.
+            element = 'failure' if job.status == 'failed' else 'error'
+            problem = ElementTree.SubElement( case, element, type=job.status, message="{} after {} attempt(s)".format(job.status, job.attempts) )
+            problem.text = job.exception or ''
+        output = ElementTree.SubElement( case, 'system-out' )
+        output.text = job.output
+    ElementTree.ElementTree(suite).write(path, encoding='utf-8')
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Play a suite of eventcapture recordings in parallel.")
+    parser.add_argument('recordings', help="A directory of recordings, or a manifest file listing them.")
+    parser.add_argument('command', help="The command to launch the app in playback mode, e.g. 'python demo_app.py --playback {recording}'")
+    parser.add_argument('--processes', type=int, default=None)
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--retries', type=int, default=0)
+    parser.add_argument('--no-xvfb', dest='xvfb', action='store_false', 
+                        help="Play the recordings one at a time on the current display, instead of in parallel under Xvfb.")
+    parser.add_argument('--history', help="A previous JSON report, used to schedule the longest recordings first.")
+    parser.add_argument('--json-report', default='eventcapture-report.json')
+    parser.add_argument('--junit-report', default='eventcapture-report.xml')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    runner = PlaybackRunner( args.command, args.processes, args.timeout, args.retries, args.xvfb, history=args.history )
+    jobs = runner.run( find_recordings(args.recordings) )
+    write_json_report( jobs, args.json_report )
+    write_junit_report( jobs, args.junit_report )
+    failed = filter( lambda j: j.status != 'passed', jobs )
+    print "{} of {} recordings passed.".format( len(jobs) - len(failed), len(jobs) )
+    sys.exit( 1 if failed else 0 )
@@ -0,0 +1,143 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import csv
+import json
+
+from eventTypeNames import EventTypeNameDict
+from instrumentation import LatencyHistogram
+
+class PlaybackTimingLog(object):
+    """
+    Records the timing of every event delivered during playback, 
+    so we can tell whether a slow playback is the fault of the app or the harness.
+
+    For each event, we record (all in seconds):
+    
+    - scheduled: When the event was supposed to be posted (relative to the start of playback), or None if it wasn't scheduled.
+    - posted: When the event was actually posted.
+    - drift: posted - scheduled
+    - lookup: Time spent locating the receiver (including waiting for it to appear)
+    - sleep: Time spent waiting for the scheduled time (or for the app to become idle)
+    - flush: Round-trip time for the main thread to deliver the event and process everything it triggered.
+    """
+    Fields = ['index', 'event_type', 'receiver', 'scheduled', 'posted', 'drift', 'lookup', 'sleep', 'flush', 'lookup_attempts']
+    Measurements = ['drift', 'lookup', 'sleep', 'flush']
+
+    def __init__(self, keep_rows=True):
+        """
+        keep_rows: If True, keep the raw timing of every event (for dump()).
+                   Otherwise, only the summary statistics are kept, so memory usage doesn't grow with the 
+                   length of the playback.  (It grows only with the number of distinct receivers.)
+        """
+        self.keep_rows = keep_rows
+        self.rows = []
+        self._count = 0
+        # Summary statistics: { measurement : LatencyHistogram }, overall and per event type and receiver.
+        self._overall = {}
+        self._by_type = {}
+        self._by_receiver = {}
+
+    def record(self, event_type, receiver, scheduled, posted, lookup, sleep, flush, lookup_attempts=1):
+        drift = None
+        if scheduled is not None:
+            drift = posted - scheduled
+        type_name = EventTypeNameDict.get(event_type, str(event_type))
+        if self.keep_rows:
+            self.rows.append( [self._count, type_name, receiver, scheduled, posted, drift, lookup, sleep, flush, lookup_attempts] )
+        self._count += 1
+
+        values = zip( self.Measurements, (drift, lookup, sleep, flush) )
+        for histograms in ( self._overall, 
+                            self._by_type.setdefault(type_name, {}), 
+                            self._by_receiver.setdefault(receiver, {}) ):
+            for measurement, value in values:
+                if value is not None:
+                    histogram = histograms.get(measurement)
+                    if histogram is None:
+                        histogram = histograms[measurement] = LatencyHistogram()
+                    histogram.record(value)
+
+    def __len__(self):
+        return self._count
+
+    def summary(self):
+        """
+        Return a JSON-friendly dict of percentiles for each measurement:
+        { 'overall' : { measurement : stats },
+          'by_event_type' : { type name : { measurement : stats } },
+          'by_receiver' : { receiver : { measurement : stats } } }
+
+        Percentiles come from LatencyHistograms, so they are upper bounds within 1/LatencyHistogram.SubBuckets
+        of the exact values.  (Negative drifts count as zero in the percentiles, but not in the mean.)
+        """
+        return { 'overall' : self._summarize(self._overall),
+                 'by_event_type' : { k : self._summarize(h) for k, h in self._by_type.items() },
+                 'by_receiver' : { k : self._summarize(h) for k, h in self._by_receiver.items() } }
+
+    def _summarize(self, histograms):
+        result = {}
+        for measurement, histogram in histograms.items():
+            result[measurement] = { 'count' : histogram.count,
+                                    'mean' : histogram.total / histogram.count,
+                                    'max' : histogram.max,
+                                    'p50' : histogram.percentile(50),
+                                    'p95' : histogram.percentile(95),
+                                    'p99' : histogram.percentile(99) }
+        return result
+
+    def worst_receivers(self, measurement='lookup', n=10):
+        """
+        Return the n receivers with the largest p95 for the given measurement, as a list of (receiver, p95).
+        """
+        by_receiver = self.summary()['by_receiver']
+        p95s = [ (receiver, stats[measurement]['p95']) for receiver, stats in by_receiver.items() if measurement in stats ]
+        return sorted( p95s, key=lambda item: item[1], reverse=True )[:n]
+
+    def dump_json(self, path):
+        with open(path, 'w') as f:
+            json.dump( { 'summary' : self.summary(),
+                         'fields' : self.Fields,
+                         'events' : self.rows }, f, indent=2, sort_keys=True )
+
+    def dump_csv(self, path):
+        with open(path, 'wb') as f:
+            writer = csv.writer(f)
+            writer.writerow(self.Fields)
+            writer.writerows(self.rows)
+
+    def dump(self, path):
+        """
+        Write the raw data (and the summary, for JSON) to the given path.  
+        The format is determined by the extension: .csv or .json
+        (The raw data is only available if keep_rows is True.)
+        """
+        if path.endswith('.csv'):
+            self.dump_csv(path)
+        else:
+            self.dump_json(path)
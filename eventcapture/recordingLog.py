@@ -0,0 +1,247 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import sys
+import json
+import time
+import atexit
+import datetime
+import threading
+import Queue
+
+from eventSerializers import EventKinds, write_playback_script
+
+import logging
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT_NAME = "eventcapture-log"
+LOG_FORMAT_VERSION = 1
+
+class RecordingLogError(Exception):
+    pass
+
+class RecordingLogWriter(object):
+    """
+    An append-only, crash-safe log of captured events.
+
+    Has the same append()/append_comment() interface as CapturedEventBuffer, 
+    so the EventRecorder can use it in place of an in-memory buffer.
+    Records are handed to a background thread, which writes them to disk in batches
+    (one JSON list per line) and calls fsync() periodically.
+    If the application crashes, at most the last few records are lost, 
+    and a truncated final line is simply ignored by read_recording_log().
+
+    Iterating over the writer re-reads the log from disk, so memory usage stays 
+    constant no matter how long the recording session is.
+    """
+    _Stop = object()
+
+    def __init__(self, path, batch_size=100, flush_interval=0.5, fsync_interval=2.0):
+        """
+        path: The log file to create.  (If it already exists, it is overwritten.)
+        batch_size: Maximum number of records written per batch.
+        flush_interval: Maximum time (in seconds) a record may wait in memory before it is written.
+        fsync_interval: Minimum time (in seconds) between calls to fsync().
+        """
+        self.path = path
+        self._batch_size = batch_size
+        self._flush_interval = flush_interval
+        self._fsync_interval = fsync_interval
+        self._queue = Queue.Queue()
+        self._closed = False
+        self.delete_on_close = False
+        # Errors from the writer thread, reported by the next call to flush()
+        self._errors = []
+        self._had_errors = False
+
+        # The file and the writer thread are created when the first record arrives,
+        # so an app that never records anything doesn't leave an empty log behind.
+        self._f = None
+        self._thread = None
+        self._open_lock = threading.Lock()
+        atexit.register( self.close )
+
+    @property
+    def opened(self):
+        return self._f is not None
+
+    def _open(self):
+        with self._open_lock:
+            if self._f is not None:
+                return
+            f = open(self.path, 'w')
+            header = { 'format' : LOG_FORMAT_NAME,
+                       'version' : LOG_FORMAT_VERSION,
+                       'created' : str(datetime.datetime.now()) }
+            f.write( json.dumps(header) + '\n' )
+            f.flush()
+            os.fsync( f.fileno() )
+            self._f = f
+            logger.info( "Recording log: {}".format( self.path ) )
+
+            self._thread = threading.Thread( target=self._run, name="RecordingLogWriter" )
+            self._thread.daemon = True
+            self._thread.start()
+
+    def append(self, kind, event_type, args, text, objname, timestamp_in_seconds):
+        assert not self._closed, "Can't append to a closed log"
+        if self._f is None:
+            self._open()
+        self._queue.put( (kind, event_type, tuple(args), text, objname, timestamp_in_seconds) )
+
+    def append_comment(self, comment, timestamp_in_seconds=None):
+        self.append(EventKinds.Comment, 0, (), comment, "comment", timestamp_in_seconds)
+
+    def flush(self):
+        """
+        Block until all records appended so far have been written and fsync'd.
+        Raises RecordingLogError if any of them couldn't be written.
+        """
+        self._queue.join()
+        self._raise_errors()
+
+    def _raise_errors(self):
+        errors, self._errors = self._errors, []
+        if errors:
+            raise RecordingLogError( "{} error(s) while writing recording log {}: {}"
+                                     .format( len(errors), self.path, "; ".join(errors) ) )
+
+    def close(self):
+        """
+        Stop the writer thread and close the file.
+        If delete_on_close is set (e.g. because everything in the log has already been saved elsewhere), 
+        the log file is removed, too.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._f is None:
+            return
+        self._queue.put( RecordingLogWriter._Stop )
+        self._thread.join()
+        self._f.close()
+        if self._had_errors:
+            # Something is missing from the log (and maybe from the saved script), so don't delete it.
+            self.delete_on_close = False
+        if self.delete_on_close:
+            try:
+                os.remove( self.path )
+            except OSError:
+                logger.warn( "Failed to remove recording log: {}".format( self.path ), exc_info=True )
+
+    def __iter__(self):
+        if self._f is None:
+            return iter(())
+        if not self._closed:
+            self.flush()
+        return read_recording_log(self.path)
+
+    def _run(self):
+        last_fsync = time.time()
+        stopping = False
+        while not stopping:
+            batch = []
+            try:
+                batch.append( self._queue.get(timeout=self._flush_interval) )
+                while len(batch) < self._batch_size:
+                    batch.append( self._queue.get_nowait() )
+            except Queue.Empty:
+                pass
+
+            try:
+                lines = []
+                for record in batch:
+                    if record is RecordingLogWriter._Stop:
+                        stopping = True
+                    else:
+                        try:
+                            lines.append( json.dumps(record) + '\n' )
+                        except Exception as ex:
+                            # Don't let one bad record take down the rest of the batch.
+                            logger.error( "Failed to serialize record for recording log: {!r}".format( record ), exc_info=True )
+                            self._errors.append( "couldn't serialize {!r}: {}".format( record, ex ) )
+                            self._had_errors = True
+                if lines:
+                    self._f.write( ''.join(lines) )
+                    self._f.flush()
+                # fsync periodically, and also before anyone waiting in flush() is released.
+                now = time.time()
+                if batch and (stopping or self._queue.empty() or now - last_fsync >= self._fsync_interval):
+                    os.fsync( self._f.fileno() )
+                    last_fsync = now
+            except Exception as ex:
+                logger.error( "Failed to write to recording log: {}".format( self.path ), exc_info=True )
+                self._errors.append( str(ex) )
+                self._had_errors = True
+            finally:
+                for _ in batch:
+                    self._queue.task_done()
+
+def read_recording_log(path):
+    """
+    Generator.  Yields the records stored in the given recording log:
+    (kind, event_type, args, text, objname, timestamp_in_seconds)
+    
+    If the log was truncated (e.g. because the application crashed while it was being written),
+    all complete records are returned and the partial record at the end is ignored.
+    """
+    with open(path, 'r') as f:
+        header = json.loads( f.readline() )
+        assert header['format'] == LOG_FORMAT_NAME, "Not an eventcapture recording log: {}".format( path )
+        assert header['version'] <= LOG_FORMAT_VERSION, "Unsupported recording log version: {}".format( header['version'] )
+        for line in f:
+            try:
+                kind, event_type, args, text, objname, timestamp_in_seconds = json.loads(line)
+            except ValueError:
+                logger.warn( "Ignoring truncated record at the end of {}".format( path ) )
+                break
+            if text is not None:
+                text = text.encode('utf-8')
+            yield kind, event_type, tuple(args), text, str(objname), timestamp_in_seconds
+
+def read_recording_log_creation_time(path):
+    with open(path, 'r') as f:
+        return json.loads( f.readline() )['created']
+
+def convert_log_to_script(log_path, script_path, author_name):
+    """
+    Convert a recording log (possibly truncated) into a normal playback script.
+    """
+    with open(script_path, 'w') as f:
+        write_playback_script( f, author_name, read_recording_log_creation_time(log_path), read_recording_log(log_path) )
+
+if __name__ == "__main__":
+    import argparse
+    parser = argparse.ArgumentParser(description="Convert an eventcapture recording log into a playback script.")
+    parser.add_argument('log_path')
+    parser.add_argument('script_path')
+    parser.add_argument('--author', default='(recovered from log)')
+    args = parser.parse_args()
+    convert_log_to_script( args.log_path, args.script_path, args.author )
+    sys.exit(0)
@@ -0,0 +1,195 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import re
+import ast
+
+from eventTypeNames import EventTypes, SymbolValueDict
+from eventSerializers import EventKinds
+
+class ScriptParseError(Exception):
+    pass
+
+# Comments that write_playback_script() adds to every script.
+_BoilerplateComments = ("SCRIPT STARTING", "SCRIPT COMPLETE")
+
+def parse_playback_script(path):
+    """
+    Parse a playback script (as written by eventSerializers.write_playback_script) 
+    WITHOUT executing it.
+    
+    Returns (metadata, records), where metadata is a dict with 'author_name' and 'start_time'
+    and records is a list of (kind, event_type, args, text, objname, timestamp_in_seconds)
+
+    Raises ScriptParseError if the script contains anything that write_playback_script() wouldn't have written,
+    e.g. hand-edited code.  (Such scripts can only be played back by executing them.)
+    """
+    with open(path, 'r') as f:
+        source = f.read()
+    return parse_playback_script_source(source, path)
+
+def parse_playback_script_source(source, path='<script>'):
+    metadata = { 'author_name' : '', 'start_time' : '' }
+    match = re.search(r'^# Created by (.*)$', source, re.MULTILINE)
+    if match:
+        metadata['author_name'] = match.group(1)
+    match = re.search(r'^# Started at: (.*)$', source, re.MULTILINE)
+    if match:
+        metadata['start_time'] = match.group(1)
+
+    try:
+        module = ast.parse(source, path)
+    except SyntaxError as ex:
+        raise ScriptParseError( "{}: {}".format( path, ex ) )
+
+    functions = [ node for node in module.body if isinstance(node, ast.FunctionDef) and node.name == 'playback_events' ]
+    if len(functions) != 1:
+        raise ScriptParseError( "{}: Couldn't find the playback_events() function".format( path ) )
+
+    records = []
+    event_fields = None
+    for statement in functions[0].body:
+        try:
+            if isinstance(statement, (ast.Import, ast.ImportFrom)):
+                continue
+            if isinstance(statement, ast.Assign) and len(statement.targets) == 1 and isinstance(statement.targets[0], ast.Name):
+                target = statement.targets[0].id
+                if target == 'mainwin':
+                    continue
+                if target == 'event':
+                    event_fields = _parse_event_constructor(statement.value)
+                    continue
+            if isinstance(statement, ast.Expr) and isinstance(statement.value, ast.Call):
+                call = statement.value
+                method = _dotted_name(call.func)
+                if method == 'player.post_event':
+                    objname, event_name, timestamp = call.args
+                    if _dotted_name(event_name) != 'event' or event_fields is None:
+                        raise ScriptParseError("post_event() must be called with the most recently constructed event")
+                    records.append( event_fields + ( _evaluate(objname), float(_evaluate(timestamp)) ) )
+                    event_fields = None
+                    continue
+                if method == 'player.display_comment':
+                    comment = _evaluate(call.args[0])
+                    if comment not in _BoilerplateComments:
+                        records.append( (EventKinds.Comment, 0, (), comment, "comment", None) )
+                    continue
+        except (ValueError, TypeError) as ex:
+            raise ScriptParseError( "{} line {}: {}".format( path, statement.lineno, ex ) )
+        raise ScriptParseError( "{} line {}: Unrecognized statement".format( path, statement.lineno ) )
+    return metadata, records
+
+def _dotted_name(node):
+    if isinstance(node, ast.Name):
+        return node.id
+    if isinstance(node, ast.Attribute):
+        prefix = _dotted_name(node.value)
+        if prefix is not None:
+            return prefix + '.' + node.attr
+    return None
+
+class _RelativePoint(tuple):
+    """A point that was written relative to the main window, i.e. mainwin.mapToGlobal( QPoint(0,0) ) + QPoint(x,y)"""
+
+def _evaluate(node):
+    """
+    Evaluate the (small) subset of Python expressions that write_playback_script() uses.
+    """
+    if isinstance(node, ast.Num):
+        return node.n
+    if isinstance(node, ast.Str):
+        return node.s
+    if isinstance(node, ast.Name) and node.id in ('True', 'False'):
+        return node.id == 'True'
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+        return -_evaluate(node.operand)
+    if isinstance(node, ast.Attribute):
+        name = _dotted_name(node)
+        try:
+            return SymbolValueDict[name]
+        except KeyError:
+            raise ValueError("Unknown symbol: {}".format( name ))
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.BitOr):
+        return _evaluate(node.left) | _evaluate(node.right)
+    if isinstance(node, ast.BinOp) and isinstance(node.op, ast.Add) \
+       and isinstance(node.left, ast.Call) and (_dotted_name(node.left.func) or '').endswith('.mapToGlobal'):
+        return _RelativePoint( _evaluate(node.right) )
+    if isinstance(node, ast.Call):
+        func_name = (_dotted_name(node.func) or '').split('.')[-1]
+        if func_name in ('QPoint', 'QSize'):
+            coords = tuple( _evaluate(arg) for arg in node.args )
+            if len(coords) == 0:
+                coords = (0, 0)
+            if len(coords) != 2:
+                raise ValueError("Bad {} arguments".format( func_name ))
+            return coords
+    raise ValueError("Unsupported expression: {}".format( ast.dump(node) ))
+
+def _relative(point):
+    if not isinstance(point, _RelativePoint):
+        raise ValueError("Global positions must be given relative to the main window")
+    return point
+
+def _parse_event_constructor(node):
+    """
+    Returns (kind, event_type, args, text), as returned by eventSerializers.extract_event_fields()
+    """
+    if not isinstance(node, ast.Call):
+        raise ValueError("Expected an event constructor")
+    constructor = (_dotted_name(node.func) or '').split('.')[-1]
+    a = [ _evaluate(arg) for arg in node.args ]
+    if constructor == 'QMouseEvent':
+        event_type, pos, global_pos, button, buttons, modifiers = a
+        rel = _relative(global_pos)
+        return EventKinds.Mouse, event_type, (pos[0], pos[1], rel[0], rel[1], button, buttons, modifiers), None
+    if constructor == 'QWheelEvent':
+        pos, global_pos, delta, buttons, modifiers, orientation = a
+        rel = _relative(global_pos)
+        return EventKinds.Wheel, EventTypes.Wheel, (pos[0], pos[1], rel[0], rel[1], delta, buttons, modifiers, orientation), None
+    if constructor == 'QKeyEvent':
+        event_type, key, modifiers, text, autorepeat, count = a
+        return EventKinds.Key, event_type, (key, modifiers, int(autorepeat), count), text
+    if constructor == 'QMoveEvent':
+        pos, old_pos = a
+        return EventKinds.Move, EventTypes.Move, pos + old_pos, None
+    if constructor == 'QContextMenuEvent':
+        reason, pos, global_pos, modifiers = a
+        rel = _relative(global_pos)
+        return EventKinds.ContextMenu, EventTypes.ContextMenu, (reason, pos[0], pos[1], rel[0], rel[1], modifiers), None
+    if constructor == 'QResizeEvent':
+        size, old_size = a
+        return EventKinds.Resize, EventTypes.Resize, size + old_size, None
+    if constructor == 'QWindowStateChangeEvent':
+        old_state, = a
+        return EventKinds.WindowStateChange, EventTypes.WindowStateChange, (old_state,), None
+    if constructor == 'QCloseEvent':
+        return EventKinds.Close, EventTypes.Close, (), None
+    if constructor == 'QEvent':
+        event_type, = a
+        return EventKinds.Generic, event_type, (), None
+    raise ValueError("Unsupported event type: {}".format( constructor ))
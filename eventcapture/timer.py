@@ -26,19 +26,90 @@
 # ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
 # POSSIBILITY OF SUCH DAMAGE.
 
+import sys
+import time
 from time import sleep
 import datetime
 import functools
 import logging
 
+def _find_monotonic_ns():
+    """
+    Return a function that reads a monotonic clock, in integer nanoseconds.
+    Unlike datetime.now() or time.time(), a monotonic clock never jumps (e.g. due to NTP adjustments or DST).
+    """
+    if hasattr(time, 'monotonic_ns'):
+        return time.monotonic_ns
+    if hasattr(time, 'monotonic'):
+        return lambda: int(time.monotonic() * 1e9)
+
+    # Python 2 has no monotonic clock, so we ask the OS directly.
+    import ctypes
+    import ctypes.util
+    if sys.platform == 'win32':
+        frequency = ctypes.c_int64()
+        ctypes.windll.kernel32.QueryPerformanceFrequency( ctypes.byref(frequency) )
+        counter = ctypes.c_int64()
+        def monotonic_ns():
+            ctypes.windll.kernel32.QueryPerformanceCounter( ctypes.byref(counter) )
+            return counter.value * 1000000000 // frequency.value
+        return monotonic_ns
+
+    class timespec(ctypes.Structure):
+        _fields_ = [ ('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long) ]
+
+    CLOCK_MONOTONIC = 6 if sys.platform == 'darwin' else 1
+    for libname in ['c', 'rt']: # (Old versions of glibc keep clock_gettime in librt)
+        path = ctypes.util.find_library(libname)
+        try:
+            clock_gettime = ctypes.CDLL(path, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ ctypes.c_int, ctypes.POINTER(timespec) ]
+        ts = timespec()
+        if clock_gettime( CLOCK_MONOTONIC, ctypes.byref(ts) ) != 0:
+            continue
+        def monotonic_ns():
+            clock_gettime( CLOCK_MONOTONIC, ctypes.byref(ts) )
+            return ts.tv_sec * 1000000000 + ts.tv_nsec
+        return monotonic_ns
+
+    logging.getLogger(__name__).warn( "No monotonic clock available.  Timing may be affected by changes to the system clock." )
+    import timeit
+    return lambda: int(timeit.default_timer() * 1e9)
+
+monotonic_ns = _find_monotonic_ns()
+
+def sleep_until_ns(deadline_ns, spin_threshold=0.002):
+    """
+    Sleep until the monotonic clock reaches the given deadline (in nanoseconds).
+    The OS can oversleep by a millisecond or more, so we only sleep until we're within 
+    ``spin_threshold`` seconds of the deadline, and then spin the rest of the way.
+    """
+    while True:
+        remaining = (deadline_ns - monotonic_ns()) / 1e9
+        if remaining <= 0.0:
+            return
+        if remaining > spin_threshold:
+            sleep( remaining - spin_threshold )
+        else:
+            # Yield to other threads while we spin.
+            sleep( 0 )
+
 class Timer(object):
     """
     Context manager.
     Takes a START timestamp on __enter__ and takes a STOP timestamp on __exit__.
     Call ``seconds()`` to get the elapsed time so far, or the total time if the timer has already stopped.
     
+    Elapsed time is measured with a monotonic clock (see monotonic_ns()), 
+    but ``start_time`` and ``stop_time`` are wall-clock datetimes, for display.
+    
     .. note:: This class provides WALL timing of long-running tasks, not cpu benchmarking for short tasks.
     """
+    # sleep_until() sleeps until it's this close (in seconds) to the deadline, and then spins.
+    SpinThreshold = 0.002
+
     def __init__(self):
         """
         Creates a paused timer.  Call `unpause()` to start the timer.
@@ -50,8 +121,8 @@ class Timer(object):
         self.start_time = None
         self.stop_time = None
 
-        self._last_start = None
-        self._total_time = datetime.timedelta()
+        self._last_start_ns = None
+        self._total_ns = 0
     
     def __enter__(self):
         self.unpause()
@@ -62,32 +133,47 @@ class Timer(object):
 
     def unpause(self):
         assert self.paused
-        self._last_start = datetime.datetime.now()
+        self._last_start_ns = monotonic_ns()
         self.paused = False
         if self.start_time is None:
-            self.start_time = self._last_start
+            self.start_time = datetime.datetime.now()
 
     def pause(self):
         assert not self.paused
+        self._total_ns += monotonic_ns() - self._last_start_ns
         self.paused = True
-        self._last_stop = datetime.datetime.now()
-        self._total_time += self._last_stop - self._last_start
-        self.stop_time = self._last_stop
+        self.stop_time = datetime.datetime.now()
     
+    def nanoseconds(self):
+        """
+        Return the total elapsed time of the timer in nanoseconds, not counting the time spent while paused.
+        """
+        total_ns = self._total_ns
+        if not self.paused:
+            total_ns += monotonic_ns() - self._last_start_ns
+        return total_ns
+
     def seconds(self):
         """
         Return the total elapsed time of the timer, not counting the time spent while paused.
         """
-        timedelta = self._total_time
-        if not self.paused:
-            timedelta +=  datetime.datetime.now() - self._last_start
-        return timedelta.seconds + timedelta.microseconds / 1000000.0
+        return self.nanoseconds() / 1e9
+
+    def microseconds(self):
+        """
+        Return the total elapsed time of the timer in whole microseconds, not counting the time spent while paused.
+        (Recorded timestamps have microsecond resolution.  See EventRecorder.)
+        """
+        return (self.nanoseconds() + 500) // 1000
 
     def sleep_until(self, seconds):
+        """
+        Sleep until the timer reads the given number of seconds.
+        The deadline is absolute, so errors don't accumulate over many calls.
+        """
         assert not self.paused
-        remaining = seconds - self.seconds()
-        if remaining > 0:
-            sleep( remaining )
+        deadline_ns = self._last_start_ns - self._total_ns + int(seconds * 1e9)
+        sleep_until_ns( deadline_ns, self.SpinThreshold )
 
 def timed(func):
     """
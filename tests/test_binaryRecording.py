@@ -0,0 +1,109 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+import unittest
+
+try:
+    import PyQt4
+except ImportError:
+    PyQt4 = None
+
+@unittest.skipIf(PyQt4 is None, "PyQt4 is not installed")
+class TestBinaryRecording(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _records(self, timestamps):
+        from PyQt4.QtCore import QEvent
+        from eventcapture.eventSerializers import EventKinds
+        records = [ (EventKinds.Comment, 0, (), "a comment", "comment", None) ]
+        for i, timestamp in enumerate(timestamps):
+            # args: (x, y, rel_x, rel_y, button, buttons, modifiers)
+            records.append( (EventKinds.Mouse, int(QEvent.MouseMove), (i, 2*i, i, 2*i, 0, 0, 0), None, "MainWindow.button", timestamp) )
+        return records
+
+    def _round_trip(self, records):
+        """Write the records as a script, convert it to binary and back, and return both scripts."""
+        from eventcapture.eventSerializers import write_playback_script
+        from eventcapture.binaryRecording import script_to_binary, binary_to_script
+        script_path = os.path.join(self.tmpdir, 'recording.py')
+        binary_path = os.path.join(self.tmpdir, 'recording.ecrec')
+        converted_path = os.path.join(self.tmpdir, 'converted.py')
+        with open(script_path, 'w') as f:
+            write_playback_script( f, "tester", "2016-01-01 00:00:00", records )
+        script_to_binary( script_path, binary_path )
+        binary_to_script( binary_path, converted_path )
+        with open(script_path) as f:
+            original = f.read()
+        with open(converted_path) as f:
+            converted = f.read()
+        return original, converted
+
+    def test_microsecond_timestamps(self):
+        original, converted = self._round_trip( self._records( [0.0, 0.000001, 1.5, 12.345678, 3600.000001] ) )
+        self.assertEqual( original, converted )
+
+    def test_sub_microsecond_timestamps(self):
+        original, converted = self._round_trip( self._records( [0.0000001, 1.2345678912, 12.3456789123, 2.5] ) )
+        self.assertEqual( original, converted )
+
+    def test_exact_timestamps(self):
+        from eventcapture.binaryRecording import write_binary_recording, BinaryRecording
+        timestamps = [ 0.1 + 0.2, 1.0/3, 1e-9, 2.5, 1000.000000001 ]
+        records = self._records( timestamps )
+        path = os.path.join(self.tmpdir, 'recording.ecrec')
+        with open(path, 'wb') as f:
+            write_binary_recording( f, records, "tester", "2016-01-01 00:00:00" )
+        recording = BinaryRecording(path)
+        self.assertEqual( [ record[5] for record in recording ], [None] + timestamps )
+        self.assertEqual( recording[3][5], timestamps[2] )
+
+    def test_indexing(self):
+        from eventcapture.binaryRecording import write_binary_recording, BinaryRecording
+        records = self._records( [ 0.5 * i for i in range(100) ] )
+        path = os.path.join(self.tmpdir, 'recording.ecrec')
+        with open(path, 'wb') as f:
+            write_binary_recording( f, records, "tester", "2016-01-01 00:00:00" )
+        recording = BinaryRecording(path)
+        n = len(records)
+        self.assertEqual( len(recording), n )
+        self.assertEqual( recording[n-1][5], records[n-1][5] )
+        self.assertEqual( recording[-1][5], records[-1][5] )
+        self.assertEqual( recording[-n][3], records[0][3] )
+        for i in (n, n+1, -n-1):
+            self.assertRaises( IndexError, lambda: recording[i] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,71 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import time
+import threading
+import unittest
+
+try:
+    import PyQt4
+except ImportError:
+    PyQt4 = None
+
+@unittest.skipIf(PyQt4 is None, "PyQt4 is not installed")
+class TestEventPlayerBreakpoints(unittest.TestCase):
+
+    def _wait_for(self, condition, timeout=5.0):
+        deadline = time.time() + timeout
+        while not condition():
+            self.assertTrue( time.time() < deadline, "Timed out" )
+            time.sleep(0.001)
+
+    def test_breakpoint_and_resume(self):
+        from eventcapture.eventPlayer import EventPlayer
+        from eventcapture.eventSerializers import EventKinds
+        comments = []
+        player = EventPlayer( comment_display=comments.append )
+        records = [ (EventKinds.Comment, 0, (), text, "comment", None) for text in ("first", "Click OK", "last") ]
+
+        thread = threading.Thread( target=player.play_records, args=(records,), kwargs={ 'breakpoints' : [1] } )
+        thread.daemon = True
+        thread.start()
+
+        self._wait_for( lambda: any( c.startswith("PLAYBACK PAUSED") for c in comments ) )
+        self.assertTrue( player.paused )
+        self.assertTrue( thread.is_alive() )
+        self.assertTrue( "Click OK" not in comments )
+
+        player.resume()
+        thread.join(5.0)
+        self.assertFalse( thread.is_alive() )
+        self.assertFalse( player.paused )
+        self.assertEqual( comments[-3:], ["Click OK", "last", "SCRIPT COMPLETE"] )
+        self.assertTrue( comments.index("PLAYBACK RESUMED", comments.index("BREAKPOINT AT EVENT 1")) < comments.index("Click OK") )
+
+if __name__ == "__main__":
+    unittest.main()
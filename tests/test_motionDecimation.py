@@ -0,0 +1,131 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import unittest
+
+try:
+    import PyQt4
+except ImportError:
+    PyQt4 = None
+
+@unittest.skipIf(PyQt4 is None, "PyQt4 is not installed")
+class TestSimplifyPath(unittest.TestCase):
+
+    def test_short_paths(self):
+        from eventcapture.motionDecimation import simplify_path
+        self.assertEqual( simplify_path([], 1.0), [] )
+        self.assertEqual( simplify_path([(0,0)], 1.0), [0] )
+        self.assertEqual( simplify_path([(0,0), (5,5)], 1.0), [0, 1] )
+
+    def test_collinear(self):
+        from eventcapture.motionDecimation import simplify_path
+        points = [ (x, 2*x) for x in range(100) ]
+        self.assertEqual( simplify_path(points, 0.5), [0, 99] )
+
+    def test_corner(self):
+        from eventcapture.motionDecimation import simplify_path
+        points = [ (x, 0) for x in range(50) ] + [ (49, y) for y in range(1, 50) ]
+        self.assertEqual( simplify_path(points, 1.0), [0, 49, 98] )
+
+    def test_tolerance(self):
+        from eventcapture.motionDecimation import simplify_path
+        points = [ (0,0), (5,1), (10,0) ]
+        self.assertEqual( simplify_path(points, 2.0), [0, 2] )
+        self.assertEqual( simplify_path(points, 0.5), [0, 1, 2] )
+
+    def test_closed_loop(self):
+        from eventcapture.motionDecimation import simplify_path
+        points = [ (0,0), (10,0), (10,10), (0,10), (0,0) ]
+        self.assertEqual( simplify_path(points, 1.0), [0, 1, 2, 3, 4] )
+
+@unittest.skipIf(PyQt4 is None, "PyQt4 is not installed")
+class TestMotionDecimator(unittest.TestCase):
+
+    def _decimate(self, points, tolerance, max_rate, interval=0.01, buttons=1):
+        from PyQt4.QtCore import QEvent
+        from eventcapture.motionDecimation import MotionDecimator
+        from eventcapture.eventSerializers import EventKinds
+        sink = []
+        class Sink(object):
+            def append(self, *record):
+                sink.append(record)
+            def append_comment(self, comment, *args):
+                sink.append( (EventKinds.Comment, 0, (), comment, "comment", None) )
+        decimator = MotionDecimator( Sink(), tolerance, max_rate )
+        for i, (x, y) in enumerate(points):
+            # args: (x, y, rel_x, rel_y, button, buttons, modifiers)
+            decimator.append( EventKinds.Mouse, int(QEvent.MouseMove), (x, y, x, y, 0, buttons, 0), None, "MainWindow", i*interval )
+        decimator.flush()
+        return decimator, sink
+
+    def test_collinear_moves(self):
+        points = [ (x, 0) for x in range(100) ]
+        decimator, sink = self._decimate( points, 2.0, None )
+        self.assertEqual( len(sink), 2 )
+        # A max rate never adds moves back.
+        for max_rate in (10, 1000):
+            decimator, sink = self._decimate( points, 2.0, max_rate )
+            self.assertEqual( len(sink), 2 )
+            self.assertEqual( (decimator.kept, decimator.dropped), (2, 98) )
+
+    def test_corner_survives_rate_limit(self):
+        points = [ (x, 0) for x in range(50) ] + [ (49, y) for y in range(1, 50) ]
+        decimator, sink = self._decimate( points, 1.0, 10 )
+        self.assertEqual( [ record[2][:2] for record in sink ], [ (0,0), (49,0), (49,49) ] )
+
+    def test_rate_limit_caps_survivors(self):
+        # A zigzag: every point is a turning point.
+        points = [ (x, 10*(x % 2)) for x in range(100) ]
+        decimator, sink = self._decimate( points, 1.0, None )
+        self.assertEqual( len(sink), 100 )
+        decimator, sink = self._decimate( points, 1.0, 10 )
+        timestamps = [ record[5] for record in sink ]
+        # 1 second of moves at 10 per second (plus the endpoints)
+        self.assertTrue( len(sink) <= 12 )
+        self.assertEqual( (timestamps[0], timestamps[-1]), (0.0, 0.99) )
+        for t1, t2 in zip(timestamps[1:-2], timestamps[2:-1]):
+            self.assertTrue( t2 - t1 >= 0.1 - 1e-9 )
+
+    def test_rate_limit_without_tolerance(self):
+        points = [ (x, 0) for x in range(100) ]
+        decimator, sink = self._decimate( points, None, 10 )
+        self.assertTrue( 2 < len(sink) <= 12 )
+
+    def test_other_events_end_runs(self):
+        from PyQt4.QtCore import QEvent
+        from eventcapture.eventSerializers import EventKinds
+        decimator, sink = self._decimate( [ (x, 0) for x in range(10) ], 2.0, None )
+        decimator.append( EventKinds.Mouse, int(QEvent.MouseButtonRelease), (9, 0, 9, 0, 1, 0, 0), None, "MainWindow", 0.1 )
+        for x in range(10, 20):
+            decimator.append( EventKinds.Mouse, int(QEvent.MouseMove), (x, 0, x, 0, 0, 0, 0), None, "MainWindow", x*0.01 )
+        decimator.append_comment( "done" )
+        self.assertEqual( [ record[2][0] for record in sink[:-1] ], [0, 9, 9, 10, 19] )
+        self.assertEqual( sink[-1][3], "done" )
+
+if __name__ == "__main__":
+    unittest.main()
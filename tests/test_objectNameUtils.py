@@ -0,0 +1,72 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import unittest
+
+try:
+    import PyQt4
+except ImportError:
+    PyQt4 = None
+
+@unittest.skipIf(PyQt4 is None, "PyQt4 is not installed")
+class TestChildIndexAllocator(unittest.TestCase):
+
+    def _allocator(self, indexes):
+        from PyQt4.QtCore import QObject
+        from eventcapture.objectNameUtils import _ChildIndexAllocator
+        siblings = []
+        for index in indexes:
+            sibling = QObject()
+            if index is not None:
+                sibling.setProperty( 'unique_child_index', index )
+            siblings.append( sibling )
+        return _ChildIndexAllocator( siblings )
+
+    def test_counts_up(self):
+        allocator = self._allocator( [] )
+        self.assertEqual( [ allocator.allocate() for _ in range(3) ], [0, 1, 2] )
+
+    def test_reuses_smallest_free_index(self):
+        allocator = self._allocator( [] )
+        for _ in range(4):
+            allocator.allocate()
+        self.assertTrue( allocator.release(2) )
+        self.assertTrue( allocator.release(0) )
+        self.assertEqual( [ allocator.allocate() for _ in range(3) ], [0, 2, 4] )
+
+    def test_seeded_from_siblings(self):
+        # Same choices as a scan of the siblings: the gaps first, then above the largest index.
+        allocator = self._allocator( [3, None, 1] )
+        self.assertEqual( [ allocator.allocate() for _ in range(4) ], [0, 2, 4, 5] )
+
+    def test_release_unknown_index(self):
+        allocator = self._allocator( [0] )
+        self.assertFalse( allocator.release(7) )
+        self.assertEqual( allocator.allocate(), 1 )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,88 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+import os
+import shutil
+import tempfile
+import unittest
+from xml.etree import ElementTree
+
+from eventcapture.playbackRunner import PlaybackRunner, RecordingJob, write_junit_report
+
+class TestAttemptStatus(unittest.TestCase):
+
+    def setUp(self):
+        self.runner = PlaybackRunner( 'true', use_xvfb=False )
+
+    def test_passed(self):
+        self.assertEqual( self.runner._attempt_status('exited', 0, 'passed'), ('passed', None) )
+        # The app didn't quit on its own, so it was terminated after playback finished.
+        self.assertEqual( self.runner._attempt_status('killed', -15, 'passed'), ('passed', None) )
+
+    def test_failed(self):
+        self.assertEqual( self.runner._attempt_status('exited', 1, 'failed')[0], 'failed' )
+        self.assertEqual( self.runner._attempt_status('exited', 1, 'passed')[0], 'failed' )
+        self.assertEqual( self.runner._attempt_status('exited', 2, None)[0], 'failed' )
+
+    def test_errors(self):
+        self.assertEqual( self.runner._attempt_status('timeout', -15, None)[0], 'timeout' )
+        self.assertEqual( self.runner._attempt_status('timeout', -15, 'passed')[0], 'timeout' )
+        self.assertEqual( self.runner._attempt_status('exited', 1, 'error')[0], 'error' )
+        self.assertEqual( self.runner._attempt_status('exited', -11, None)[0], 'error' )
+        self.assertEqual( self.runner._attempt_status('exited', -11, 'passed')[0], 'error' )
+        self.assertEqual( self.runner._attempt_status('exited', 0, None)[0], 'error' )
+
+class TestJUnitReport(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def test_failures_and_errors(self):
+        jobs = []
+        for name, status in [('a', 'passed'), ('b', 'failed'), ('c', 'timeout'), ('d', 'error')]:
+            job = RecordingJob( name + '.py', 1.0 )
+            job.status = status
+            job.attempts = 1
+            jobs.append( job )
+        path = os.path.join( self.tmpdir, 'report.xml' )
+        write_junit_report( jobs, path )
+
+        suite = ElementTree.parse(path).getroot()
+        self.assertEqual( suite.get('failures'), '1' )
+        self.assertEqual( suite.get('errors'), '2' )
+        cases = dict( (case.get('name'), case) for case in suite.findall('testcase') )
+        self.assertIsNone( cases['a'].find('failure') )
+        self.assertIsNone( cases['a'].find('error') )
+        self.assertIsNotNone( cases['b'].find('failure') )
+        self.assertIsNotNone( cases['c'].find('error') )
+        self.assertIsNotNone( cases['d'].find('error') )
+
+if __name__ == "__main__":
+    unittest.main()
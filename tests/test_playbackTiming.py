@@ -0,0 +1,78 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+try:
+    import PyQt4
+except ImportError:
+    PyQt4 = None
+
+@unittest.skipIf(PyQt4 is None, "PyQt4 is not installed")
+class TestPlaybackTimingLog(unittest.TestCase):
+
+    def _fill(self, log, n):
+        from PyQt4.QtCore import QEvent
+        for i in range(n):
+            receiver = "MainWindow.button_{}".format( i % 3 )
+            log.record( int(QEvent.MouseMove), receiver, i*0.01, i*0.01 + 0.002, 0.001*(i % 3 + 1), 0.0, 0.004 )
+
+    def test_summary_without_rows(self):
+        from eventcapture.playbackTiming import PlaybackTimingLog
+        log = PlaybackTimingLog( keep_rows=False )
+        self._fill(log, 300)
+        self.assertEqual( len(log), 300 )
+        self.assertEqual( log.rows, [] )
+        summary = log.summary()
+        self.assertEqual( summary['overall']['flush']['count'], 300 )
+        self.assertAlmostEqual( summary['overall']['flush']['mean'], 0.004 )
+        self.assertTrue( 0.004 <= summary['overall']['flush']['p95'] <= 0.004 * 1.125 )
+        self.assertEqual( sorted(summary['by_receiver']), [ "MainWindow.button_{}".format(i) for i in range(3) ] )
+        self.assertEqual( log.worst_receivers('lookup', 1)[0][0], "MainWindow.button_2" )
+
+    def test_dump(self):
+        from eventcapture.playbackTiming import PlaybackTimingLog
+        log = PlaybackTimingLog()
+        self._fill(log, 10)
+        tmpdir = tempfile.mkdtemp()
+        try:
+            path = os.path.join(tmpdir, 'timing.json')
+            log.dump(path)
+            with open(path) as f:
+                report = json.load(f)
+            self.assertEqual( len(report['events']), 10 )
+            self.assertEqual( report['summary']['overall']['lookup']['count'], 10 )
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    unittest.main()
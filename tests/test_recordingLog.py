@@ -0,0 +1,132 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import shutil
+import tempfile
+import threading
+import unittest
+
+try:
+    import PyQt4
+except ImportError:
+    PyQt4 = None
+
+@unittest.skipIf(PyQt4 is None, "PyQt4 is not installed")
+class TestRecordingLog(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.mkdtemp()
+        self.log_path = os.path.join(self.tmpdir, 'recording.log')
+
+    def tearDown(self):
+        shutil.rmtree(self.tmpdir)
+
+    def _records(self, n):
+        from PyQt4.QtCore import QEvent
+        from eventcapture.eventSerializers import EventKinds
+        # args: (x, y, rel_x, rel_y, button, buttons, modifiers)
+        return [ (EventKinds.Mouse, int(QEvent.MouseMove), (i, i, i, i, 0, 0, 0), None, "MainWindow.button", i*0.01)
+                 for i in range(n) ]
+
+    def test_round_trip(self):
+        from eventcapture.recordingLog import RecordingLogWriter
+        writer = RecordingLogWriter(self.log_path)
+        records = self._records(10)
+        for record in records:
+            writer.append(*record)
+        writer.append_comment("a comment")
+        self.assertEqual( list(writer)[:10], records )
+        writer.close()
+        self.assertEqual( list(writer)[10][3], "a comment" )
+
+    def test_no_file_until_first_record(self):
+        from eventcapture.recordingLog import RecordingLogWriter
+        writer = RecordingLogWriter(self.log_path)
+        self.assertEqual( list(writer), [] )
+        writer.close()
+        self.assertFalse( os.path.exists(self.log_path) )
+
+    def test_unserializable_record(self):
+        from PyQt4.QtCore import QEvent
+        from eventcapture.eventSerializers import EventKinds
+        from eventcapture.recordingLog import RecordingLogWriter, RecordingLogError
+        writer = RecordingLogWriter(self.log_path)
+        records = self._records(3)
+        writer.append(*records[0])
+        # Not valid UTF-8, so it can't be serialized as JSON
+        writer.append( EventKinds.Key, int(QEvent.KeyPress), (0, 0, 0), '\xe9', "MainWindow", 0.5 )
+        writer.append(*records[1])
+
+        # flush() must report the error instead of hanging.
+        errors = []
+        def flush():
+            try:
+                writer.flush()
+            except RecordingLogError as ex:
+                errors.append(ex)
+        thread = threading.Thread(target=flush)
+        thread.daemon = True
+        thread.start()
+        thread.join(10.0)
+        self.assertFalse( thread.is_alive(), "flush() hung" )
+        self.assertEqual( len(errors), 1 )
+
+        # The writer keeps going, and the error is only reported once.
+        writer.append(*records[2])
+        self.assertEqual( list(writer), records )
+        writer.delete_on_close = True
+        writer.close()
+        self.assertTrue( os.path.exists(self.log_path) )
+
+    def test_truncated_log_recovery(self):
+        from eventcapture.recordingLog import RecordingLogWriter, read_recording_log, convert_log_to_script
+        from eventcapture.scriptParser import parse_playback_script
+        writer = RecordingLogWriter(self.log_path)
+        records = self._records(5)
+        for record in records:
+            writer.append(*record)
+        writer.close()
+
+        # Simulate a crash in the middle of writing the last record.
+        with open(self.log_path, 'r') as f:
+            data = f.read()
+        with open(self.log_path, 'w') as f:
+            f.write( data[:-10] )
+
+        self.assertEqual( list(read_recording_log(self.log_path)), records[:4] )
+
+        script_path = os.path.join(self.tmpdir, 'recovered.py')
+        convert_log_to_script( self.log_path, script_path, "tester" )
+        metadata, recovered = parse_playback_script(script_path)
+        self.assertEqual( metadata['author_name'], "tester" )
+        self.assertEqual( [ (r[0], r[1], r[2][:2], r[4], r[5]) for r in recovered ],
+                          [ (r[0], r[1], r[2][:2], r[4], r[5]) for r in records[:4] ] )
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,85 @@
+# Copyright (c) 2016, HHMI
+# All rights reserved.
+#
+# Redistribution and use in source and binary forms, with or without modification,
+# are permitted provided that the following conditions are met:
+#
+#   1. Redistributions of source code must retain the above copyright notice, this
+#      list of conditions and the following disclaimer.
+#
+#   2. Redistributions in binary form must reproduce the above copyright notice,
+#      this list of conditions and the following disclaimer in the documentation
+#      and/or other materials provided with the distribution.
+#
+#   3. Neither the name of the copyright holder nor the names of its contributors
+#      may be used to endorse or promote products derived from this software
+#      without specific prior written permission.
+#
+# THIS SOFTWARE IS PROVIDED BY THE COPYRIGHT HOLDERS AND CONTRIBUTORS "AS IS" AND
+# ANY EXPRESS OR IMPLIED WARRANTIES, INCLUDING, BUT NOT LIMITED TO, THE IMPLIED
+# WARRANTIES OF MERCHANTABILITY AND FITNESS FOR A PARTICULAR PURPOSE ARE DISCLAIMED.
+# IN NO EVENT SHALL THE COPYRIGHT HOLDER OR CONTRIBUTORS BE LIABLE FOR ANY DIRECT,
+# INDIRECT, INCIDENTAL, SPECIAL, EXEMPLARY, OR CONSEQUENTIAL DAMAGES (INCLUDING, BUT
+# NOT LIMITED TO, PROCUREMENT OF SUBSTITUTE GOODS OR SERVICES; LOSS OF USE, DATA, OR
+# PROFITS; OR BUSINESS INTERRUPTION) HOWEVER CAUSED AND ON ANY THEORY OF LIABILITY,
+# WHETHER IN CONTRACT, STRICT LIABILITY, OR TORT (INCLUDING NEGLIGENCE OR OTHERWISE)
+# ARISING IN ANY WAY OUT OF THE USE OF THIS SOFTWARE, EVEN IF ADVISED OF THE
+# POSSIBILITY OF SUCH DAMAGE.
+
+import os
+import time
+import shutil
+import tempfile
+import unittest
+
+from eventcapture.timer import Timer
+
+try:
+    import PyQt4
+except ImportError:
+    PyQt4 = None
+
+class TestTimer(unittest.TestCase):
+
+    def test_microseconds(self):
+        timer = Timer()
+        self.assertEqual( timer.microseconds(), 0 )
+        with timer:
+            time.sleep(0.01)
+        self.assertTrue( isinstance(timer.microseconds(), (int, long)) )
+        self.assertEqual( timer.microseconds(), (timer.nanoseconds() + 500) // 1000 )
+        self.assertTrue( timer.microseconds() >= 10000 )
+
+    @unittest.skipIf(PyQt4 is None, "PyQt4 is not installed")
+    def test_recorded_timestamps_round_trip(self):
+        """Timestamps taken the way EventRecorder takes them survive script -> binary -> script unchanged."""
+        from PyQt4.QtCore import QEvent
+        from eventcapture.eventSerializers import EventKinds, write_playback_script
+        from eventcapture.binaryRecording import script_to_binary, binary_to_script, BinaryRecording
+
+        timer = Timer()
+        timer.unpause()
+        records = []
+        for i in range(100):
+            timestamp = timer.microseconds() / 1e6
+            self.assertEqual( int(round(timestamp * 1e6)) / 1e6, timestamp )
+            records.append( (EventKinds.Mouse, int(QEvent.MouseMove), (i, i, i, i, 0, 0, 0), None, "MainWindow", timestamp) )
+            time.sleep(0.0001)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            script_path = os.path.join(tmpdir, 'recording.py')
+            binary_path = os.path.join(tmpdir, 'recording.ecrec')
+            converted_path = os.path.join(tmpdir, 'converted.py')
+            with open(script_path, 'w') as f:
+                write_playback_script( f, "tester", timer.start_time, records )
+            script_to_binary( script_path, binary_path )
+            binary_to_script( binary_path, converted_path )
+            self.assertEqual( [ record[5] for record in BinaryRecording(binary_path) ], [ record[5] for record in records ] )
+            with open(script_path) as f, open(converted_path) as g:
+                self.assertEqual( f.read(), g.read() )
+        finally:
+            shutil.rmtree(tmpdir)
+
+if __name__ == "__main__":
+    unittest.main()